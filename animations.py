@@ -0,0 +1,484 @@
+import asyncio
+import random
+
+from collections.abc import Callable, Hashable, Iterable, Sequence
+from dataclasses import dataclass, field
+from statistics import fmean
+from typing import Any
+
+from presets import LightBoardPreset
+from streaming import Transport
+
+# Hue lights interpolate between states on their own over `transitiontime`
+# (in 100ms steps), so a timeline only needs a keyframe wherever something
+# changes and the lights fill in the rest without any more commands
+
+
+@dataclass(slots=True)
+class Keyframe:
+    """State a light should start moving to at `at` seconds into a timeline,
+    reaching it `transition` seconds later"""
+    at: float
+    color: str | None = None  # hex color
+    brightness: int | None = None  # percentage (1-100)
+    transition: float = 0.0
+    on: bool | None = None
+
+
+@dataclass(slots=True)
+class Timeline:
+    """Keyframes for each light, played from the start (and optionally on
+    repeat) by an `Animator`"""
+    name: str
+    tracks: dict[Hashable, list[Keyframe]] = field(default_factory=dict)
+    loop: bool = False
+    # how long one play through takes; defaults to the end of the last
+    # transition
+    length: float | None = None
+
+    @property
+    def duration(self) -> float:
+        """How long one play through takes"""
+        if self.length is not None:
+            return self.length
+        return max(
+            (k.at + k.transition for track in self.tracks.values()
+             for k in track),
+            default=0.0,
+        )
+
+
+@dataclass(slots=True)
+class Frame:
+    """Light states to send together at `at` seconds into a timeline"""
+    at: float
+    states: dict[Any, dict[str, Any]]
+
+
+@dataclass(slots=True)
+class AnimationStats:
+    """How playback of a timeline went"""
+    frames: int = 0  # frames played
+    sent: int = 0  # light states sent
+    planned_drops: int = 0  # frames merged away to stay within the budget
+    late_drops: int = 0  # frames skipped because playback fell behind
+    # how late each frame was sent, in seconds
+    jitter: list[float] = field(default_factory=list)
+
+    @property
+    def dropped(self) -> int:
+        return self.planned_drops + self.late_drops
+
+    def summary(self) -> dict[str, float]:
+        jitter = sorted(self.jitter)
+        return {
+            'frames': self.frames,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'planned_drops': self.planned_drops,
+            'late_drops': self.late_drops,
+            'jitter_mean_ms': fmean(jitter) * 1000 if jitter else 0.0,
+            'jitter_p95_ms': (
+                jitter[int(len(jitter) * 0.95)] * 1000 if jitter else 0.0
+            ),
+            'jitter_max_ms': jitter[-1] * 1000 if jitter else 0.0,
+        }
+
+
+def plan(
+    timeline: Timeline,
+    to_state: Callable[[Any, Keyframe], dict[str, Any]],
+    budget: float,
+    burst: int | None = None,
+) -> tuple[list[Frame], int]:
+    """Turn a timeline's keyframes into frames of light states sent at no
+    more than `budget` commands per second on average (one per light per
+    frame)
+
+    Commands are paced like a token bucket holding up to `burst` commands
+    (one per light by default, so a frame can always set every light at
+    once). The bucket starts full, so any one second can see up to `burst`
+    commands more than `budget`. A frame that doesn't fit is held back and
+    sent on its own as soon as the budget allows, or if the light's next
+    keyframe comes first, merged into it (like the write queue does), so
+    the lights always end up in the right state. Looping timelines are
+    planned as they'd play on repeat. Returns the frames and the number of
+    frames merged into later ones.
+    """
+    moments: dict[float, dict[Any, dict[str, Any]]] = {}
+    for light, track in timeline.tracks.items():
+        for key in track:
+            moments.setdefault(round(key.at, 3), {})[light] = to_state(
+                light, key
+            )
+    burst = burst or max(len(timeline.tracks), 1)
+    interval = 1 / budget
+
+    def run(
+        tokens: float,
+        carry: dict[Any, dict[str, Any]],
+        end: float,
+    ) -> tuple[list[Frame], int, float, dict[Any, dict[str, Any]], float]:
+        frames: list[Frame] = []
+        dropped = 0
+        last = 0.0
+        for at in [*sorted(moments), end]:
+            if carry:
+                # held back states go out once there's budget for them, if
+                # that's before anything else happens
+                ready = last + max(len(carry) - tokens, 0) * interval
+                if ready < at:
+                    tokens = min(burst, tokens + (ready - last) * budget)
+                    tokens -= len(carry)
+                    last = ready
+                    frames.append(Frame(round(ready, 3), carry))
+                    carry = {}
+            if at == end:
+                break
+            tokens = min(burst, tokens + (at - last) * budget)
+            last = at
+            if carry.keys() & moments[at].keys():
+                dropped += 1  # a held back state is replaced by this one
+            states = {
+                light: {**carry.pop(light, {}), **state}
+                for light, state in moments[at].items()
+            }
+            if tokens + 1e-9 < len(states):
+                # not enough budget left; hold these back
+                carry.update(states)
+                continue
+            tokens -= len(states)
+            frames.append(Frame(at, states))
+        return frames, dropped, tokens, carry, last
+
+    if not timeline.loop:
+        frames, dropped, *_ = run(burst, {}, float('inf'))
+        return frames, dropped
+    # play through once to see how much budget is left over (and what's
+    # still waiting to be sent) when the timeline comes back around
+    duration = timeline.duration or interval
+    _, _, tokens, carry, last = run(burst, {}, duration)
+    frames, dropped, *_ = run(
+        min(burst, tokens + (duration - last) * budget), carry, duration
+    )
+    return frames, dropped
+
+
+def sample(
+    timeline: Timeline,
+    to_state: Callable[[Any, Keyframe], dict[str, Any]],
+    rate: float,
+) -> list[Frame]:
+    """Interpolate a timeline's transitions into frames `rate` times a
+    second, for streaming (where the lights don't interpolate on their own)
+
+    Every frame sets every light that has started playing.
+    """
+    segments = {
+        light: _segments(
+            [(key.at, key.transition, to_state(light, key))
+             for key in sorted(track, key=lambda key: key.at)],
+            timeline,
+        )
+        for light, track in timeline.tracks.items()
+    }
+    frames = []
+    step = 1 / rate
+    count = max(round(timeline.duration * rate), 1)
+    # a looping timeline's end is the next loop's start, so leave it out
+    for i in range(count if timeline.loop else count + 1):
+        at = round(i * step, 3)
+        states = {
+            light: state
+            for light, track in segments.items()
+            if (state := _state_at(track, at))
+        }
+        frames.append(Frame(at, states))
+    return frames
+
+
+class Animator:
+    """Plays timelines on a light controller's lights, one at a time
+
+    Each frame is planned ahead of time to fit `budget` commands per second
+    (the controller's write rate by default) and sent with the controller's
+    `apply`, so unchanged states are still skipped, and what is sent counts
+    against the controller's write queue: writes queued meanwhile (e.g.
+    from the light cards) wait for room rather than going over the write
+    rate. Frames that can't be sent on time because the bridge is slow are
+    skipped rather than piling up.
+
+    Given a `transport` to open, the lights are streamed to instead (at
+    `stream_rate` frames per second) while animations play, if the
+    controller can stream.
+    """
+    def __init__(
+        self,
+        controller: Any,
+        budget: float | None = None,
+        max_lateness: float = 0.25,
+        transport: Callable[[], Transport] | None = None,
+        stream_rate: float = 25.0,
+    ) -> None:
+        self.controller = controller
+        self.budget = budget or controller.queue.rate
+        self.max_lateness = max_lateness
+        self.transport = transport
+        self.stream_rate = stream_rate
+        self.timeline: Timeline | None = None
+        self.stats = AnimationStats()
+        self._task: asyncio.Task | None = None
+        # so one animation stopping the stream and the next starting it
+        # don't overlap
+        self._streaming = asyncio.Lock()
+
+    @property
+    def playing(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, timeline: Timeline) -> asyncio.Task:
+        """Stop whatever's playing and start playing `timeline`"""
+        self.stop()
+        self.timeline = timeline
+        self.stats = AnimationStats()
+        self._task = asyncio.create_task(self.play(timeline, self.stats))
+        return self._task
+
+    def stop(self) -> None:
+        """Stop playback, leaving the lights as they are"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def to_state(self, light: Any, key: Keyframe) -> dict[str, Any]:
+        """Hue state body for a keyframe"""
+        attrs: dict[str, Any] = {'transitiontime': round(key.transition * 10)}
+        if key.on is not None:
+            attrs['on'] = key.on
+        return self.controller.to_state(
+            key.color, key.brightness, light=light, **attrs
+        )
+
+    async def play(
+        self,
+        timeline: Timeline,
+        stats: AnimationStats | None = None,
+    ) -> AnimationStats:
+        """Play a timeline through (forever, if it loops), returning how it
+        went"""
+        stats = stats if stats is not None else AnimationStats()
+        streams = self.transport is not None and hasattr(
+            self.controller, 'start_streaming'
+        )
+        try:
+            if streams:
+                async with self._streaming:
+                    if not self.controller.streaming:
+                        # (which falls back to requests if it can't)
+                        await self.controller.start_streaming(
+                            self.transport(), self.stream_rate  # type: ignore
+                        )
+            return await self._play(timeline, stats)
+        finally:
+            # the stream is kept for the next animation, if one's started
+            if streams and not self._replaced():
+                async with self._streaming:
+                    await self.controller.stop_streaming()
+
+    def _replaced(self) -> bool:
+        """Whether another animation has started since this one"""
+        return self.playing and self._task is not asyncio.current_task()
+
+    async def _play(
+        self,
+        timeline: Timeline,
+        stats: AnimationStats,
+    ) -> AnimationStats:
+        if (stream := getattr(self.controller, 'stream', None)) is not None:
+            # frames are cheap, so send every step of every transition
+            frames = sample(timeline, self.to_state, stream.rate)
+        else:
+            frames, stats.planned_drops = plan(
+                timeline, self.to_state, self.budget
+            )
+        if not frames:
+            return stats
+        loop = asyncio.get_running_loop()
+        duration = max(timeline.duration, frames[-1].at)
+        start = loop.time()
+        carry: dict[Any, dict[str, Any]] = {}
+        while True:
+            for i, frame in enumerate(frames):
+                if (delay := start + frame.at - loop.time()) > 0:
+                    await asyncio.sleep(delay)
+                lateness = loop.time() - start - frame.at
+                states = {
+                    light: {**carry.pop(light, {}), **state}
+                    for light, state in frame.states.items()
+                }
+                if lateness > self.max_lateness and i < len(frames) - 1:
+                    # fell behind; catch up by merging into the next frame
+                    carry.update(states)
+                    stats.late_drops += 1
+                    continue
+                stats.jitter.append(max(lateness, 0.0))
+                stats.frames += 1
+                stats.sent += len(states)
+                await self._send(states)
+            if not timeline.loop:
+                return stats
+            start += duration
+
+    async def _send(self, states: dict[Any, dict[str, Any]]) -> None:
+        if asyncio.iscoroutinefunction(self.controller.apply):
+            await self.controller.apply(states)
+        else:  # blocking (phue) controller
+            await asyncio.to_thread(self.controller.apply, states)
+
+
+def crossfade(
+    lights: Sequence[Any],
+    presets: Iterable[LightBoardPreset],
+    hold: float = 5.0,
+    duration: float = 2.0,
+    loop: bool = True,
+) -> Timeline:
+    """Fade through a series of presets, holding each for `hold` seconds"""
+    presets = list(presets)
+    # the last preset is held too, before fading back to the first
+    timeline = Timeline(
+        'Preset cycle', loop=loop, length=len(presets) * (hold + duration)
+    )
+    for i, preset in enumerate(presets):
+        for light in lights:
+            if (setting := preset.lights.get(light.light_id)) is None:
+                continue
+            timeline.tracks.setdefault(light, []).append(Keyframe(
+                i * (hold + duration),
+                setting.color,
+                setting.brightness,
+                duration,
+            ))
+    return timeline
+
+
+def candle(
+    lights: Sequence[Any],
+    color: str = '#FF8A1C',
+    brightness: int = 60,
+    length: float = 30.0,
+    seed: int | None = None,
+) -> Timeline:
+    """Slow, uneven glow of a candle flame"""
+    rng = random.Random(seed)
+    timeline = Timeline('Candle', loop=True, length=length)
+    for light in lights:
+        track = timeline.tracks.setdefault(light, [])
+        at = rng.uniform(0.0, 0.3)  # so the lights don't move in lockstep
+        while at < length:
+            step = rng.uniform(0.3, 0.9)
+            level = brightness + rng.gauss(0, brightness * 0.15)
+            track.append(Keyframe(round(at, 2), color, _level(level), step))
+            at += step
+    return timeline
+
+
+def flicker(
+    lights: Sequence[Any],
+    colors: Sequence[str] = ('#FFB46B',),
+    brightness: int = 80,
+    length: float = 20.0,
+    seed: int | None = None,
+) -> Timeline:
+    """Failing torch or faulty magic lantern: steady light with sudden dips"""
+    rng = random.Random(seed)
+    timeline = Timeline('Flicker', loop=True, length=length)
+    for i, light in enumerate(lights):
+        color = colors[i % len(colors)]
+        track = timeline.tracks.setdefault(light, [])
+        track.append(Keyframe(0.0, color, brightness, 0.2))
+        at = rng.uniform(0.5, 2.0)
+        while at < length:
+            track.append(Keyframe(
+                round(at, 2), color, _level(brightness * rng.uniform(0.1, 0.5))
+            ))
+            back = at + rng.uniform(0.1, 0.3)
+            track.append(Keyframe(round(back, 2), color, brightness, 0.1))
+            at = back + rng.expovariate(1 / 1.5)
+    return timeline
+
+
+def lightning(
+    lights: Sequence[Any],
+    color: str = '#2B3A67',
+    brightness: int = 15,
+    flash: str = '#E8EEFF',
+    length: float = 30.0,
+    seed: int | None = None,
+) -> Timeline:
+    """Dim storm light broken up by bright double flashes"""
+    rng = random.Random(seed)
+    timeline = Timeline('Lightning', loop=True, length=length)
+    tracks = [timeline.tracks.setdefault(light, []) for light in lights]
+    for track in tracks:
+        track.append(Keyframe(0.0, color, brightness, 1.0))
+    at = rng.uniform(2.0, 5.0)
+    while at < length - 1.0:
+        # strike every light at once, but vary how hard it hits each one
+        for track in tracks:
+            track.append(Keyframe(round(at, 2), flash, 100))
+            track.append(Keyframe(
+                round(at + 0.2, 2), color, _level(rng.uniform(20, 40))
+            ))
+            track.append(Keyframe(round(at + 0.4, 2), flash, 90))
+            track.append(Keyframe(round(at + 0.6, 2), color, brightness, 1.5))
+        at += rng.uniform(4.0, 12.0)
+    return timeline
+
+
+_Segment = tuple[float, float, dict[str, Any], dict[str, Any]]
+
+
+def _segments(
+    keys: list[tuple[float, float, dict[str, Any]]],
+    timeline: Timeline,
+) -> list[_Segment]:
+    """(start, transition, from state, to state) of each keyframe"""
+    def build(state: dict[str, Any]) -> list[_Segment]:
+        segments = []
+        for at, transition, target in keys:
+            if segments:
+                state = _state_at(segments, at)
+            segments.append((at, transition, state, target))
+        return segments
+
+    segments = build({})
+    if timeline.loop and segments:
+        # the first transition starts from where the last loop ended
+        segments = build(_state_at(segments, timeline.duration))
+    return segments
+
+
+def _state_at(segments: list[_Segment], at: float) -> dict[str, Any]:
+    state: dict[str, Any] = {}
+    for start, transition, before, after in segments:
+        if start > at:
+            break
+        done = min((at - start) / transition, 1.0) if transition else 1.0
+        state = {**before, **after}
+        for key in ('xy', 'bri'):
+            if key in before and key in after:
+                state[key] = _lerp(before[key], after[key], done)
+    state.pop('transitiontime', None)
+    return state
+
+
+def _lerp(a: Any, b: Any, t: float) -> Any:
+    if isinstance(a, (tuple, list)):
+        return tuple(x + (y - x) * t for x, y in zip(a, b))
+    return round(a + (b - a) * t)
+
+
+def _level(value: float) -> int:
+    # Hue lights don't go below brightness 1
+    return min(max(round(value), 1), 100)
@@ -0,0 +1,118 @@
+import json
+
+from contextlib import suppress
+from typing import Any
+
+from fastapi import APIRouter, Body, HTTPException, WebSocket
+from fastapi import WebSocketDisconnect
+
+from control import ANIMATIONS, RigControl
+from scenes import THEMES
+
+# JSON control of the lights for other tools (a soundboard, a VTT macro...),
+# served by the app itself at /api:
+#
+#   GET    /api/lights               every light and its state
+#   PUT    /api/lights/{id}          {"on": true, "color": "#FF8A1C",
+#                                     "brightness": 40} (any of them)
+#   GET    /api/presets              preset names
+#   POST   /api/presets/{name}       apply a preset
+#   GET    /api/scenes               random scene themes
+#   POST   /api/scenes/{theme}       apply a random scene in a theme
+#   POST   /api/animations/{name}    loop an animation
+#   DELETE /api/animations           stop the animation
+#   POST   /api/reset                reset the lights to warm white
+#   POST   /api/batch                a list of operations (see
+#                                    RigControl.run), carried out in order
+#   WS     /api/ws                   an operation or list of operations per
+#                                    message, answered with its result(s)
+#
+# Everything goes through RigControl, like the UI, so light writes are
+# queued and merged the same way and every open window shows the changes.
+
+
+def api_router(control: RigControl) -> APIRouter:
+    router = APIRouter(prefix='/api', tags=['api'])
+
+    async def run(operation: dict[str, Any]) -> dict[str, Any]:
+        """Carry out an operation, answering 400 if it's invalid"""
+        result = await control.run(operation)
+        if not result['ok']:
+            raise HTTPException(400, result['error'])
+        return result
+
+    @router.get('/lights')
+    def lights() -> dict[str, Any]:
+        return {'lights': control.state()}
+
+    @router.put('/lights/{light_id}')
+    async def set_light(
+        light_id: int,
+        state: dict[str, Any] = Body(...),
+    ) -> dict[str, Any]:
+        return await run({**state, 'op': 'set', 'light': light_id})
+
+    @router.get('/presets')
+    def presets() -> dict[str, Any]:
+        return {'presets': [preset.name for preset in control.presets]}
+
+    @router.post('/presets/{name}')
+    async def apply_preset(name: str) -> dict[str, Any]:
+        return await run({'op': 'preset', 'name': name})
+
+    @router.get('/scenes')
+    def scenes() -> dict[str, Any]:
+        return {'themes': list(THEMES)}
+
+    @router.post('/scenes/{theme}')
+    async def roll_scene(theme: str) -> dict[str, Any]:
+        return await run({'op': 'scene', 'theme': theme})
+
+    @router.get('/animations')
+    def animations() -> dict[str, Any]:
+        timeline = control.animator.timeline
+        return {
+            'animations': list(ANIMATIONS),
+            'playing': (
+                timeline.name if timeline and control.animator.playing
+                else None
+            ),
+        }
+
+    @router.post('/animations/{name}')
+    async def play(name: str) -> dict[str, Any]:
+        return await run({'op': 'animate', 'name': name})
+
+    @router.delete('/animations')
+    async def stop() -> dict[str, Any]:
+        return await run({'op': 'stop'})
+
+    @router.post('/reset')
+    async def reset() -> dict[str, Any]:
+        return await run({'op': 'reset'})
+
+    @router.post('/batch')
+    async def batch(operations: list[Any] = Body(...)) -> dict[str, Any]:
+        return {'results': await control.run_batch(operations)}
+
+    @router.websocket('/ws')
+    async def socket(websocket: WebSocket) -> None:
+        await websocket.accept()
+        with suppress(WebSocketDisconnect):
+            while True:
+                message = await websocket.receive_text()
+                try:
+                    request = json.loads(message)
+                except ValueError:
+                    await websocket.send_json(
+                        {'ok': False, 'error': 'Messages must be JSON'}
+                    )
+                    continue
+                if isinstance(request, list):
+                    await websocket.send_json(
+                        {'results': await control.run_batch(request)}
+                    )
+                else:
+                    await websocket.send_json(await control.run(request))
+
+    return router
@@ -0,0 +1,500 @@
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+
+from contextlib import contextmanager
+from pathlib import Path
+from statistics import fmean, median
+from time import monotonic, sleep
+from typing import Any, Iterable, Iterator, TextIO
+
+import httpx
+
+from animations import Animator, candle, flicker, lightning
+from config import LightConfig
+from fakebridge import FakeBridge
+from lights import AsyncLightController
+
+# Traces are NDJSON files of UI events, one per line, each with the time
+# (in seconds from the start of the trace) it happened at:
+#
+#   {"t": 0.016, "type": "brightness", "light": 1, "value": 40}
+#   {"t": 0.250, "type": "color", "light": 2, "value": "#FF8A1C"}
+#   {"t": 0.900, "type": "on", "light": 1, "value": false}
+#   {"t": 1.200, "type": "preset", "name": "Tavern",
+#    "lights": {"1": {"color": "#FF8A1C", "brightness": 60}}}
+#   {"t": 2.000, "type": "animation", "name": "candle", "seconds": 10}
+#   {"t": 9.500, "type": "stop"}
+#
+# An animation plays for `seconds` if given, otherwise until the next
+# animation, "stop" event or the end of the trace.
+#
+# Run the app with EVERLIGHT_TRACE=<file> set to record one.
+
+ANIMATIONS = {'candle': candle, 'flicker': flicker, 'lightning': lightning}
+
+APP_DIR = Path(__file__).resolve().parent
+
+
+class TraceRecorder:
+    """Appends UI events to a trace file as they happen"""
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._file: TextIO = open(path, 'a', encoding='utf-8')
+        self._start = monotonic()
+
+    def record(self, kind: str, **data: Any) -> None:
+        event = {'t': round(monotonic() - self._start, 4), 'type': kind}
+        self._file.write(json.dumps({**event, **data}) + '\n')
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def read_trace(path: Path) -> list[dict[str, Any]]:
+    with open(path, encoding='utf-8') as file:
+        events = [json.loads(line) for line in file if line.strip()]
+    return sorted(events, key=lambda event: event['t'])
+
+
+def slider_drag(
+    light_ids: Iterable[int],
+    seconds: float = 3.0,
+    rate: float = 60.0,
+) -> list[dict[str, Any]]:
+    """Brightness sliders dragged back and forth, sending `rate` events per
+    second (about what a browser sends while dragging)"""
+    events = []
+    for light_id in light_ids:
+        for i in range(int(seconds * rate)):
+            t = i / rate
+            value = round(50 + 50 * math.sin(t * math.pi))
+            events.append({
+                't': t, 'type': 'brightness', 'light': light_id,
+                'value': value,
+            })
+    return sorted(events, key=lambda event: event['t'])
+
+
+def color_drag(
+    light_ids: Iterable[int],
+    seconds: float = 3.0,
+    rate: float = 30.0,
+    seed: int = 0,
+) -> list[dict[str, Any]]:
+    """Colors picked as fast as the color picker allows"""
+    rng = random.Random(seed)
+    events = [
+        {
+            't': i / rate, 'type': 'color', 'light': light_id,
+            'value': f'#{rng.randrange(1 << 24):06X}',
+        }
+        for light_id in light_ids
+        for i in range(int(seconds * rate))
+    ]
+    return sorted(events, key=lambda event: event['t'])
+
+
+def preset_storm(
+    light_ids: Iterable[int],
+    count: int = 30,
+    interval: float = 0.1,
+    seed: int = 0,
+) -> list[dict[str, Any]]:
+    """Presets applied in quick succession (a player mashing Apply)"""
+    rng = random.Random(seed)
+    light_ids = list(light_ids)
+    # a handful of presets, reused like a real preset library would be
+    presets = [
+        {
+            str(light_id): {
+                'color': f'#{rng.randrange(1 << 24):06X}',
+                'brightness': rng.randrange(1, 101),
+            }
+            for light_id in light_ids
+        }
+        for _ in range(max(count // 3, 1))
+    ]
+    picks = [rng.randrange(len(presets)) for _ in range(count)]
+    return [
+        {
+            't': i * interval, 'type': 'preset', 'name': f'Preset {n}',
+            'lights': presets[n],
+        }
+        for i, n in enumerate(picks)
+    ]
+
+
+def animation_playback(
+    name: str = 'candle',
+    seconds: float = 10.0,
+) -> list[dict[str, Any]]:
+    return [{'t': 0.0, 'type': 'animation', 'name': name, 'seconds': seconds}]
+
+
+SCENARIOS = {
+    'slider': lambda ids: slider_drag(ids),
+    'color': lambda ids: color_drag(ids),
+    'presets': lambda ids: preset_storm(ids),
+    'animation': lambda ids: animation_playback(),
+}
+
+
+async def replay(
+    controller: AsyncLightController,
+    events: list[dict[str, Any]],
+    sample_interval: float = 0.01,
+) -> dict[str, Any]:
+    """Play UI events through the controller at the times they happened,
+    the way the UI would call it, sampling the write queue's depth as it
+    goes
+
+    Returns the events that were played with the (monotonic) time they were
+    played at, the queue depth samples and the animation stats.
+    """
+    played: list[tuple[float, dict[str, Any]]] = []
+    depths: list[int] = []
+    animator = Animator(controller)
+    animations: list[dict[str, Any]] = []
+    tasks = []
+    errors = 0
+
+    async def sample() -> None:
+        while True:
+            depths.append(controller.queue.depth)
+            await asyncio.sleep(sample_interval)
+
+    async def run(coroutine: Any) -> None:
+        nonlocal errors
+        try:
+            await coroutine
+        except ConnectionError:
+            errors += 1
+
+    def stop_animation() -> None:
+        if animator.timeline is not None and animator.playing:
+            animations.append(
+                {'name': animator.timeline.name} | animator.stats.summary()
+            )
+        animator.stop()
+
+    async def stop_after(seconds: float, timeline: Any) -> None:
+        await asyncio.sleep(seconds)
+        if animator.timeline is timeline:
+            stop_animation()
+
+    sampler = asyncio.create_task(sample())
+    start = monotonic()
+    for event in events:
+        if (delay := start + event['t'] - monotonic()) > 0:
+            await asyncio.sleep(delay)
+        played.append((monotonic(), event))
+        light = controller.lights.get(event.get('light'))  # type: ignore
+        kind = event['type']
+        if kind == 'brightness':
+            controller.set_brightness(light, event['value'])
+        elif kind == 'color':
+            controller.set_color(light, event['value'])
+        elif kind == 'on':
+            tasks.append(asyncio.create_task(
+                run(controller.set_state(light, on=event['value']))
+            ))
+        elif kind == 'preset':
+            states = {
+                controller.lights[int(light_id)]: controller.to_state(
+                    setting['color'],
+                    setting['brightness'],
+                    light=controller.lights[int(light_id)],
+                )
+                for light_id, setting in event['lights'].items()
+                if int(light_id) in controller.lights
+            }
+            tasks.append(asyncio.create_task(
+                run(controller.apply_scene(states, name=event.get('name', '')))
+            ))
+        elif kind == 'animation' and event['name'] in ANIMATIONS:
+            stop_animation()
+            animator.start(
+                ANIMATIONS[event['name']](list(controller.lights.values()))
+            )
+            if 'seconds' in event:
+                tasks.append(asyncio.create_task(
+                    stop_after(event['seconds'], animator.timeline)
+                ))
+        elif kind == 'stop':
+            stop_animation()
+    await asyncio.gather(*tasks)
+    stop_animation()
+    # let the queue drain at its own pace
+    while controller.queue.depth:
+        await asyncio.sleep(sample_interval)
+    await asyncio.sleep(0.1)
+    sampler.cancel()
+    return {
+        'played': played,
+        'depths': depths,
+        'animations': animations,
+        'errors': errors,
+    }
+
+
+def report(
+    bridge: FakeBridge,
+    controller: AsyncLightController,
+    result: dict[str, Any],
+) -> dict[str, Any]:
+    """Summarize a replay: requests the bridge saw, how long each event took
+    to reach the lights, and how deep the write queue got
+
+    An event's latency is the time from the UI event until the bridge
+    applied a write carrying that attribute to that light, so events that
+    were coalesced into a later write count the wait for that write.
+    """
+    latencies = []
+    unmatched = 0
+    writes = sorted(bridge.writes, key=lambda write: write.at)
+    for at, event in result['played']:
+        for light_id, key in _expected(event):
+            landed = next(
+                (
+                    write.at for write in writes
+                    if write.at >= at and write.light_id == light_id
+                    and key in write.state
+                ),
+                None,
+            )
+            if landed is None:
+                unmatched += 1  # skipped (nothing changed) or lost
+            else:
+                latencies.append(landed - at)
+    latencies.sort()
+    depths = result['depths'] or [0]
+    return {
+        'events': len(result['played']),
+        'requests': dict(bridge.requests),
+        'responses': dict(bridge.responses),
+        'max_in_flight': bridge.max_in_flight,
+        'state_writes': len(writes),
+        'latency_ms': {
+            f'p{p}': round(_percentile(latencies, p) * 1000, 1)
+            for p in (50, 90, 99)
+        } | {'max': round(latencies[-1] * 1000, 1) if latencies else 0.0},
+        'unmatched_events': unmatched,
+        'errors': result['errors'],
+        'queue': controller.queue.stats() | {
+            'max_depth': max(depths),
+            'mean_depth': round(fmean(depths), 2),
+        },
+        'skipped_writes': controller.mirror.skipped,
+        'animations': result['animations'],
+    }
+
+
+async def benchmark(
+    events: list[dict[str, Any]],
+    lights: int = 2,
+    **bridge_options: Any,
+) -> dict[str, Any]:
+    """Replay events against a fresh fake bridge and report how it went"""
+    with FakeBridge(lights=lights, **bridge_options) as bridge:
+        controller = AsyncLightController(
+            bridge.address,
+            [LightConfig(light_id) for light_id in range(1, lights + 1)],
+            username=bridge.username,
+        )
+        await controller.connect()
+        bridge.reset_stats()
+        try:
+            result = await replay(controller, events)
+            return report(bridge, controller, result)
+        finally:
+            await controller.close()
+
+
+def import_times() -> dict[str, Any]:
+    """Time a cold `import main` in a fresh interpreter, in total and for
+    each module it imports directly (from `python -X importtime`)"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        cwd=APP_DIR, capture_output=True, text=True, check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        # import time: <self us> | <cumulative us> | <indented name>
+        if not line.startswith('import time:') or line.count('|') != 2:
+            continue
+        cumulative, name = line.split('|')[1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1 and cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative) / 1000
+    total = modules.pop('main', 0.0)
+    slowest = sorted(modules.items(), key=lambda item: -item[1])[:8]
+    return {
+        'import_ms': round(total, 1),
+        'imports_ms': {name: round(ms, 1) for name, ms in slowest},
+    }
+
+
+@contextmanager
+def running_app(
+    lights: int = 2,
+    **bridge_options: Any,
+) -> Iterator[tuple[FakeBridge, int, float]]:
+    """Launch the app (as a plain web server, see main.py) against a fresh
+    fake bridge, yielding the bridge, the port the app is served on and the
+    (monotonic) time it was launched; the app is stopped on exit"""
+    with (
+        FakeBridge(lights=lights, **bridge_options) as bridge,
+        tempfile.TemporaryDirectory() as home,
+    ):
+        config = Path(home) / 'lights.json'
+        config.write_text(json.dumps({
+            'bridge': bridge.address,
+            'lights': [{'id': i} for i in range(1, lights + 1)],
+        }))
+        # the bridge username, where the controller looks for it
+        (Path(home) / '.python_hue').write_text(
+            json.dumps({bridge.address: {'username': bridge.username}})
+        )
+        with socket.socket() as free:
+            free.bind(('127.0.0.1', 0))
+            port = free.getsockname()[1]
+        start = monotonic()
+        app = subprocess.Popen(
+            [sys.executable, 'main.py'],
+            cwd=APP_DIR,
+            env=os.environ | {
+                'HOME': home,
+                'EVERLIGHT_CONFIG': str(config),
+                'EVERLIGHT_PORT': str(port),
+            },
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            yield bridge, port, start
+        finally:
+            app.terminate()
+            try:
+                app.wait(10)
+            except subprocess.TimeoutExpired:
+                app.kill()
+
+
+def startup(
+    lights: int = 2,
+    timeout: float = 30.0,
+    **bridge_options: Any,
+) -> dict[str, float]:
+    """Launch the app against a fake bridge and time, from launch, how long
+    until the page is first served and how long until the bridge has been
+    connected to"""
+    with running_app(lights, **bridge_options) as (bridge, port, start):
+        served = None
+        while served is None and monotonic() - start < timeout:
+            try:
+                httpx.get(f'http://127.0.0.1:{port}/', timeout=timeout)
+                served = monotonic()
+            except httpx.TransportError:
+                sleep(0.01)
+        while (
+            'GET lights' not in bridge.first_answered
+            and monotonic() - start < timeout
+        ):
+            sleep(0.01)
+        connected = bridge.first_answered.get('GET lights')
+    if served is None or connected is None:
+        raise TimeoutError('the app did not start in time')
+    return {
+        'first_paint_ms': round((served - start) * 1000, 1),
+        'connect_ms': round((connected - start) * 1000, 1),
+    }
+
+
+def _expected(event: dict[str, Any]) -> list[tuple[int, str]]:
+    """(light ID, state attribute) pairs an event should change"""
+    kind = event['type']
+    if kind in ('brightness', 'color', 'on'):
+        key = {'brightness': 'bri', 'color': 'xy', 'on': 'on'}[kind]
+        return [(event['light'], key)]
+    if kind == 'preset':
+        return [
+            (int(light_id), key)
+            for light_id in event['lights'] for key in ('xy', 'bri')
+        ]
+    return []
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    index = min(round(percent / 100 * (len(values) - 1)), len(values) - 1)
+    return values[index]
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(
+        description='Replay UI event traces against a fake Hue bridge'
+    )
+    parser.add_argument(
+        'traces', nargs='*', type=Path,
+        help='recorded trace files (default: the built-in scenarios)',
+    )
+    parser.add_argument(
+        '--scenario', choices=sorted(SCENARIOS), action='append',
+        help='built-in scenario to run (repeatable)',
+    )
+    parser.add_argument(
+        '--startup', action='store_true',
+        help='time a cold start of the app instead (import, connect and '
+        'first paint)',
+    )
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--lights', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.03)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--rate-limit', type=float, default=None)
+    parser.add_argument('--group-rate-limit', type=float, default=None)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.startup:
+        # medians over a few runs, each in a fresh process
+        imports = [import_times() for _ in range(args.runs)]
+        starts = [
+            startup(args.lights, latency=args.latency, jitter=args.jitter)
+            for _ in range(args.runs)
+        ]
+        print(json.dumps({
+            'import_ms': median(run['import_ms'] for run in imports),
+            'imports_ms': imports[-1]['imports_ms'],
+        } | {
+            key: median(run[key] for run in starts) for key in starts[0]
+        }, indent=2))
+        sys.exit()
+
+    light_ids = range(1, args.lights + 1)
+    runs = {str(path): read_trace(path) for path in args.traces}
+    for name in args.scenario or ([] if runs else SCENARIOS):
+        runs[name] = SCENARIOS[name](light_ids)
+    for name, events in runs.items():
+        print(f'== {name}')
+        print(json.dumps(asyncio.run(benchmark(
+            events,
+            lights=args.lights,
+            latency=args.latency,
+            jitter=args.jitter,
+            rate_limit=args.rate_limit,
+            group_rate_limit=args.group_rate_limit,
+            error_rate=args.error_rate,
+            seed=0,
+        )), indent=2))
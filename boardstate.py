@@ -0,0 +1,101 @@
+import asyncio
+
+from collections.abc import Callable
+from typing import Any
+
+import metrics
+
+# One copy of what the lights are set to (as far as the UI is concerned),
+# shared by every open window, so a change made on one device shows up on
+# all the others
+
+Watcher = Callable[[dict[str, Any]], Any]
+
+STATE_DIFFS = metrics.Counter(
+    'everlight_state_diffs_total',
+    'Light state changes pushed to the UI, by field',
+    ('field',),
+)
+
+
+class BoardState:
+    """State of each light shown in the UI: whether it's on, its color (a
+    hex color picked in the app, or '' if none) and its brightness (0-100)
+
+    Watchers (e.g. a light card in one browser) are called with only the
+    fields that changed since they last saw the light. Changes are
+    broadcast at most once every `interval` seconds, so dragging a slider
+    on one device sends the others its latest value rather than every step
+    on the way there.
+    """
+    FIELDS = ('on', 'color', 'brightness')
+
+    def __init__(self, interval: float = 0.05) -> None:
+        self.interval = interval
+        self.lights: dict[int, dict[str, Any]] = {}
+        # light ID -> watcher -> state of the light the watcher is showing
+        self._watchers: dict[int, dict[Watcher, dict[str, Any]]] = {}
+        self._dirty: set[int] = set()
+        self._broadcast: asyncio.TimerHandle | None = None
+
+    def get(self, light_id: int) -> dict[str, Any]:
+        """Current state of a light (empty if unknown)"""
+        return dict(self.lights.get(light_id, {}))
+
+    def update(
+        self,
+        light_id: int,
+        source: Watcher | None = None,
+        **changes: Any,
+    ) -> None:
+        """Change a light's state, as changed by `source` (which is already
+        showing the change, so isn't told about it)"""
+        changes = {
+            field: value for field, value in changes.items()
+            if field in self.FIELDS
+        }
+        self.lights.setdefault(light_id, {}).update(changes)
+        if (shown := self._watchers.get(light_id, {}).get(source)) is not None:
+            shown.update(changes)
+        self._dirty.add(light_id)
+        self._schedule()
+
+    def watch(self, light_id: int, watcher: Watcher) -> None:
+        """Call `watcher` with the changes to a light from now on (it should
+        already be showing the light's current state)"""
+        self._watchers.setdefault(light_id, {})[watcher] = self.get(light_id)
+
+    def unwatch(self, watcher: Watcher) -> None:
+        for watchers in self._watchers.values():
+            watchers.pop(watcher, None)
+
+    def flush(self) -> None:
+        """Send every watcher the changes it hasn't seen yet"""
+        if self._broadcast is not None:
+            self._broadcast.cancel()
+            self._broadcast = None
+        dirty, self._dirty = self._dirty, set()
+        for light_id in dirty:
+            state = self.lights.get(light_id, {})
+            watchers = self._watchers.get(light_id, {})
+            for watcher, shown in list(watchers.items()):
+                diff = {
+                    field: value for field, value in state.items()
+                    if field not in shown or shown[field] != value
+                }
+                if not diff:
+                    continue
+                shown.update(diff)
+                for field in diff:
+                    STATE_DIFFS.inc(field=field)
+                watcher(diff)
+
+    def _schedule(self) -> None:
+        if self._broadcast is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:  # not in the app (e.g. a script)
+            self.flush()
+            return
+        self._broadcast = loop.call_later(self.interval, self.flush)
@@ -0,0 +1,151 @@
+import colorsys
+
+from collections.abc import Iterable
+from functools import lru_cache
+from typing import Literal
+
+RGB = tuple[float, float, float]  # channels from 0-1
+XY = tuple[float, float]
+Gamut = Literal['A', 'B', 'C']
+
+# (red, green, blue) corners of each Hue color gamut in xy space
+GAMUTS: dict[str, tuple[XY, XY, XY]] = {
+    'A': ((0.704, 0.296), (0.2151, 0.7106), (0.138, 0.08)),
+    'B': ((0.675, 0.322), (0.409, 0.518), (0.167, 0.04)),
+    'C': ((0.6915, 0.3083), (0.17, 0.7), (0.1532, 0.0475)),
+}
+
+# sRGB gamma expansion for each 8-bit channel value
+_LINEAR = tuple(
+    v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+    for v in (i / 255 for i in range(256))
+)
+
+
+def hex_to_rgb(color: str) -> RGB:
+    color = color.lstrip('#')
+    r, g, b = (int(color[i:i+2], 16) / 255 for i in (0, 2, 4))
+    return r, g, b
+
+
+def rgb_to_hex(rgb: RGB) -> str:
+    return '#' + ''.join(f'{round(min(max(c, 0), 1) * 255):02X}' for c in rgb)
+
+
+def _to_linear(value: float) -> float:
+    if (level := round(value * 255)) == value * 255:  # an 8-bit value
+        return _LINEAR[level]
+    if value <= 0.04045:
+        return value / 12.92
+    return ((value + 0.055) / 1.055) ** 2.4
+
+
+def _from_linear(value: float) -> float:
+    if value <= 0.0031308:
+        return 12.92 * value
+    return 1.055 * value ** (1 / 2.4) - 0.055
+
+
+def rgb_to_xy(colors: Iterable[RGB], gamut: Gamut | None = None) -> list[XY]:
+    """Convert RGB colors to xy, clamped to `gamut` if given"""
+    points = []
+    for red, green, blue in colors:
+        red, green, blue = _to_linear(red), _to_linear(green), _to_linear(blue)
+        # wide gamut D65 conversion, as recommended by Philips
+        x = red * 0.649926 + green * 0.103455 + blue * 0.197109
+        y = red * 0.234327 + green * 0.743075 + blue * 0.022598
+        z = green * 0.053077 + blue * 1.035763
+        total = x + y + z
+        points.append((x / total, y / total) if total else (0.0, 0.0))
+    return clamp(points, gamut) if gamut else points
+
+
+def xy_to_rgb(points: Iterable[XY], gamut: Gamut | None = None) -> list[RGB]:
+    """Convert xy colors (at full brightness) to RGB, clamping them to
+    `gamut` first if given, for showing what a light will look like"""
+    if gamut:
+        points = clamp(points, gamut)
+    colors = []
+    for x, y in points:
+        if y <= 0:
+            colors.append((0.0, 0.0, 0.0))
+            continue
+        # XYZ with luminance Y = 1
+        big_x, big_z = x / y, (1 - x - y) / y
+        red = big_x * 1.656492 - 0.354851 - big_z * 0.255038
+        green = -big_x * 0.707196 + 1.655397 + big_z * 0.036152
+        blue = big_x * 0.051713 - 0.121364 + big_z * 1.011530
+        # scale down so no channel is out of range, keeping the hue
+        peak = max(red, green, blue, 1e-9)
+        colors.append(tuple(
+            _from_linear(max(c / peak, 0.0)) for c in (red, green, blue)
+        ))  # type: ignore
+    return colors
+
+
+def rgb_to_hue_sat(colors: Iterable[RGB]) -> list[tuple[int, int]]:
+    """Convert RGB colors to Hue hue (0-65535) and saturation (0-254)"""
+    return [
+        (round(h * 65535), round(s * 254))
+        for h, s, _ in (colorsys.rgb_to_hsv(*rgb) for rgb in colors)
+    ]
+
+
+def hue_sat_to_rgb(values: Iterable[tuple[int, int]]) -> list[RGB]:
+    """Convert Hue hue (0-65535) and saturation (0-254) to RGB colors (at
+    full brightness)"""
+    return [
+        colorsys.hsv_to_rgb(hue / 65535, sat / 254, 1.0)
+        for hue, sat in values
+    ]
+
+
+# (cached, as the same colors come up again and again: presets, random
+# scene palettes...)
+@lru_cache(maxsize=4096)
+def hex_to_xy(color: str, gamut: Gamut | None = None) -> XY:
+    """Convert a single hex color to xy, clamped to `gamut` if given"""
+    return rgb_to_xy([hex_to_rgb(color)], gamut)[0]
+
+
+def preview(color: str, gamut: Gamut | None) -> str:
+    """Hex color closest to what a light with `gamut` shows for `color`"""
+    if not gamut:
+        return color
+    return rgb_to_hex(xy_to_rgb([hex_to_xy(color, gamut)])[0])
+
+
+def clamp(points: Iterable[XY], gamut: Gamut) -> list[XY]:
+    """Move xy points outside the gamut triangle to the closest point on its
+    edge"""
+    red, green, blue = GAMUTS[gamut]
+    edges = ((red, green), (green, blue), (blue, red))
+    clamped = []
+    for point in points:
+        if _inside(point, red, green, blue):
+            clamped.append(point)
+            continue
+        closest = (_closest_on_edge(point, a, b) for a, b in edges)
+        clamped.append(min(closest, key=lambda p: _distance2(p, point)))
+    return clamped
+
+
+def _inside(point: XY, a: XY, b: XY, c: XY) -> bool:
+    def side(p: XY, q: XY, r: XY) -> float:
+        return (p[0] - r[0]) * (q[1] - r[1]) - (q[0] - r[0]) * (p[1] - r[1])
+    d1, d2, d3 = side(point, a, b), side(point, b, c), side(point, c, a)
+    negative = d1 < 0 or d2 < 0 or d3 < 0
+    positive = d1 > 0 or d2 > 0 or d3 > 0
+    return not (negative and positive)
+
+
+def _closest_on_edge(point: XY, a: XY, b: XY) -> XY:
+    ab = (b[0] - a[0], b[1] - a[1])
+    ap = (point[0] - a[0], point[1] - a[1])
+    t = (ap[0] * ab[0] + ap[1] * ab[1]) / (ab[0] ** 2 + ab[1] ** 2)
+    t = min(max(t, 0.0), 1.0)
+    return a[0] + ab[0] * t, a[1] + ab[1] * t
+
+
+def _distance2(p: XY, q: XY) -> float:
+    return (p[0] - q[0]) ** 2 + (p[1] - q[1]) ** 2
@@ -0,0 +1,199 @@
+import json
+import os
+
+from collections.abc import Mapping
+from dataclasses import dataclass
+from pathlib import Path
+
+# which bridge(s) to use and which of their lights the app controls (in the
+# order they're shown); edit this to add lights to the rig
+CONFIG_PATH = Path(__file__).resolve().parent / 'lights.json'
+
+
+@dataclass(frozen=True)
+class LightConfig:
+    """A light the app controls, by its ID on the bridge (or its name there,
+    until the bridge has been asked for its ID)"""
+    light_id: int | None
+    label: str = ''  # shown in the UI instead of the bridge's name
+    # with several bridges: the name of the one the light is on (the first
+    # bridge if not given), and the light's ID on it if that isn't light_id
+    # (light IDs have to be unique across the whole rig)
+    bridge: str = ''
+    bridge_light_id: int | None = None
+    name: str = ''  # the light's name on the bridge
+
+    @property
+    def local_id(self) -> int | None:
+        """ID of the light on its bridge"""
+        if self.bridge_light_id is None:
+            return self.light_id
+        return self.bridge_light_id
+
+
+@dataclass(frozen=True)
+class BridgeConfig:
+    """A bridge, by address and/or bridge ID; a bridge with no address is
+    found on the network (see discovery.py)"""
+    name: str = ''
+    address: str = ''
+    bridge_id: str = ''
+
+
+@dataclass(frozen=True)
+class StreamConfig:
+    """Where to stream animations to over the Entertainment API (see
+    streaming.py); the bridge itself only takes DTLS, so this is a DTLS
+    proxy in front of it (or a local stand-in)"""
+    host: str
+    port: int = 2100
+    rate: float = 25.0  # frames per second
+
+
+@dataclass(frozen=True)
+class Config:
+    bridges: tuple[BridgeConfig, ...] = (BridgeConfig(),)
+    # no lights means every light on the (first) bridge
+    lights: tuple[LightConfig, ...] = ()
+    # animations are sent as REST requests unless streamed
+    stream: StreamConfig | None = None
+
+    @property
+    def bridge_ip(self) -> str:
+        """Address of the first bridge"""
+        return self.bridges[0].address
+
+    @property
+    def light_ids(self) -> list[int]:
+        """IDs of the lights, leaving out any not looked up yet"""
+        return [
+            light.light_id for light in self.lights
+            if light.light_id is not None
+        ]
+
+    @property
+    def unresolved(self) -> bool:
+        """Whether any light is only known by name so far"""
+        return any(light.light_id is None for light in self.lights)
+
+    def lights_on(self, bridge: BridgeConfig) -> tuple[LightConfig, ...]:
+        """The configured lights on a bridge"""
+        first = bridge == self.bridges[0]
+        return tuple(
+            light for light in self.lights
+            if light.bridge == bridge.name or (first and not light.bridge)
+        )
+
+
+def load_config(path: Path = CONFIG_PATH) -> Config:
+    """Read the light config, raising ValueError if it's malformed
+
+    The bridge is either given by address ("bridge": "10.0.42.2"), or
+    several are listed by name ("bridges": [{"name": "tavern", "address":
+    "10.0.42.2"}, {"name": "annex", "id": "001788fffe23ab45"}]); with
+    neither, the bridge is found on the network.
+
+    A light is given by its ID ("id": 3) or, with a single bridge, by its
+    name on the bridge ("name": "Dining Room 1"), which is looked up when
+    connecting and then saved as its ID (see `save_light_ids`).
+
+    Animations are streamed to the lights of a single bridge rather than
+    sent as requests if given where to ("stream": {"address":
+    "127.0.0.1:2100", "rate": 25}).
+    """
+    try:
+        data = json.loads(path.read_text())
+        lights = tuple(
+            LightConfig(
+                int(light['id']) if 'id' in light else None,
+                str(light.get('label', '')),
+                str(light.get('bridge', '')),
+                int(light['light']) if 'light' in light else None,
+                str(light.get('name', '')),
+            )
+            for light in data.get('lights', [])
+        )
+        if 'bridges' in data:
+            bridges = tuple(
+                BridgeConfig(
+                    str(bridge['name']),
+                    str(bridge.get('address', '')),
+                    str(bridge.get('id', '')),
+                )
+                for bridge in data['bridges']
+            )
+        else:
+            bridges = (BridgeConfig(address=str(data.get('bridge', ''))),)
+        stream = None
+        if 'stream' in data:
+            host, _, port = str(data['stream']['address']).partition(':')
+            stream = StreamConfig(
+                host,
+                int(port) if port else StreamConfig.port,
+                float(data['stream'].get('rate', StreamConfig.rate)),
+            )
+        config = Config(bridges, lights, stream)
+    except (KeyError, TypeError, AttributeError, ValueError) as e:
+        raise ValueError(f'invalid light config {path}: {e!r}') from e
+    if not bridges:
+        raise ValueError(f'invalid light config {path}: no bridges')
+    if stream is not None and (not stream.host or stream.rate <= 0):
+        raise ValueError(
+            f'invalid light config {path}: a stream needs an address and a '
+            'positive rate'
+        )
+    if stream is not None and len(bridges) > 1:
+        raise ValueError(
+            f'invalid light config {path}: only a single bridge can stream'
+        )
+    for light in lights:
+        if light.light_id is None and not light.name:
+            raise ValueError(
+                f'invalid light config {path}: a light needs an ID or a name'
+            )
+        if light.light_id is None and (
+            len(bridges) > 1 or light.bridge_light_id is not None
+        ):
+            raise ValueError(
+                f'invalid light config {path}: light {light.name!r} needs '
+                'an ID (lights are only looked up by name with one bridge)'
+            )
+    if len(set(config.light_ids)) != len(config.light_ids):
+        raise ValueError(f'invalid light config {path}: duplicate light IDs')
+    names = [light.name for light in lights if light.light_id is None]
+    if len(set(names)) != len(names):
+        raise ValueError(f'invalid light config {path}: duplicate names')
+    bridge_names = {bridge.name for bridge in bridges}
+    if len(bridge_names) != len(bridges):
+        raise ValueError(f'invalid light config {path}: duplicate bridges')
+    if unknown := {light.bridge for light in lights} - bridge_names - {''}:
+        raise ValueError(
+            f'invalid light config {path}: unknown bridges {sorted(unknown)}'
+        )
+    for bridge in bridges:
+        local_ids = [
+            light.local_id for light in config.lights_on(bridge)
+            if light.local_id is not None
+        ]
+        if len(set(local_ids)) != len(local_ids):
+            raise ValueError(
+                f'invalid light config {path}: duplicate light IDs on '
+                f'bridge {bridge.name!r}'
+            )
+    return config
+
+
+def save_light_ids(path: Path, ids: Mapping[str, int]) -> None:
+    """Fill in the IDs (from `ids`, keyed by name) of the lights given by
+    name in the light config at `path`, so they aren't looked up again"""
+    data = json.loads(path.read_text())
+    data['lights'] = [
+        {'id': ids[light['name']], **light}
+        if 'id' not in light and light.get('name') in ids else light
+        for light in data.get('lights', [])
+    ]
+    # written next to the config and moved into place, so it's never left
+    # half written
+    temporary = path.with_name(path.name + '.tmp')
+    temporary.write_text(json.dumps(data, indent=4) + '\n')
+    os.replace(temporary, path)
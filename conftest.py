@@ -0,0 +1,14 @@
+from collections.abc import Iterator
+
+import pytest
+
+# (being at the top of the repo, this also puts the app's modules on the
+# path for the tests)
+from fakebridge import FakeBridge
+
+
+@pytest.fixture
+def bridge() -> Iterator[FakeBridge]:
+    """A running fake bridge with two lights"""
+    with FakeBridge(lights=2) as bridge:
+        yield bridge
@@ -0,0 +1,281 @@
+import re
+
+from typing import Any, Awaitable, Callable
+
+import colors
+import metrics
+from animations import (
+    Animator, Timeline, candle, crossfade, flicker, lightning,
+)
+from boardstate import BoardState
+from lights import AsyncLightController, MultiBridgeController
+from presets import LightBoardPreset, PresetStore
+from scenes import SceneGenerator
+
+# What the app can do to the lights, shared by the UI and the JSON API (see
+# api.py), so a change takes the same path to the bridge and shows up in
+# every window whichever one made it
+
+API_OPERATIONS = metrics.Histogram(
+    'everlight_api_operation_seconds',
+    'Time taken by API operations',
+    ('op',),
+)
+API_ERRORS = metrics.Counter(
+    'everlight_api_operation_errors_total',
+    'API operations that were invalid or failed',
+    ('op',),
+)
+
+ANIMATIONS = ('Candle', 'Flicker', 'Lightning', 'Preset Cycle')
+
+_hex_color = re.compile(r'#[0-9a-fA-F]{6}')
+
+
+class RigControl:
+    """Operations on the whole rig: changing a light, applying a preset or
+    a random scene, playing an animation and resetting the lights
+
+    Invalid requests (an unknown light or preset, a malformed color...)
+    raise ValueError with a message fit to show the user.
+    """
+    def __init__(
+        self,
+        controller: AsyncLightController | MultiBridgeController,
+        board: BoardState,
+        animator: Animator,
+        presets: PresetStore,
+        scenes: SceneGenerator | None = None,
+    ) -> None:
+        self.lc = controller
+        self.board = board
+        self.animator = animator
+        self.presets = presets
+        self.scenes = scenes or SceneGenerator()
+        # API operations by name, each taking the operation's JSON object
+        self._operations: dict[str, Callable[[dict], Awaitable[Any]]] = {
+            'set': self._set,
+            'preset': self._preset,
+            'scene': self._scene,
+            'animate': self._animate,
+            'stop': self._stop,
+            'reset': self._reset,
+        }
+
+    def sync_board(self) -> None:
+        """Update the board with the state the controller last set the lights
+        to (e.g. when first connected, or after resetting the lights)"""
+        for light_id, light in self.lc.lights.items():
+            self.board.update(
+                light_id,
+                on=self.lc.is_on(light),
+                color=self.lc.color_of(light) or '',
+                brightness=self.lc.brightness_of(light),
+            )
+
+    def state(self) -> list[dict[str, Any]]:
+        """Every light, with its state on the board"""
+        return [
+            {'id': light_id, 'name': light.label or light.name}
+            | self.board.get(light_id)
+            for light_id, light in self.lc.lights.items()
+        ]
+
+    def set_light(
+        self,
+        light_id: int,
+        on: bool | None = None,
+        color: str | None = None,
+        brightness: int | None = None,
+    ) -> None:
+        """Change a light, queuing the write like the light cards do (so
+        it's merged with anything else waiting to be sent to the light)"""
+        if (light := self.lc.lights.get(light_id)) is None:
+            raise ValueError(f'There is no light {light_id}')
+        if on is not None and not isinstance(on, bool):
+            raise ValueError('"on" must be true or false')
+        if color is not None and (
+            not isinstance(color, str) or not _hex_color.fullmatch(color)
+        ):
+            raise ValueError('"color" must be a hex color, like "#FF8A1C"')
+        if brightness is not None and (
+            not isinstance(brightness, int) or isinstance(brightness, bool)
+            or not 0 <= brightness <= 100
+        ):
+            raise ValueError('"brightness" must be a whole number, 0-100')
+        changes = {
+            field: value
+            for field, value in (
+                ('on', on), ('color', color), ('brightness', brightness)
+            )
+            if value is not None
+        }
+        if not changes:
+            raise ValueError('Give "on", "color" and/or "brightness"')
+        if color is not None:
+            self.lc.set_color(light, color)
+        if brightness is not None:
+            self.lc.set_brightness(light, brightness)
+        if on is not None:
+            self.lc.queue_state(light, on=on)
+        self.board.update(light_id, **changes)
+
+    def find_preset(self, name: Any) -> LightBoardPreset:
+        preset = self.presets.get(name) if isinstance(name, str) else None
+        if preset is None:
+            raise ValueError(f'There is no preset named {name!r}')
+        return preset
+
+    async def apply_preset(
+        self,
+        preset: LightBoardPreset,
+        queued: bool = False,
+    ) -> None:
+        """Set the lights to a preset (stopping any animation), in one go
+        (as a single group action if every light changes), or if `queued`
+        through the write queue like the light cards"""
+        self.animator.stop()
+        # only the lights in the preset (and still in the rig) change
+        settings = {
+            light_id: setting for light_id, setting in preset.lights.items()
+            if light_id in self.lc.lights
+        }
+        states = {
+            self.lc.lights[light_id]: self.lc.to_state(
+                setting.color, setting.brightness,
+                light=self.lc.lights[light_id],
+            )
+            for light_id, setting in settings.items()
+        }
+        if queued:
+            for light, state in states.items():
+                self.lc.queue_state(light, **state)
+        else:
+            await self.lc.apply_scene(states, name=preset.name or '')
+        for light_id, setting in settings.items():
+            self.lc.remember_color(self.lc.lights[light_id], setting.color)
+            self.board.update(
+                light_id, color=setting.color, brightness=setting.brightness
+            )
+
+    def gamuts(self) -> dict[int, colors.Gamut | None]:
+        """The color gamut of every light (None if unknown)"""
+        return {
+            light_id: self.lc.gamut_of(light)
+            for light_id, light in self.lc.lights.items()
+        }
+
+    async def roll_scene(self, theme: Any) -> LightBoardPreset:
+        """Set the lights to a random scene in a theme (one of
+        scenes.THEMES, in any case), returning the scene"""
+        scene = self.scenes.roll(theme, self.gamuts())
+        # (queued rather than stored on the bridge as a scene, since it's
+        # likely to be rolled again straight away)
+        await self.apply_preset(scene, queued=True)
+        return scene
+
+    def play(self, name: Any) -> Timeline:
+        """Start looping an animation (one of ANIMATIONS, in any case) on
+        every light"""
+        names = {animation.lower(): animation for animation in ANIMATIONS}
+        if (animation := names.get(str(name).lower())) is None:
+            raise ValueError(
+                f'There is no animation {name!r} (try one of '
+                f'{", ".join(ANIMATIONS)})'
+            )
+        lights = list(self.lc.lights.values())
+        if animation == 'Preset Cycle':
+            if not len(self.presets):
+                raise ValueError('There are no presets to cycle')
+            timeline = crossfade(lights, self.presets)
+        elif animation == 'Flicker':
+            # flicker whatever colors the lights are set to
+            timeline = flicker(lights, [
+                self.board.get(light_id).get('color') or '#FFB46B'
+                for light_id in self.lc.lights
+            ])
+        else:
+            timeline = {'Candle': candle, 'Lightning': lightning}[animation](
+                lights
+            )
+        self.animator.start(timeline)
+        return timeline
+
+    def stop(self) -> None:
+        """Stop the animation, leaving the lights as they are"""
+        self.animator.stop()
+
+    async def reset(self) -> None:
+        """Stop any animation and reset the lights to warm white"""
+        self.animator.stop()
+        await self.lc.reset_lights()
+        # (which also resets the color pickers, in every window)
+        self.sync_board()
+
+    async def run(self, operation: Any) -> dict[str, Any]:
+        """Carry out one API operation, e.g.
+
+            {"op": "set", "light": 1, "color": "#FF8A1C", "brightness": 40}
+            {"op": "preset", "name": "Tavern"}
+            {"op": "scene", "theme": "underdark"}
+            {"op": "animate", "name": "candle"}
+            {"op": "stop"}
+            {"op": "reset"}
+
+        returning {"ok": true}, or {"ok": false, "error": "..."} if it was
+        invalid, along with the operation's "id" if it had one
+        """
+        if not isinstance(operation, dict):
+            operation = {'op': None}
+        op = operation.get('op')
+        label = op if op in self._operations else 'unknown'
+        result: dict[str, Any] = {'ok': True}
+        if 'id' in operation:
+            result['id'] = operation['id']
+        try:
+            with API_OPERATIONS.time(op=label):
+                if op not in self._operations:
+                    raise ValueError(
+                        f'Unknown operation {op!r} (try one of '
+                        f'{", ".join(self._operations)})'
+                    )
+                await self._operations[op](operation)
+        except (ValueError, ConnectionError) as e:
+            API_ERRORS.inc(op=label)
+            result.update(ok=False, error=str(e))
+        return result
+
+    async def run_batch(self, operations: Any) -> list[dict[str, Any]]:
+        """Carry out several API operations in order, returning a result for
+        each; the writes they queue are sent together once they're done"""
+        if not isinstance(operations, list):
+            raise ValueError('A batch must be a list of operations')
+        with self.lc.queue.hold():
+            return [await self.run(operation) for operation in operations]
+
+    async def _set(self, operation: dict) -> None:
+        try:
+            light_id = int(operation['light'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('"light" must be a light ID') from None
+        self.set_light(
+            light_id,
+            on=operation.get('on'),
+            color=operation.get('color'),
+            brightness=operation.get('brightness'),
+        )
+
+    async def _preset(self, operation: dict) -> None:
+        await self.apply_preset(self.find_preset(operation.get('name')))
+
+    async def _scene(self, operation: dict) -> None:
+        await self.roll_scene(operation.get('theme'))
+
+    async def _animate(self, operation: dict) -> None:
+        self.play(operation.get('name'))
+
+    async def _stop(self, operation: dict) -> None:
+        self.stop()
+
+    async def _reset(self, operation: dict) -> None:
+        await self.reset()
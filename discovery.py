@@ -0,0 +1,194 @@
+import asyncio
+import json
+import socket
+import struct
+
+from contextlib import suppress
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+# Finding Hue bridges on the network, and the usernames (and client keys)
+# they gave the app, which are cached in the same file (and format) phue
+# uses, keyed by bridge address: {"<address>": {"username": ..., ...}}
+
+NUPNP_URL = 'https://discovery.meethue.com/'
+MDNS_GROUP = ('224.0.0.251', 5353)
+MDNS_SERVICE = '_hue._tcp.local'
+
+
+@dataclass(frozen=True)
+class BridgeInfo:
+    """A bridge that answered on the network"""
+    bridge_id: str  # lower case, e.g. '001788fffe23ab45'
+    address: str  # host or IP (and port, if not 80)
+    name: str = ''
+
+
+def credentials_path() -> Path:
+    return Path.home() / '.python_hue'
+
+
+def load_credentials() -> dict[str, dict[str, Any]]:
+    """Every cached bridge login, keyed by bridge address"""
+    with suppress(OSError, ValueError):
+        credentials = json.loads(credentials_path().read_text())
+        if isinstance(credentials, dict):
+            return credentials
+    return {}
+
+
+def find_credentials(
+    address: str = '',
+    bridge_id: str = '',
+) -> tuple[str, dict[str, Any]] | None:
+    """Cached login for a bridge, by address or else by bridge ID (for a
+    bridge that has moved), returning the address it was cached under too"""
+    credentials = load_credentials()
+    if address in credentials:
+        return address, credentials[address]
+    for cached, login in credentials.items():
+        if bridge_id and login.get('id') == bridge_id.lower():
+            return cached, login
+    return None
+
+
+def save_credentials(
+    address: str,
+    username: str,
+    clientkey: str | None = None,
+    bridge_id: str = '',
+) -> None:
+    """Cache a bridge login, keeping the logins for other bridges and
+    replacing any for the same bridge at an old address"""
+    credentials = {
+        cached: login for cached, login in load_credentials().items()
+        if not (bridge_id and login.get('id') == bridge_id.lower())
+    }
+    login: dict[str, Any] = {'username': username, 'clientkey': clientkey}
+    if bridge_id:
+        login['id'] = bridge_id.lower()
+    credentials[address] = login
+    with suppress(OSError):
+        credentials_path().write_text(json.dumps(credentials))
+
+
+async def discover(
+    timeout: float = 3.0,
+    nupnp_url: str | None = NUPNP_URL,
+    mdns: bool = True,
+) -> list[BridgeInfo]:
+    """Find the bridges on the network, by asking for them over mDNS and
+    the Hue discovery service (N-UPnP) at the same time
+
+    Candidates are confirmed by asking each for its (public) config, so
+    only bridges that actually answer are returned.
+    """
+    searches = []
+    if mdns:
+        searches.append(_mdns(timeout))
+    if nupnp_url:
+        searches.append(_nupnp(nupnp_url, timeout))
+    found = await asyncio.gather(*searches, return_exceptions=True)
+    addresses = {
+        address for result in found if isinstance(result, list)
+        for address in result
+    }
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        bridges = await asyncio.gather(
+            *(_identify(client, address) for address in sorted(addresses))
+        )
+    unique = {bridge.bridge_id: bridge for bridge in bridges if bridge}
+    return sorted(unique.values(), key=lambda bridge: bridge.bridge_id)
+
+
+async def find_bridge(
+    bridge_id: str = '',
+    timeout: float = 3.0,
+    **options: Any,
+) -> BridgeInfo:
+    """Find a bridge by ID (or any bridge, if no ID is given)
+
+    Bridges the app has logged in to before are tried first, so a known
+    bridge is found without a network-wide search. Raises ConnectionError
+    if no matching bridge answers.
+    """
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        known = await asyncio.gather(
+            *(_identify(client, address) for address in load_credentials())
+        )
+    for bridge in known:
+        if bridge and (not bridge_id or bridge.bridge_id == bridge_id.lower()):
+            return bridge
+    for bridge in await discover(timeout, **options):
+        if not bridge_id or bridge.bridge_id == bridge_id.lower():
+            return bridge
+    raise ConnectionError(
+        f'Hue bridge {bridge_id} not found' if bridge_id
+        else 'No Hue bridge found on the network'
+    )
+
+
+async def _identify(
+    client: httpx.AsyncClient,
+    address: str,
+) -> BridgeInfo | None:
+    """Ask a possible bridge who it is (bridges answer /api/config without a
+    username)"""
+    try:
+        response = await client.get(f'http://{address}/api/config')
+        config = response.json()
+        return BridgeInfo(
+            str(config['bridgeid']).lower(), address, config.get('name', '')
+        )
+    except (httpx.HTTPError, ValueError, KeyError, TypeError):
+        return None
+
+
+async def _nupnp(url: str, timeout: float) -> list[str]:
+    """Bridge addresses from the Hue discovery service"""
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        response = await client.get(url)
+    return [
+        str(bridge['internalipaddress'])
+        for bridge in response.json() if 'internalipaddress' in bridge
+    ]
+
+
+async def _mdns(timeout: float) -> list[str]:
+    """IP addresses of the hosts that answer an mDNS query for the Hue
+    service"""
+    loop = asyncio.get_running_loop()
+    addresses: set[str] = set()
+    service = b''.join(
+        bytes([len(label)]) + label.encode()
+        for label in MDNS_SERVICE.split('.')
+    ) + b'\x00'
+
+    class Listener(asyncio.DatagramProtocol):
+        def datagram_received(self, data: bytes, addr: tuple) -> None:
+            if len(data) < 12:  # not even a DNS header
+                return
+            flags, answers = struct.unpack_from('>2xH2xH', data)
+            # a response (not someone else's query) about the Hue service
+            if flags & 0x8000 and answers and service in data:
+                addresses.add(addr[0])
+
+    transport, _ = await loop.create_datagram_endpoint(
+        Listener, local_addr=('0.0.0.0', 0), family=socket.AF_INET
+    )
+    try:
+        # one PTR question, asking for unicast replies (to this socket)
+        query = struct.pack('>6H', 0, 0, 1, 0, 0, 0) + service
+        transport.sendto(query + struct.pack('>2H', 12, 0x8001), MDNS_GROUP)
+        await asyncio.sleep(timeout)
+    finally:
+        transport.close()
+    return sorted(addresses)
+
+
+if __name__ == '__main__':
+    for bridge in asyncio.run(discover()):
+        print(f'{bridge.name} ({bridge.bridge_id}) at {bridge.address}')
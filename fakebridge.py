@@ -0,0 +1,413 @@
+import json
+import random
+
+from collections import Counter
+from contextlib import suppress
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Any
+
+import colors
+
+# the attributes a light state write can set
+_STATE_KEYS = {
+    'on', 'bri', 'hue', 'sat', 'xy', 'ct', 'alert', 'effect', 'transitiontime'
+}
+
+
+@dataclass(frozen=True)
+class Write:
+    """A state change the fake bridge applied to one light"""
+    at: float  # monotonic time
+    light_id: int
+    state: dict[str, Any]
+    via: str  # 'light', 'group' or 'scene'
+
+
+class FakeBridge:
+    """Stand-in for a Hue bridge, serving the v1 REST API endpoints the app
+    uses (lights, groups, scenes and registration) over local HTTP
+
+    Every request can be slowed down by `latency` (plus up to `jitter`)
+    seconds, light and group writes are limited to `rate_limit` and
+    `group_rate_limit` per second (answering 429 when over), and a fraction
+    `error_rate` of requests fail with 503, so the controller can be
+    measured against a misbehaving bridge without the real one. Every state
+    change is recorded in `writes`.
+
+        with FakeBridge(lights=8, latency=0.05) as bridge:
+            lc = AsyncLightController(bridge.address, username=bridge.username)
+    """
+    def __init__(
+        self,
+        lights: int = 2,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_limit: float | None = None,
+        group_rate_limit: float | None = None,
+        error_rate: float = 0.0,
+        username: str = 'everlight',
+        seed: int | None = None,
+        name: str = 'Fake bridge',
+        bridge_id: str | None = None,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.group_rate_limit = group_rate_limit
+        self.error_rate = error_rate
+        self.username = username
+        self.name = name
+        self._random = random.Random(seed)
+        self.bridge_id = bridge_id or (
+            f'001788fffe{self._random.randrange(1 << 24):06x}'
+        )
+        self.lights: dict[str, dict[str, Any]] = {
+            str(i): {
+                'name': f'Light {i}',
+                'type': 'Extended color light',
+                'state': {
+                    'on': True, 'bri': 254, 'hue': 6929, 'sat': 129,
+                    'xy': [0.4578, 0.41], 'ct': 366, 'colormode': 'xy',
+                    'reachable': True,
+                },
+                'capabilities': {'control': {'colorgamuttype': 'C'}},
+            }
+            for i in range(1, lights + 1)
+        }
+        self.groups: dict[str, dict[str, Any]] = {}
+        self.scenes: dict[str, dict[str, Any]] = {}
+        # what happened, for benchmarks and tests
+        self.writes: list[Write] = []
+        self.requests: Counter[str] = Counter()  # by '<METHOD> <resource>'
+        self.responses: Counter[int] = Counter()  # by HTTP status
+        # monotonic time each kind of request was first answered
+        self.first_answered: dict[str, float] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = Lock()
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.bridge = self  # type: ignore
+        # (once stopped, connections kept alive are hung up on too)
+        self.stopped = False
+        self._thread: Thread | None = None
+
+    @property
+    def address(self) -> str:
+        """host:port to use as the controller's bridge IP"""
+        host, port = self._server.server_address[:2]
+        return f'{host}:{port}'
+
+    def start(self) -> 'FakeBridge':
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.stopped = True
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'FakeBridge':
+        return self.start()
+
+    def __exit__(self, *_: Any) -> None:
+        self.stop()
+
+    def public_config(self) -> dict[str, Any]:
+        """What the bridge tells anyone who asks (no username needed)"""
+        return {
+            'name': self.name,
+            'bridgeid': self.bridge_id.upper(),
+            'modelid': 'BSB002',
+            'apiversion': '1.50.0',
+        }
+
+    def reset_stats(self) -> None:
+        """Forget the requests and writes seen so far"""
+        with self._lock:
+            self.writes.clear()
+            self.requests.clear()
+            self.responses.clear()
+            self.first_answered.clear()
+            self.max_in_flight = self.in_flight
+
+    def handle(
+        self,
+        method: str,
+        path: str,
+        body: Any,
+    ) -> tuple[int, Any]:
+        """Answer a request, returning the HTTP status and JSON body"""
+        parts = path.strip('/').split('/')
+        kind = _resource(parts)
+        with self._lock:
+            self.requests[f'{method} {kind}'] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency or self.jitter:
+                sleep(self.latency + self._random.uniform(0, self.jitter))
+            with self._lock:
+                status, result = self._respond(method, parts, kind, body)
+                self.responses[status] += 1
+                self.first_answered.setdefault(f'{method} {kind}', monotonic())
+            return status, result
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _respond(
+        self,
+        method: str,
+        parts: list[str],
+        kind: str,
+        body: Any,
+    ) -> tuple[int, Any]:
+        if self.error_rate and self._random.random() < self.error_rate:
+            return 503, _error(503, '/'.join(parts), 'service unavailable')
+        if method != 'GET':
+            limit = (
+                self.group_rate_limit if kind == 'group action'
+                else self.rate_limit if kind == 'light state' else None
+            )
+            if limit and not self._take(kind, limit):
+                return 429, _error(429, '/'.join(parts), 'too many requests')
+        if parts == ['api'] and method == 'POST':
+            result = {'username': self.username}
+            if isinstance(body, dict) and body.get('generateclientkey'):
+                result['clientkey'] = '00' * 16
+            return 200, [{'success': result}]
+        if method == 'GET' and len(parts) in (2, 3) and parts[-1] == 'config':
+            return 200, self.public_config()
+        if len(parts) < 2 or parts[0] != 'api' or parts[1] != self.username:
+            return 200, _error(1, '/'.join(parts), 'unauthorized user')
+        address = '/' + '/'.join(parts[2:])
+        route = parts[2:]
+        if not route and method == 'GET':
+            return 200, {
+                'lights': self.lights, 'groups': self.groups,
+                'scenes': self.scenes, 'config': self.public_config(),
+            }
+        collection = {
+            'lights': self.lights, 'groups': self.groups,
+            'scenes': self.scenes,
+        }.get(route[0]) if route else None
+        if collection is None:
+            return 200, _error(3, address, 'resource not available')
+        if len(route) == 1:
+            if method == 'GET':
+                return 200, collection
+            if method == 'POST' and route[0] in ('groups', 'scenes'):
+                return 200, self._create(route[0], body)
+        elif route[1] not in collection and route[:2] != ['groups', '0']:
+            return 200, _error(3, address, 'resource not available')
+        elif len(route) == 2 and method == 'GET':
+            return 200, collection[route[1]]
+        elif len(route) == 2 and method == 'PUT' and route[0] == 'groups':
+            group = collection[route[1]]
+            group.update({k: v for k, v in body.items() if k != 'stream'})
+            if 'stream' in body:
+                group.setdefault('stream', {}).update(body['stream'])
+            return 200, _success(address, body)
+        elif route[2:] == ['state'] and route[0] == 'lights':
+            self._set_state(int(route[1]), body, 'light')
+            return 200, _success(address + '/', body)
+        elif route[2:] == ['action'] and route[0] == 'groups':
+            return 200, self._group_action(route[1], body, address)
+        return 200, _error(3, address, 'resource not available')
+
+    def _create(self, kind: str, body: Any) -> Any:
+        collection = self.groups if kind == 'groups' else self.scenes
+        new_id = str(len(collection) + 1)
+        if kind == 'groups':
+            collection[new_id] = {
+                'name': body.get('name', ''),
+                'lights': list(body.get('lights', [])),
+                'type': body.get('type', 'LightGroup'),
+                'action': {},
+            }
+        else:
+            collection[new_id] = dict(body)
+        return [{'success': {'id': new_id}}]
+
+    def _group_action(self, group_id: str, body: Any, address: str) -> Any:
+        if group_id == '0':
+            light_ids = list(self.lights)
+        else:
+            light_ids = self.groups[group_id]['lights']
+        if 'scene' in body:
+            scene = self.scenes.get(str(body['scene']))
+            if scene is None:
+                return _error(7, address, 'invalid scene')
+            for light_id, state in scene.get('lightstates', {}).items():
+                self._set_state(int(light_id), state, 'scene')
+        else:
+            for light_id in light_ids:
+                self._set_state(int(light_id), body, 'group')
+        return _success(address + '/', body)
+
+    def _set_state(self, light_id: int, body: Any, via: str) -> None:
+        state = {k: v for k, v in body.items() if k in _STATE_KEYS}
+        light = self.lights[str(light_id)]['state']
+        light.update({k: v for k, v in state.items() if k != 'transitiontime'})
+        # like a real bridge, report the color in the other modes too (bar
+        # color temperature)
+        if 'xy' in state:
+            light['colormode'] = 'xy'
+            rgb = colors.xy_to_rgb([tuple(light['xy'])])  # type: ignore
+            light['hue'], light['sat'] = colors.rgb_to_hue_sat(rgb)[0]
+        elif 'hue' in state or 'sat' in state:
+            light['colormode'] = 'hs'
+            rgb = colors.hue_sat_to_rgb([(light['hue'], light['sat'])])
+            x, y = colors.rgb_to_xy(rgb, 'C')[0]
+            light['xy'] = [round(x, 4), round(y, 4)]
+        elif 'ct' in state:
+            light['colormode'] = 'ct'
+        self.writes.append(Write(monotonic(), light_id, state, via))
+
+    def _take(self, kind: str, rate: float) -> bool:
+        """Token bucket per kind of write, holding one second's worth"""
+        now = monotonic()
+        tokens, last = self._buckets.get(kind, (rate, now))
+        tokens = min(rate, tokens + (now - last) * rate)
+        if tokens < 1:
+            self._buckets[kind] = (tokens, now)
+            return False
+        self._buckets[kind] = (tokens - 1, now)
+        return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, like the real bridge
+    protocol_version = 'HTTP/1.1'
+
+    def _answer(self) -> None:
+        if self.server.bridge.stopped:  # type: ignore
+            self.close_connection = True  # gone, without a word
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            body = json.loads(raw) if raw else None
+        except ValueError:
+            body = None
+        status, result = self.server.bridge.handle(  # type: ignore
+            self.command, self.path, body
+        )
+        data = json.dumps(result).encode()
+        # the client may have given up (timed out or closed) by now
+        with suppress(ConnectionError):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _answer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass  # keep benchmark output readable
+
+
+class FakeDiscovery:
+    """Stand-in for the Hue discovery service (N-UPnP), listing the given
+    fake bridges
+
+        with FakeBridge() as a, FakeBridge() as b, FakeDiscovery([a, b]) as d:
+            bridges = await discover(nupnp_url=d.url, mdns=False)
+    """
+    def __init__(
+        self,
+        bridges: list[FakeBridge],
+        host: str = '127.0.0.1',
+        port: int = 0,
+    ) -> None:
+        self.bridges = bridges
+        self._server = ThreadingHTTPServer((host, port), _DiscoveryHandler)
+        self._server.daemon_threads = True
+        self._server.discovery = self  # type: ignore
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def __enter__(self) -> 'FakeDiscovery':
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _DiscoveryHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        data = json.dumps([
+            {'id': bridge.bridge_id, 'internalipaddress': bridge.address}
+            for bridge in self.server.discovery.bridges  # type: ignore
+        ]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def _resource(parts: list[str]) -> str:
+    """Kind of resource a request is for, for counting requests"""
+    route = parts[2:]
+    if parts[1:] == ['config'] or route == ['config']:
+        return 'config'
+    if route[:1] == ['lights'] and route[2:] == ['state']:
+        return 'light state'
+    if route[:1] == ['groups'] and route[2:] == ['action']:
+        return 'group action'
+    return '/'.join(route[:1]) or ('register' if parts == ['api'] else 'api')
+
+
+def _success(address: str, body: Any) -> list[dict[str, Any]]:
+    if not isinstance(body, dict):
+        return []
+    return [{'success': {f'{address}{k}': v}} for k, v in body.items()]
+
+
+def _error(kind: int, address: str, description: str) -> list[dict[str, Any]]:
+    return [{'error': {
+        'type': kind, 'address': f'/{address}', 'description': description,
+    }}]
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='Run a fake Hue bridge')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--lights', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=None)
+    parser.add_argument('--group-rate-limit', type=float, default=None)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    bridge = FakeBridge(
+        lights=args.lights,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        group_rate_limit=args.group_rate_limit,
+        error_rate=args.error_rate,
+    )
+    print(f'Fake bridge at {bridge.address} (username {bridge.username!r})')
+    bridge._server.serve_forever()
@@ -0,0 +1,98 @@
+import json
+
+from contextlib import suppress
+from pathlib import Path
+from typing import Any
+
+# the ways of setting a light's color; the bridge uses xy over ct over
+# hue/sat when given more than one, so a newer color has to replace an older
+# one set a different way
+COLOR_MODES = ({'xy'}, {'ct'}, {'hue', 'sat'})
+
+
+class CommandJournal:
+    """Light state writes that couldn't be sent because the bridge was
+    offline, kept until they can be
+
+    Every write is appended to `path` as it's recorded, so nothing is lost
+    if the app is closed before the bridge comes back, but only the final
+    state of each light is kept (and replayed): turning a light off and on
+    again while offline is replayed as nothing more than "on".
+    """
+    def __init__(
+        self,
+        path: Path | None = None,
+        compact_at: int = 1000,
+    ) -> None:
+        self.path = path
+        # the file is rewritten with just the final states once it has this
+        # many lines, so a long outage doesn't grow it without end
+        self.compact_at = compact_at
+        self.recorded = 0  # writes recorded
+        self._states: dict[int, dict[str, Any]] = {}
+        self._lines = 0
+        if path is not None:
+            self._load()
+
+    def __len__(self) -> int:
+        """Number of lights with state waiting to be sent"""
+        return len(self._states)
+
+    def record(self, light_id: int, state: dict[str, Any]) -> None:
+        """Note the state a light should have once the bridge is back"""
+        # (transitions would only slow down catching up)
+        state = {k: v for k, v in state.items() if k != 'transitiontime'}
+        if not state:
+            return
+        self.recorded += 1
+        self._merge(light_id, state)
+        if self.path is None:
+            return
+        if self._lines >= self.compact_at:
+            self._write(self._states, 'w')
+        else:
+            self._write({light_id: state}, 'a')
+
+    def pending(self) -> dict[int, dict[str, Any]]:
+        """Final state of each light with writes waiting"""
+        return {
+            light_id: dict(state) for light_id, state in self._states.items()
+        }
+
+    def clear(self) -> None:
+        """Forget every recorded write (e.g. once replayed)"""
+        self._states.clear()
+        self._lines = 0
+        if self.path is not None:
+            with suppress(OSError):
+                self.path.unlink(missing_ok=True)
+
+    def _merge(self, light_id: int, state: dict[str, Any]) -> None:
+        known = self._states.setdefault(light_id, {})
+        if any(state.keys() & mode for mode in COLOR_MODES):
+            for mode in COLOR_MODES:
+                if not state.keys() & mode:
+                    for attr in mode:
+                        known.pop(attr, None)
+        known.update(state)
+
+    def _write(self, states: dict[int, dict[str, Any]], mode: str) -> None:
+        with suppress(OSError):
+            self.path.parent.mkdir(parents=True, exist_ok=True)  # type: ignore
+            with self.path.open(mode) as file:  # type: ignore
+                for light_id, state in states.items():
+                    file.write(
+                        json.dumps({'light': light_id, 'state': state}) + '\n'
+                    )
+            self._lines = (self._lines if mode == 'a' else 0) + len(states)
+
+    def _load(self) -> None:
+        """Read back writes recorded before the app was last closed,
+        skipping any line cut short"""
+        with suppress(OSError):
+            with self.path.open() as file:  # type: ignore
+                for line in file:
+                    self._lines += 1
+                    with suppress(ValueError, KeyError, TypeError):
+                        entry = json.loads(line)
+                        self._merge(int(entry['light']), dict(entry['state']))
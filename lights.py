@@ -1,72 +1,1800 @@
-from phue import Bridge, Light
+from __future__ import annotations
 
+import asyncio
+
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, suppress
+from dataclasses import dataclass, replace
+from pathlib import Path
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Iterable, Iterator
+
+import httpx
+
+import colors
+import metrics
+from config import Config, LightConfig, load_config
+from discovery import find_bridge, find_credentials, save_credentials
+from journal import COLOR_MODES, CommandJournal
+from streaming import HueStream, Transport
+
+if TYPE_CHECKING:  # phue is only imported by LightController, when used
+    from phue import Light
+
+# served at /metrics, see metrics.py
+BRIDGE_REQUESTS = metrics.Counter(
+    'everlight_bridge_requests_total',
+    'Requests sent to the Hue bridge, by response status',
+    ('method', 'resource', 'status'),
+)
+BRIDGE_LATENCY = metrics.Histogram(
+    'everlight_bridge_request_seconds',
+    'Time taken by bridge requests, including retries',
+    ('method', 'resource'),
+)
+BRIDGE_ERRORS = metrics.Counter(
+    'everlight_bridge_errors_total',
+    'Failed bridge request attempts, by kind of failure',
+    ('resource', 'error'),
+)
+BRIDGE_IN_FLIGHT = metrics.Gauge(
+    'everlight_bridge_requests_in_flight',
+    'Bridge requests waiting for a response',
+)
+OPERATIONS = metrics.Histogram(
+    'everlight_controller_operation_seconds',
+    'Time taken by light controller operations',
+    ('operation',),
+)
+OPERATION_ERRORS = metrics.Counter(
+    'everlight_controller_operation_errors_total',
+    'Light controller operations that raised',
+    ('operation',),
+)
+WRITES_QUEUED = metrics.Counter(
+    'everlight_writes_queued_total', 'Light state writes queued'
+)
+WRITES_COALESCED = metrics.Counter(
+    'everlight_writes_coalesced_total',
+    'Queued writes merged into one already pending',
+)
+WRITES_SENT = metrics.Counter(
+    'everlight_writes_sent_total', 'Queued writes taken off the queue to send'
+)
+WRITES_DROPPED = metrics.Counter(
+    'everlight_writes_dropped_total',
+    'Queued writes lost because the bridge was unreachable',
+)
+WRITES_SKIPPED = metrics.Counter(
+    'everlight_writes_skipped_total',
+    'Writes skipped because they would not change anything',
+)
+WRITES_JOURNALED = metrics.Counter(
+    'everlight_writes_journaled_total',
+    'Writes kept to send later because the bridge was offline',
+)
+WRITES_REPLAYED = metrics.Counter(
+    'everlight_writes_replayed_total',
+    'Journaled light states sent once the bridge was back',
+)
+RECONNECTS = metrics.Counter(
+    'everlight_bridge_reconnects_total',
+    'Attempts to reconnect to a bridge that went offline, by result',
+    ('result',),
+)
+QUEUE_DEPTH = metrics.Gauge(
+    'everlight_write_queue_depth',
+    'Lights with a write waiting to be sent (over every bridge)',
+)
+
+
+# bridge answers worth trying again: it's busy (rate limiting or overloaded)
+# rather than gone
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class BridgeError(ConnectionError):
+    """The bridge is there but turned a request down (an HTTP error status,
+    or an error in its response)"""
+
+
+class UnauthorizedError(BridgeError):
+    """The bridge doesn't know the username requests are made with (e.g.
+    it was reset, or the username removed)"""
+
+
+# Hue error type for an unknown username
+_UNAUTHORIZED = 1
+
+
+def _raise_for_errors(data: Any, method: str, resource: str) -> None:
+    """Raise for the errors the bridge answers (with a 200) in place of a
+    result: any unknown username error, or an error list where a GET
+    should have returned an object (other requests answer a list either
+    way, for the caller to check)"""
+    if not isinstance(data, list):
+        return
+    errors = [
+        item['error'] for item in data
+        if isinstance(item, dict) and isinstance(item.get('error'), dict)
+    ]
+    if not errors:
+        return
+    message = (
+        f'Hue bridge request failed: {errors[0].get("description")} '
+        f'({method} {resource})'
+    )
+    if any(error.get('type') == _UNAUTHORIZED for error in errors):
+        BRIDGE_ERRORS.inc(resource=resource, error='UnauthorizedError')
+        raise UnauthorizedError(message)
+    if method == 'GET':
+        BRIDGE_ERRORS.inc(resource=resource, error='BridgeError')
+        raise BridgeError(message)
+
+
+def _timed(operation: str) -> Callable:
+    return metrics.timed(OPERATIONS, OPERATION_ERRORS, operation=operation)
+
+
+def _resource(path: str) -> str:
+    """Request path with the IDs taken out, e.g. /lights/{id}/state, so
+    metrics aren't split per light"""
+    return '/'.join(
+        '{id}' if part.isdigit() else part for part in path.split('/')
+    ) or '/'
+
+
+class _WriteQueue(ABC):
+    """Pending light state writes, merged per light
+
+    A newer value for an attribute replaces the older one, so only the latest
+    state for each light is ever sent. Subclasses drain the queue round-robin
+    at no more than `rate` writes per second.
+    """
+    def __init__(
+        self,
+        send: Callable[[int, dict[str, Any]], Any],
+        rate: float,
+    ) -> None:
+        self.send = send
+        self.rate = rate
+        # counters
+        self.queued = 0  # writes submitted
+        self.coalesced = 0  # writes merged into one already pending
+        self.sent = 0  # writes actually sent to the bridge
+        self._pending: dict[int, dict[str, Any]] = {}
+        self._lock = Lock()
+        self._last_sent = 0.0
+        self._held = 0
+
+    def put(self, light_id: int, **attrs: Any) -> None:
+        """Queue a state write for the given light"""
+        with self._lock:
+            self.queued += 1
+            if light_id in self._pending:
+                self.coalesced += 1
+                self._pending[light_id].update(attrs)
+                WRITES_COALESCED.inc()
+            else:
+                self._pending[light_id] = dict(attrs)
+                QUEUE_DEPTH.inc()
+        WRITES_QUEUED.inc()
+        self._notify()
+
+    def discard(self, light_id: int) -> dict[str, Any]:
+        """Remove and return any pending state for the given light"""
+        with self._lock:
+            if light_id not in self._pending:
+                return {}
+            QUEUE_DEPTH.dec()
+            return self._pending.pop(light_id)
+
+    @contextmanager
+    def hold(self) -> Iterator[None]:
+        """Keep queued writes from being sent until the block exits"""
+        with self._lock:
+            self._held += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._held -= 1
+            self._notify()
+
+    def spend(self, writes: int) -> None:
+        """Count writes sent some other way (e.g. animation frames) against
+        the rate, holding queued writes back to make room for them"""
+        with self._lock:
+            # as if sent one after another from now (or from the end of
+            # whatever was spent before)
+            self._last_sent = (
+                max(self._last_sent, monotonic() - 1 / self.rate)
+                + writes / self.rate
+            )
+
+    @property
+    def depth(self) -> int:
+        """Number of lights with a write waiting to be sent"""
+        return len(self._pending)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'queued': self.queued,
+            'coalesced': self.coalesced,
+            'sent': self.sent,
+            'pending': self.depth,
+        }
+
+    @abstractmethod
+    def _notify(self) -> None:
+        """Wake the worker (starting it if needed) to drain the queue"""
+
+    def _delay(self) -> float:
+        # the remainder of the interval is waited out before popping, so
+        # anything submitted in the meantime is merged into the next write
+        return self._last_sent + 1 / self.rate - monotonic()
+
+    def _pop(self) -> tuple[int, dict[str, Any]] | None:
+        with self._lock:
+            if self._held or not self._pending:
+                return None
+            # oldest entry first, so every light gets its turn
+            light_id = next(iter(self._pending))
+            self._last_sent = monotonic()
+            self.sent += 1
+            WRITES_SENT.inc()
+            QUEUE_DEPTH.dec()
+            return light_id, self._pending.pop(light_id)
+
+    def _take_all(self) -> list[tuple[int, dict[str, Any]]]:
+        with self._lock:
+            items = list(self._pending.items())
+            self._pending.clear()
+            self.sent += len(items)
+            WRITES_SENT.inc(len(items))
+            QUEUE_DEPTH.dec(len(items))
+            return items
+
+
+class CommandQueue(_WriteQueue):
+    """Coalescing, rate-limited queue of pending light state writes, drained
+    by a background thread"""
+    def __init__(
+        self,
+        send: Callable[[int, dict[str, Any]], Any],
+        rate: float = 10.0,
+    ) -> None:
+        super().__init__(send, rate)
+        self._wakeup = Event()
+        self._worker: Thread | None = None
+
+    def flush(self) -> None:
+        """Send everything that's pending right away, ignoring the rate"""
+        for item in self._take_all():
+            self._send(*item)
+
+    def _notify(self) -> None:
+        if self._worker is None:
+            self._worker = Thread(target=self._run, daemon=True)
+            self._worker.start()
+        self._wakeup.set()
+
+    def _send(self, light_id: int, state: dict[str, Any]) -> None:
+        try:
+            self.send(light_id, state)
+        except OSError as e:  # bridge unreachable; drop the write
+            WRITES_DROPPED.inc()
+            # (phue's requests aren't counted anywhere else)
+            BRIDGE_ERRORS.inc(
+                resource='/lights/{id}/state', error=type(e).__name__
+            )
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            while True:
+                # (again after waiting, in case more was spent meanwhile)
+                while (delay := self._delay()) > 0:
+                    sleep(delay)
+                if (item := self._pop()) is None:
+                    break
+                self._send(*item)
+
+
+class AsyncCommandQueue(_WriteQueue):
+    """Coalescing, rate-limited queue of pending light state writes, drained
+    by an asyncio task on the running event loop"""
+    def __init__(
+        self,
+        send: Callable[[int, dict[str, Any]], Awaitable[Any]],
+        rate: float = 10.0,
+    ) -> None:
+        super().__init__(send, rate)
+        self._wakeup = asyncio.Event()
+        self._worker: asyncio.Task | None = None
+
+    async def flush(self) -> None:
+        """Send everything that's pending right away, ignoring the rate"""
+        await asyncio.gather(*(self._send(*item) for item in self._take_all()))
+
+    def _notify(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+        self._wakeup.set()
+
+    async def _send(self, light_id: int, state: dict[str, Any]) -> None:
+        try:
+            await self.send(light_id, state)
+        except ConnectionError:  # bridge unreachable; drop the write
+            # (the failed request is counted in BRIDGE_ERRORS)
+            WRITES_DROPPED.inc()
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while True:
+                while (delay := self._delay()) > 0:
+                    await asyncio.sleep(delay)
+                if (item := self._pop()) is None:
+                    break
+                await self._send(*item)
+
+
+class StateMirror:
+    """Last known state of each light, kept in memory
+
+    Updated with whatever is sent to the bridge and refreshed periodically
+    from the bridge itself, so writes that wouldn't change anything can be
+    skipped and the UI can show the lights' actual state.
+    """
+    # xy values come back from the bridge rounded to 4 decimal places
+    XY_TOLERANCE = 0.0005
+
+    def __init__(self) -> None:
+        self.skipped = 0  # writes skipped because nothing would change
+        self.refreshed_at = 0.0  # monotonic time of the last bridge refresh
+        self._states: dict[int, dict[str, Any]] = {}
+        # hex colors set through the app, for the UI to show
+        self._colors: dict[int, str] = {}
+        self._gamuts: dict[int, colors.Gamut] = {}
+
+    def get(self, light_id: int) -> dict[str, Any]:
+        """Return the known state of a light (empty if unknown)"""
+        return dict(self._states.get(light_id, {}))
+
+    def color(self, light_id: int) -> str | None:
+        """Return the last hex color set for a light, if it still applies,
+        or else the color the light is known to show (at full brightness),
+        e.g. after a reset or being changed from the Hue app"""
+        if (color := self._colors.get(light_id)) is not None:
+            return color
+        known = self._states.get(light_id, {})
+        if known.get('colormode') == 'hs' and known.keys() >= {'hue', 'sat'}:
+            rgb = colors.hue_sat_to_rgb([(known['hue'], known['sat'])])[0]
+        elif known.get('colormode') == 'xy' and 'xy' in known:
+            rgb = colors.xy_to_rgb([tuple(known['xy'])])[0]  # type: ignore
+        else:
+            return None
+        return colors.rgb_to_hex(rgb)
+
+    def set_color(self, light_id: int, color: str) -> None:
+        self._colors[light_id] = color
+
+    def gamut(self, light_id: int) -> colors.Gamut | None:
+        """Return the color gamut (A, B or C) of a light, if known"""
+        return self._gamuts.get(light_id)
+
+    def update(self, light_id: int, state: dict[str, Any]) -> None:
+        """Record state that was sent to a light"""
+        state = {k: v for k, v in state.items() if k != 'transitiontime'}
+        if 'hue' in state or 'sat' in state or 'ct' in state:
+            # no longer an xy color, so the remembered hex color is stale
+            self._colors.pop(light_id, None)
+        known = self._states.setdefault(light_id, {})
+        if mode := _colormode(state):
+            # the light no longer shows a color set any other way
+            for attrs in COLOR_MODES:
+                if not state.keys() & attrs:
+                    for attr in attrs:
+                        known.pop(attr, None)
+            known['colormode'] = mode
+        known.update(state)
+
+    def refresh(self, lights: dict[str, Any]) -> None:
+        """Replace the known states with a bridge `GET /lights` response"""
+        for light_id, attrs in lights.items():
+            light_id = int(light_id)
+            state = attrs.get('state', {})
+            control = attrs.get('capabilities', {}).get('control', {})
+            if control.get('colorgamuttype') in colors.GAMUTS:
+                self._gamuts[light_id] = control['colorgamuttype']
+            if not self._matches(self._states.get(light_id, {}), state, 'xy'):
+                # changed from outside the app (e.g. the Hue app)
+                self._colors.pop(light_id, None)
+            self._states[light_id] = dict(state)
+        self.refreshed_at = monotonic()
+
+    def diff(self, light_id: int, state: dict[str, Any]) -> dict[str, Any]:
+        """Return the part of `state` that differs from the known state
+
+        A transition time is only kept if something else is changing. (Only
+        the caller knows whether a write is skipped for it: see `skip`.)
+        """
+        known = self._states.get(light_id, {})
+        # a color set a different way than the light's is showing is a
+        # change, even if the light happens to report the same values
+        mode = _colormode(state)
+        new_mode = mode is not None and known.get('colormode', mode) != mode
+        changed = {
+            k: v for k, v in state.items()
+            if k != 'transitiontime' and (
+                new_mode and k in _COLOR_ATTRS
+                or not self._matches(known, {k: v}, k)
+            )
+        }
+        if changed and 'transitiontime' in state:
+            changed['transitiontime'] = state['transitiontime']
+        return changed
+
+    def skip(self, writes: int = 1) -> None:
+        """Count writes not sent because they wouldn't change anything"""
+        self.skipped += writes
+        WRITES_SKIPPED.inc(writes)
+
+    @classmethod
+    def _matches(cls, known: dict, state: dict, key: str) -> bool:
+        if key not in known or key not in state:
+            return key not in state
+        if key == 'xy':
+            return all(
+                abs(a - b) <= cls.XY_TOLERANCE
+                for a, b in zip(known[key], state[key])
+            )
+        return known[key] == state[key]
+
+
+# every attribute that sets a light's color
+_COLOR_ATTRS = set().union(*COLOR_MODES)
+
+
+def _resolve_names(
+    configs: Iterable[LightConfig],
+    names: dict[int, str],
+) -> tuple[LightConfig, ...]:
+    """Light configs with the IDs of lights given by name filled in from
+    the bridge's light `names` (keyed by ID)"""
+    # (the lowest ID, if several lights have the same name)
+    ids = {
+        name: light_id
+        for light_id, name in sorted(names.items(), reverse=True)
+    }
+    return tuple(
+        replace(config, light_id=ids[config.name])
+        if config.light_id is None and config.name in ids else config
+        for config in configs
+    )
+
+
+def _colormode(state: dict[str, Any]) -> str | None:
+    """The `colormode` a light is left in by a state write (the bridge uses
+    xy over ct over hue/sat when given more than one), if it sets a color"""
+    for attrs, mode in zip(COLOR_MODES, ('xy', 'ct', 'hs')):
+        if state.keys() & attrs:
+            return mode
+    return None
+
+
+class _ControllerBase:
+    """State conversions and group and scene bookkeeping shared by the
+    controllers (which only differ in how they talk to the bridge)"""
+    GROUP_NAME = 'Everlight'
+    lights: dict[int, Any]
+    mirror: StateMirror
+    queue: _WriteQueue
+    use_scenes: bool
+
+    def to_state(
+        self,
+        color: str | None = None,
+        brightness: int | None = None,
+        light: Any = None,
+        **attrs: Any,
+    ) -> dict[str, Any]:
+        """Build a Hue state body from a hex color and percentage brightness
+
+        If the light is given, the color is clamped to its color gamut.
+        """
+        state = {}
+        if color:
+            state['xy'] = colors.hex_to_xy(color, self.gamut_of(light))
+        if brightness is not None:
+            state['bri'] = self._percent_to_bri(brightness)
+        state.update(attrs)
+        return state
+
+    @staticmethod
+    def _scene_key(states: dict[Any, dict[str, Any]]) -> tuple:
+        """Hashable key identifying a set of light states"""
+        return tuple(sorted(
+            (light.light_id, tuple(sorted(attrs.items())))
+            for light, attrs in states.items()
+        ))
+
+    def _scene_body(
+        self,
+        name: str,
+        states: dict[Any, dict[str, Any]],
+    ) -> dict[str, Any]:
+        """Request body for storing the light states as a bridge scene"""
+        return {
+            # NOTE: the bridge limits scene names to 32 characters
+            'name': (name or self.GROUP_NAME)[:32],
+            'lights': [str(light.light_id) for light in states],
+            'lightstates': {
+                str(light.light_id): attrs for light, attrs in states.items()
+            },
+            # let the bridge clean up scenes when it runs out of room
+            'recycle': True,
+        }
+
+    def _group_write(
+        self,
+        states: dict[Any, dict[str, Any]],
+        group_id: int | None,
+    ) -> str:
+        """How `apply_scene` sets the light states: with one group 'action'
+        (they all share a state), by recalling a 'scene', with a request per
+        light ('apply') or not at all ('skip': nothing would change)"""
+        if group_id is None or set(states) != set(self.lights.values()):
+            return 'apply'  # not every light in the group is changing
+        # fold any queued writes into the new state so they can't land late
+        for light in states:
+            self.queue.discard(light.light_id)
+        if not any(
+            self.mirror.diff(light.light_id, attrs)
+            for light, attrs in states.items()
+        ):
+            # the lights already look like this
+            self.mirror.skip(len(states))
+            return 'skip'
+        first, *rest = states.values()
+        if all(attrs == first for attrs in rest):
+            return 'action'
+        return 'scene' if self.use_scenes else 'apply'
+
+    def _group_written(self, states: dict[Any, dict[str, Any]]) -> None:
+        """Record light states set with a group action or scene"""
+        for light, attrs in states.items():
+            self.mirror.update(light.light_id, attrs)
+
+    def _group_body(self) -> dict[str, Any]:
+        """Request body for creating the bridge group for the lights"""
+        return {
+            'name': self.GROUP_NAME,
+            'lights': [str(light_id) for light_id in self.lights],
+        }
+
+    def _match_group(
+        self,
+        groups: dict[str, Any],
+    ) -> tuple[int | None, dict[str, Any] | None]:
+        """Find the group for the lights in a bridge `GET /groups` response,
+        returning its ID (if there is one) and the update its lights need
+        (if they aren't the configured lights)"""
+        body = self._group_body()
+        for group_id, group in groups.items():
+            if group['name'] == self.GROUP_NAME:
+                if sorted(group['lights']) == sorted(body['lights']):
+                    return int(group_id), None
+                return int(group_id), {'lights': body['lights']}
+        return None, None
+
+    @classmethod
+    def _created_id(cls, result: Any) -> str | None:
+        """ID of what a bridge `POST` created, if it worked"""
+        return result[0]['success']['id'] if cls._succeeded(result) else None
+
+    def brightness_of(self, light: Any, default: int = 100) -> int:
+        """Last known brightness of a light as a percentage (0-100)"""
+        bri = self.mirror.get(light.light_id).get('bri') if light else None
+        return default if bri is None else round(bri / 254 * 100)
+
+    def color_of(self, light: Any) -> str | None:
+        """Last hex color set for a light, if it's still showing it"""
+        return self.mirror.color(light.light_id) if light else None
+
+    def gamut_of(self, light: Any) -> colors.Gamut | None:
+        """Color gamut (A, B or C) of a light, if known"""
+        return self.mirror.gamut(light.light_id) if light else None
+
+    def preview_of(self, light: Any, color: str) -> str:
+        """Hex color closest to what the light actually shows for `color`"""
+        return colors.preview(color, self.gamut_of(light))
+
+    def remember_color(self, light: Any, color: str) -> None:
+        """Note the hex color a light was set to, for `color_of`"""
+        if light and color:
+            self.mirror.set_color(light.light_id, color)
+
+    def is_on(self, light: Any, default: bool = True) -> bool:
+        """Whether a light is on, as far as we know"""
+        on = self.mirror.get(light.light_id).get('on') if light else None
+        return default if on is None else on
+
+    @staticmethod
+    def _succeeded(result: Any) -> bool:
+        """Whether a bridge response (a list of results, which answers
+        errors with a 200 too) reports nothing but success"""
+        return (
+            isinstance(result, list) and bool(result)
+            and all(isinstance(r, dict) and 'success' in r for r in result)
+        )
+
+    @staticmethod
+    def _percent_to_bri(brightness: int) -> int:
+        # scale the percentage brightness (0-100) to Hue brightness (0-254)
+        return int((brightness / 100) * 254)
+
+
+class LightController(_ControllerBase):
+    def __init__(
+        self,
+        bridge_ip: str,
+        lights: Iterable[LightConfig] = (),
+        write_rate: float = 10.0,
+        use_scenes: bool = True,
+    ) -> None:
+        from phue import Bridge
 
-class LightController:
-    def __init__(self, bridge_ip: str) -> None:
         self.bridge = Bridge(bridge_ip)
         self.bridge.connect()
-        self.bridge.get_api()
-        lights: dict[str, Light] = (
-            self.bridge.get_light_objects('name')  # type: ignore
+        # what the lights are showing, so unchanged writes can be skipped
+        self.mirror = StateMirror()
+        self.mirror.refresh(self.bridge.get_api()['lights'])
+        by_id: dict[int, Light] = (
+            self.bridge.get_light_objects('id')  # type: ignore
         )
-        self.D1 = lights.get('Dining Room 1')
-        self.D2 = lights.get('Dining Room 2')
+        # slider and color picker writes are coalesced and sent at a rate the
+        # bridge can keep up with (about 10 commands per second)
+        self.queue = CommandQueue(self._send_state, write_rate)
+        # the configured lights (or every light) keyed by ID, in order
+        configs = _resolve_names(
+            lights, {light_id: light.name for light_id, light in by_id.items()}
+        ) or [LightConfig(light_id) for light_id in sorted(by_id)]
+        self.lights: dict[int, Light] = {
+            config.light_id: by_id[config.light_id]
+            for config in configs if config.light_id in by_id
+        }
+
+        # bridge group holding the lights, so presets can be applied to all
+        # of them at once (created lazily by `apply_scene`)
+        self.use_scenes = use_scenes
+        self.group_id: int | None = None
+        # so concurrent callers don't each create a group
+        self._group_lock = Lock()
+        # bridge-side scene IDs, keyed by the light states they were made from
+        self._scenes: dict[tuple, str] = {}
+
+        self.apply({light: {'on': True} for light in self.lights.values()})
+
+    @_timed('set_state')
+    def set_state(self, light: Light | None, **attrs: Any) -> None:
+        """Send the given state attributes (on, xy, bri, transitiontime...)
+        to a light as a single request
+
+        Any writes still queued for the light are folded into the same
+        request, which counts against the write queue's rate (so writes sent
+        this way, e.g. by animations, and queued writes stay within it
+        between them)
+        """
+        if not light:
+            return
+        state = self.queue.discard(light.light_id)
+        state.update(attrs)
+        if self._send_state(light.light_id, state) is not None:
+            self.queue.spend(1)
+
+    @_timed('refresh')
+    def refresh(self) -> None:
+        """Update the state mirror from the bridge"""
+        self.mirror.refresh(self.bridge.get_light())
 
-        if self.D1:
-            self.D1.on = True
-        if self.D2:
-            self.D2.on = True
+    @_timed('apply')
+    def apply(self, states: dict[Light | None, dict[str, Any]]) -> None:
+        """Set the state of several lights concurrently, one request each"""
+        if len(states) < 2:
+            for light, attrs in states.items():
+                self.set_state(light, **attrs)
+            return
+        with ThreadPoolExecutor(min(len(states), 8)) as pool:
+            for _ in pool.map(
+                lambda item: self.set_state(item[0], **item[1]),
+                states.items(),
+            ):
+                pass  # raise the first error, if any
+
+    @_timed('apply_scene')
+    def apply_scene(
+        self,
+        states: dict[Light | None, dict[str, Any]],
+        name: str = '',
+    ) -> None:
+        """Set the state of several lights with a single group action
+
+        Lights that share a state are set with one group action; otherwise a
+        bridge-side scene is stored for the states (once) and recalled, so
+        every light changes at the same moment. Falls back to `apply` when the
+        group or scene can't be used.
+        """
+        states = {light: attrs for light, attrs in states.items() if light}
+        if not states:
+            return
+        group_id = self._ensure_group()
+        how = self._group_write(states, group_id)
+        if how == 'action':
+            state = next(iter(states.values()))  # (every light's)
+            self._request('PUT', f'/groups/{group_id}/action', state)
+        elif how == 'scene' and not self._recall_scene(
+            group_id, name, states  # type: ignore
+        ):
+            how = 'apply'
+        if how == 'apply':
+            self.apply(states)
+        elif how != 'skip':
+            self._group_written(states)
+
+    def _ensure_group(self) -> int | None:
+        """Find or create the bridge group for the lights, returning its ID"""
+        with self._group_lock:
+            return self._find_group()
+
+    def _find_group(self) -> int | None:
+        if self.group_id is not None:
+            return self.group_id
+        if not self.lights:
+            return None
+        group_id, update = self._match_group(self._request('GET', '/groups'))
+        if group_id is None:
+            result = self._request('POST', '/groups', self._group_body())
+            if (created := self._created_id(result)) is None:
+                return None
+            group_id = int(created)
+        elif update:
+            self._request('PUT', f'/groups/{group_id}', update)
+        self.group_id = group_id
+        return group_id
+
+    def _recall_scene(
+        self,
+        group_id: int,
+        name: str,
+        states: dict[Light, dict[str, Any]],
+    ) -> bool:
+        """Recall the scene for the light states on the group, storing it on
+        the bridge first if needed, returning whether it worked"""
+        key = self._scene_key(states)
+        while True:
+            scene_id = self._scenes.get(key)
+            if stored := scene_id is None:  # (stored just now)
+                result = self._request(
+                    'POST', '/scenes', self._scene_body(name, states)
+                )
+                if (scene_id := self._created_id(result)) is None:
+                    return False
+                self._scenes[key] = scene_id
+            result = self._request(
+                'PUT', f'/groups/{group_id}/action', {'scene': scene_id}
+            )
+            if self._succeeded(result):
+                return True
+            # the bridge doesn't have the scene anymore (scenes are stored
+            # to be recycled), so store it again, once
+            del self._scenes[key]
+            if stored:
+                return False
 
+    def _request(
+        self,
+        method: str,
+        path: str,
+        body: dict[str, Any] | None = None,
+    ) -> Any:
+        """Send a request to the bridge through phue, with the path under
+        the username (as for `AsyncLightController._request`)"""
+        return self.bridge.request(
+            method, f'/api/{self.bridge.username}{path}', body
+        )
+
+    @_timed('reset_lights')
     def reset_lights(self) -> None:
-        """Reset the two lights to a default warm white color"""
-        for light in (self.D1, self.D2):
-            if light:
-                # NOTE: these are the default warm white settings from Hue
-                light.hue = 6929
-                light.saturation = 129
-                light.brightness = 254
+        """Reset the lights to a default warm white color"""
+        # NOTE: these are the default warm white settings from Hue
+        self.apply_scene({
+            light: {'hue': 6929, 'sat': 129, 'bri': 254}
+            for light in self.lights.values()
+        })
 
+    @_timed('all_on')
     def all_on(self) -> None:
-        """Turn both lights on"""
-        if self.D1:
-            self.D1.on = True
-        if self.D2:
-            self.D2.on = True
+        """Turn all the lights on"""
+        self.apply_scene(
+            {light: {'on': True} for light in self.lights.values()}
+        )
 
+    @_timed('all_off')
     def all_off(self) -> None:
-        """Turn both lights off"""
-        if self.D1:
-            self.D1.on = False
-        if self.D2:
-            self.D2.on = False
+        """Turn all the lights off"""
+        self.apply_scene(
+            {light: {'on': False} for light in self.lights.values()}
+        )
 
     def set_color(self, light: Light | None, color: str) -> None:
         if not light or not color:
             return
-        color = color.lstrip('#')
-        r, g, b = (int(color[i:i+2], 16) / 255 for i in (0, 2, 4))
-        light.xy = self._rgb_to_xy(r, g, b)
+        self.remember_color(light, color)
+        self.queue.put(
+            light.light_id, xy=colors.hex_to_xy(color, self.gamut_of(light))
+        )
 
     def set_brightness(self, light: Light | None, brightness: int) -> None:
         if not light:
             return
-        # scale the percentage brightness (0-100) to Hue brightness (0-254)
-        brightness = int((brightness / 100) * 254)
-        light.brightness = brightness
+        self.queue.put(light.light_id, bri=self._percent_to_bri(brightness))
 
-    @staticmethod
-    def _rgb_to_xy(red, green, blue) -> tuple[float, float]:
-        red = pow((red + 0.055) / 1.055, 2.4) if red > 0.04045 else red / 12.92
-        green = pow((green + 0.055) / 1.055, 2.4) if green > 0.04045 else green / 12.92
-        blue = pow((blue + 0.055) / 1.055, 2.4) if blue > 0.04045 else blue / 12.92
-        x = red * 0.649926 + green * 0.103455 + blue * 0.197109
-        y = red * 0.234327 + green * 0.743075 + blue * 0.022598
-        z = green * 0.053077 + blue * 1.035763
+    @_timed('send_state')
+    def _send_state(self, light_id: int, state: dict[str, Any]) -> Any:
+        if not (state := self.mirror.diff(light_id, state)):
+            self.mirror.skip()
+            return None
+        result = self.bridge.set_light(light_id, state)
+        self.mirror.update(light_id, state)
+        return result
+
+
+@dataclass(frozen=True)
+class HueLight:
+    """A light on the bridge, as seen by AsyncLightController"""
+    light_id: int
+    name: str
+    label: str = ''  # from the light config; shown instead of the name
+
+
+class AsyncLightController(_ControllerBase):
+    """asyncio-native counterpart to LightController
+
+    Talks to the bridge's REST API over a pooled keep-alive HTTP client rather
+    than blocking phue calls, so a slow bridge never stalls the event loop.
+    Meant to be long-lived and shared: `ensure_connected` connects lazily
+    (once) and then refreshes its state mirror every `refresh_interval`
+    seconds, which doubles as a health check. Call `close` when done.
+
+    If the bridge drops off, writes aren't lost (or raised to the UI) but
+    kept in a journal (on disk, at `journal_path`), and reconnecting is
+    retried in the background, backing off from `reconnect_delay` up to
+    `max_reconnect_delay` seconds. Once back, just the final state of each
+    light is sent.
+    """
+    # state attributes an Entertainment API stream can set (transitions are
+    # ignored; streamed frames show up immediately)
+    STREAM_ATTRS = {'xy', 'bri', 'transitiontime'}
+
+    def __init__(
+        self,
+        bridge_ip: str,
+        lights: Iterable[LightConfig] = (),
+        username: str | None = None,
+        write_rate: float = 10.0,
+        use_scenes: bool = True,
+        timeout: float = 5.0,
+        retries: int = 2,
+        refresh_interval: float = 30.0,
+        bridge_id: str = '',
+        journal_path: Path | None = None,
+        reconnect_delay: float = 1.0,
+        max_reconnect_delay: float = 60.0,
+    ) -> None:
+        # with no address, the bridge (with `bridge_id`, if given) is looked
+        # for on the network when connecting
+        self.bridge_ip = bridge_ip
+        self.bridge_id = bridge_id
+        self.username = username
+        # pre-shared key for streaming over DTLS, if the bridge gave us one
+        self.clientkey: str | None = None
+        self.timeout = timeout
+        self.retries = retries
+        self.refresh_interval = refresh_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.client: httpx.AsyncClient | None = None
+        # what the lights are showing, so unchanged writes can be skipped
+        self.mirror = StateMirror()
+        self.connected = False
+        self._connect_lock = asyncio.Lock()
+        self._monitor: asyncio.Task | None = None
+        # set when a request finds the bridge gone, to reconnect right away
+        self._lost = asyncio.Event()
+        # writes made while offline (including any from before the app was
+        # last closed), sent once connected
+        self.journal = CommandJournal(journal_path)
+        self.queue = AsyncCommandQueue(self._send_state, write_rate)
+        # (lights given by name get their IDs once connected)
+        self.config = tuple(lights)
+        # the configured lights (or every light) keyed by ID, in order
+        self.lights: dict[int, HueLight] = {}
+        # called whenever `lights` has been looked up again (on connecting,
+        # including reconnecting after the bridge dropped off)
+        self.on_connect: list[Callable[[], Any]] = []
+        self.use_scenes = use_scenes
+        self.group_id: int | None = None
+        # so concurrent callers don't each create a group
+        self._group_lock = asyncio.Lock()
+        self._scenes: dict[tuple, str] = {}
+        # Entertainment API stream, while streaming (see `start_streaming`)
+        self.stream: HueStream | None = None
+        self.stream_group_id: int | None = None
+        self._rest_rate = write_rate
+        self._keep_alive: asyncio.Task | None = None
+
+    @_timed('connect')
+    async def connect(self) -> None:
+        """Open the HTTP client and look up the lights on the bridge"""
+        if not self.bridge_ip:
+            bridge = await find_bridge(self.bridge_id, self.timeout)
+            self.bridge_ip, self.bridge_id = bridge.address, bridge.bridge_id
+        if self.username is None:
+            self.username = await self._load_username()
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=self._base_url(),
+                timeout=self.timeout,
+                # enough connections to write to every light at once (the
+                # bridge handles a handful, more with a larger rig)
+                limits=httpx.Limits(
+                    max_connections=max(4, len(self.config)),
+                    max_keepalive_connections=max(4, len(self.config)),
+                ),
+            )
+        first_connect = not self.lights
         try:
-            return x / (x + y + z), y / (x + y + z)
-        except ZeroDivisionError:
-            return 0.0, 0.0
+            lights = await self._request('GET', '/lights')
+        except UnauthorizedError:
+            # the bridge no longer knows the saved username, so register a
+            # new one (which needs the link button pressed)
+            self.username = await self._register()
+            self.client.base_url = httpx.URL(self._base_url())
+            lights = await self._request('GET', '/lights')
+        self.mirror.refresh(lights)
+        self.config = _resolve_names(self.config, {
+            int(light_id): light['name'] for light_id, light in lights.items()
+        })
+        configs = self.config or [
+            LightConfig(light_id) for light_id in sorted(map(int, lights))
+        ]
+        self.lights = {
+            config.light_id: HueLight(
+                config.light_id,
+                lights[str(config.light_id)]['name'],
+                config.label,
+            )
+            for config in configs if str(config.light_id) in lights
+        }
+        self.connected = True
+        for callback in self.on_connect:
+            callback()
+        if first_connect:
+            await self.apply(
+                {light: {'on': True} for light in self.lights.values()}
+            )
+        await self.replay()
+
+    async def ensure_connected(self) -> None:
+        """Connect to the bridge unless already connected, and keep an eye on
+        the connection from then on"""
+        async with self._connect_lock:
+            if not self.connected:
+                await self.connect()
+        if self._monitor is None or self._monitor.done():
+            self._monitor = asyncio.create_task(self._watch())
+
+    @_timed('refresh')
+    async def refresh(self) -> None:
+        """Update the state mirror from the bridge"""
+        self.mirror.refresh(await self._request('GET', '/lights'))
+
+    @property
+    def offline(self) -> bool:
+        """Whether the bridge has dropped off since connecting (so writes are
+        being journaled)"""
+        return not self.connected and bool(self.lights)
+
+    @_timed('replay')
+    async def replay(self) -> None:
+        """Send the final state of each light written to while offline"""
+        if not (pending := self.journal.pending()):
+            return
+        # (anything that fails now is journaled again)
+        self.journal.clear()
+        states = {
+            light_id: state | self.queue.discard(light_id)
+            for light_id, state in pending.items() if light_id in self.lights
+        }
+        WRITES_REPLAYED.inc(len(states))
+        results = await asyncio.gather(
+            *(
+                self._send_state(light_id, state)
+                for light_id, state in states.items()
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BridgeError):  # turned down; drop it
+                WRITES_DROPPED.inc()
+            elif isinstance(result, BaseException):
+                raise result
+
+    async def check_health(self) -> bool:
+        """Refresh the state mirror, returning whether the bridge responded"""
+        try:
+            await self.refresh()
+        except UnauthorizedError:
+            # reconnect, registering a new username
+            self._disconnected()
+            return False
+        except ConnectionError:
+            return False
+        return True
+
+    async def close(self) -> None:
+        """Send any queued writes and close the HTTP client"""
+        await self.stop_streaming()
+        if self.client is not None:
+            # (journaled for next time if the bridge is offline)
+            await self.queue.flush()
+            await self.client.aclose()
+            self.client = None
+        self.connected = False
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+
+    @_timed('set_state')
+    async def set_state(self, light: HueLight | None, **attrs: Any) -> None:
+        """Send the given state attributes (on, xy, bri, transitiontime...)
+        to a light as a single request
+
+        Any writes still queued for the light are folded into the same
+        request, which counts against the write queue's rate (so writes sent
+        this way, e.g. by animations, and queued writes stay within it
+        between them)
+        """
+        if not light:
+            return
+        state = self.queue.discard(light.light_id)
+        state.update(attrs)
+        if await self._send_state(light.light_id, state) is not None:
+            self.queue.spend(1)
+
+    @_timed('apply')
+    async def apply(
+        self,
+        states: dict[HueLight | None, dict[str, Any]],
+    ) -> None:
+        """Set the state of several lights concurrently, one request each"""
+        await asyncio.gather(*(
+            self.set_state(light, **attrs) for light, attrs in states.items()
+        ))
+
+    @_timed('apply_scene')
+    async def apply_scene(
+        self,
+        states: dict[HueLight | None, dict[str, Any]],
+        name: str = '',
+    ) -> None:
+        """Set the state of several lights with a single group action
+
+        See `LightController.apply_scene`
+        """
+        states = {light: attrs for light, attrs in states.items() if light}
+        if not states:
+            return
+        if not self.connected:  # journaled, one light at a time
+            await self.apply(states)
+            return
+        try:
+            await self._apply_group(states, name)
+        except BridgeError:  # (sending each light its own would be worse)
+            raise
+        except ConnectionError:  # lost the bridge on the way
+            await self.apply(states)
+
+    async def _apply_group(
+        self,
+        states: dict[HueLight, dict[str, Any]],
+        name: str,
+    ) -> None:
+        group_id = await self._ensure_group()
+        how = self._group_write(states, group_id)
+        if how == 'action':
+            state = next(iter(states.values()))  # (every light's)
+            await self._request('PUT', f'/groups/{group_id}/action', state)
+        elif how == 'scene' and not await self._recall_scene(
+            group_id, name, states  # type: ignore
+        ):
+            how = 'apply'
+        if how == 'apply':
+            await self.apply(states)
+        elif how != 'skip':
+            self._group_written(states)
+
+    async def _recall_scene(
+        self,
+        group_id: int,
+        name: str,
+        states: dict[HueLight, dict[str, Any]],
+    ) -> bool:
+        """Recall the scene for the light states on the group, storing it on
+        the bridge first if needed, returning whether it worked"""
+        key = self._scene_key(states)
+        while True:
+            scene_id = self._scenes.get(key)
+            if stored := scene_id is None:  # (stored just now)
+                result = await self._request(
+                    'POST', '/scenes', self._scene_body(name, states)
+                )
+                if (scene_id := self._created_id(result)) is None:
+                    return False
+                self._scenes[key] = scene_id
+            result = await self._request(
+                'PUT', f'/groups/{group_id}/action', {'scene': scene_id}
+            )
+            if self._succeeded(result):
+                return True
+            # the bridge doesn't have the scene anymore (scenes are stored
+            # to be recycled), so store it again, once
+            del self._scenes[key]
+            if stored:
+                return False
+
+    @_timed('reset_lights')
+    async def reset_lights(self) -> None:
+        """Reset the lights to a default warm white color"""
+        # NOTE: these are the default warm white settings from Hue
+        await self.apply_scene(
+            {light: {'hue': 6929, 'sat': 129, 'bri': 254}
+             for light in self.lights.values()}
+        )
+
+    @_timed('all_on')
+    async def all_on(self) -> None:
+        """Turn all the lights on"""
+        await self.apply_scene(
+            {light: {'on': True} for light in self.lights.values()}
+        )
+
+    @_timed('all_off')
+    async def all_off(self) -> None:
+        """Turn all the lights off"""
+        await self.apply_scene(
+            {light: {'on': False} for light in self.lights.values()}
+        )
+
+    def set_color(self, light: HueLight | None, color: str) -> None:
+        if not light or not color:
+            return
+        self.remember_color(light, color)
+        self.queue.put(
+            light.light_id, xy=colors.hex_to_xy(color, self.gamut_of(light))
+        )
+
+    def set_brightness(self, light: HueLight | None, brightness: int) -> None:
+        if not light:
+            return
+        self.queue.put(light.light_id, bri=self._percent_to_bri(brightness))
+
+    def queue_state(self, light: HueLight | None, **attrs: Any) -> None:
+        """Queue state attributes for a light, merged with any writes already
+        waiting for it (like `set_color` and `set_brightness`)"""
+        if light and attrs:
+            self.queue.put(light.light_id, **attrs)
+
+    @property
+    def streaming(self) -> bool:
+        return self.stream is not None
+
+    @_timed('start_streaming')
+    async def start_streaming(
+        self,
+        transport: Transport,
+        rate: float = 25.0,
+    ) -> bool:
+        """Send color and brightness writes as Entertainment API stream
+        frames over `transport` instead of REST requests
+
+        Streaming has no per-command cost on the bridge, so the write queue
+        is sped up to `rate` frames per second. Writes the stream can't carry
+        (on/off, hue/sat...) still go over REST, as does everything if the
+        stream can't be started or later fails. Returns whether streaming
+        started.
+        """
+        if self.stream is not None:
+            return True
+        try:
+            group_id = await self._ensure_stream_group()
+            if group_id is None:
+                return False
+            result = await self._request(
+                'PUT', f'/groups/{group_id}', {'stream': {'active': True}}
+            )
+            if 'success' not in result[0]:
+                return False
+            transport.open()
+        except ConnectionError:  # (the failed request is counted already)
+            return False
+        except OSError as e:  # the DTLS handshake failed
+            BRIDGE_ERRORS.inc(resource='stream', error=type(e).__name__)
+            return False
+        self.stream = HueStream(transport, rate)
+        # start from what the lights are showing
+        for light_id in self.lights:
+            state = self.mirror.get(light_id)
+            self.stream.update(light_id, state.get('xy'), state.get('bri'))
+        self._rest_rate, self.queue.rate = self.queue.rate, rate
+        self._keep_alive = asyncio.create_task(self.stream.keep_alive())
+        return True
+
+    @_timed('stop_streaming')
+    async def stop_streaming(self) -> None:
+        """Go back to sending every write over REST"""
+        if self.stream is None:
+            return
+        if self._keep_alive is not None:
+            self._keep_alive.cancel()
+            self._keep_alive = None
+        self.stream.transport.close()
+        self.stream = None
+        self.queue.rate = self._rest_rate
+        with suppress(ConnectionError):
+            await self._request(
+                'PUT',
+                f'/groups/{self.stream_group_id}',
+                {'stream': {'active': False}},
+            )
+
+    async def _ensure_stream_group(self) -> int | None:
+        """Find or create the entertainment group streaming needs, returning
+        its ID"""
+        async with self._group_lock:
+            return await self._find_stream_group()
+
+    async def _find_stream_group(self) -> int | None:
+        if self.stream_group_id is not None:
+            return self.stream_group_id
+        light_ids = {str(light_id) for light_id in self.lights}
+        if not light_ids:
+            return None
+        groups = await self._request('GET', '/groups')
+        for group_id, group in groups.items():
+            if (
+                group.get('type') == 'Entertainment'
+                and light_ids <= set(group['lights'])
+            ):
+                break
+        else:
+            result = await self._request('POST', '/groups', {
+                'name': f'{self.GROUP_NAME} Stream',
+                'type': 'Entertainment',
+                'class': 'Other',
+                'lights': sorted(light_ids),
+            })
+            if (group_id := self._created_id(result)) is None:
+                return None
+        self.stream_group_id = int(group_id)
+        return self.stream_group_id
+
+    async def _watch(self) -> None:
+        """Refresh the state mirror periodically, and reconnect if the bridge
+        goes away (trying again less and less often while it stays away)"""
+        delay = self.reconnect_delay
+        while True:
+            if self.connected:
+                delay = self.reconnect_delay
+                # until it's time to refresh, or a request fails
+                self._lost.clear()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(
+                        self._lost.wait(), self.refresh_interval
+                    )
+                if self.connected:
+                    await self.check_health()
+                continue
+            await asyncio.sleep(delay)
+            try:
+                async with self._connect_lock:
+                    if not self.connected:
+                        await self.connect()  # (which replays the journal)
+            except ConnectionError:
+                RECONNECTS.inc(result='failed')
+                delay = min(delay * 2, self.max_reconnect_delay)
+            else:
+                RECONNECTS.inc(result='connected')
+
+    def _disconnected(self) -> None:
+        """Note that the bridge stopped answering, and start reconnecting"""
+        self.connected = False
+        self._lost.set()
+        if self._monitor is None or self._monitor.done():
+            self._monitor = asyncio.create_task(self._watch())
+
+    @_timed('send_state')
+    async def _send_state(self, light_id: int, state: dict[str, Any]) -> Any:
+        if not self.connected and self.lights:
+            # the whole state, not just what differs from the (stale)
+            # mirror, so changing something back while offline counts too
+            self.journal.record(light_id, state)
+            WRITES_JOURNALED.inc()
+            return None
+        if not (state := self.mirror.diff(light_id, state)):
+            self.mirror.skip()
+            return None
+        if self.stream is not None and self.stream.error is not None:
+            # stream broke; back to REST
+            BRIDGE_ERRORS.inc(
+                resource='stream', error=type(self.stream.error).__name__
+            )
+            await self.stop_streaming()
+        if self.stream is not None and state.keys() <= self.STREAM_ATTRS:
+            # lights the stream sets at the same time share one message
+            self.stream.update(light_id, state.get('xy'), state.get('bri'))
+            self.stream.send_soon()
+            self.mirror.update(light_id, state)
+            return None
+        try:
+            result = await self._request(
+                'PUT', f'/lights/{light_id}/state', state
+            )
+        except BridgeError:  # turned down, so not worth keeping
+            raise
+        except ConnectionError:  # gone offline; send it when it's back
+            self.journal.record(light_id, state)
+            WRITES_JOURNALED.inc()
+            return None
+        self.mirror.update(light_id, state)
+        return result
+
+    async def _ensure_group(self) -> int | None:
+        """Find or create the bridge group for the lights, returning its ID"""
+        async with self._group_lock:
+            return await self._find_group()
+
+    async def _find_group(self) -> int | None:
+        if self.group_id is not None:
+            return self.group_id
+        if not self.lights:
+            return None
+        groups = await self._request('GET', '/groups')
+        group_id, update = self._match_group(groups)
+        if group_id is None:
+            result = await self._request('POST', '/groups', self._group_body())
+            if (created := self._created_id(result)) is None:
+                return None
+            group_id = int(created)
+        elif update:
+            await self._request('PUT', f'/groups/{group_id}', update)
+        self.group_id = group_id
+        return group_id
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        body: dict[str, Any] | None = None,
+    ) -> Any:
+        """Send a request to the bridge, retrying timeouts and dropped
+        connections with a short backoff"""
+        if self.client is None:
+            raise ConnectionError('Not connected to the Hue bridge')
+        resource = _resource(path)
+        BRIDGE_IN_FLIGHT.inc()
+        try:
+            with BRIDGE_LATENCY.time(method=method, resource=resource):
+                return await self._send_request(method, path, resource, body)
+        finally:
+            BRIDGE_IN_FLIGHT.dec()
+
+    async def _send_request(
+        self,
+        method: str,
+        path: str,
+        resource: str,
+        body: dict[str, Any] | None,
+    ) -> Any:
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.client.request(  # type: ignore
+                    method, path, json=body
+                )
+            except httpx.TransportError as e:  # (timeouts included)
+                BRIDGE_ERRORS.inc(resource=resource, error=type(e).__name__)
+                if attempt == self.retries:
+                    # only a bridge that can't be reached is offline
+                    self._disconnected()
+                    raise ConnectionError(
+                        f'Hue bridge request failed: {e}'
+                    ) from e
+            else:
+                BRIDGE_REQUESTS.inc(
+                    method=method, resource=resource,
+                    status=response.status_code,
+                )
+                if response.is_success:
+                    data = response.json()
+                    _raise_for_errors(data, method, resource)
+                    return data
+                BRIDGE_ERRORS.inc(resource=resource, error='HTTPStatusError')
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or attempt == self.retries
+                ):
+                    raise BridgeError(
+                        f'Hue bridge request failed: HTTP '
+                        f'{response.status_code} for {method} {resource}'
+                    )
+            await asyncio.sleep(0.1 * 2 ** attempt)
+
+    def _base_url(self) -> str:
+        return f'http://{self.bridge_ip}/api/{self.username}'
+
+    async def _load_username(self) -> str:
+        """Read the cached bridge username (shared with phue), or register
+        a new one (the link button on the bridge must have been pressed)"""
+        if found := find_credentials(self.bridge_ip, self.bridge_id):
+            address, login = found
+            if address != self.bridge_ip:  # the bridge has moved
+                save_credentials(
+                    self.bridge_ip, login['username'],
+                    login.get('clientkey'), self.bridge_id,
+                )
+            self.clientkey = login.get('clientkey')
+            return login['username']
+        return await self._register()
+
+    async def _register(self) -> str:
+        """Register a new username on the bridge (the link button on the
+        bridge must have been pressed) and save it"""
+        try:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                response = await client.post(
+                    f'http://{self.bridge_ip}/api',
+                    # a client key is needed for streaming
+                    json={
+                        'devicetype': 'everlight',
+                        'generateclientkey': True,
+                    },
+                )
+        except httpx.TransportError as e:
+            raise ConnectionError(f'Hue bridge request failed: {e}') from e
+        result = response.json()[0]
+        if 'success' not in result:
+            raise ConnectionError(
+                'Press the link button on the Hue bridge and try again'
+            )
+        username = result['success']['username']
+        self.clientkey = result['success'].get('clientkey')
+        save_credentials(
+            self.bridge_ip, username, self.clientkey, self.bridge_id
+        )
+        return username
+
+
+class _QueueGroup:
+    """The write queues of several controllers, seen as one"""
+    def __init__(self, queues: list[AsyncCommandQueue]) -> None:
+        self.queues = queues
+
+    @property
+    def rate(self) -> float:
+        # animations are planned for the whole rig, so go at the slowest
+        # bridge's pace to keep from overrunning any of them
+        return min(queue.rate for queue in self.queues)
+
+    @property
+    def depth(self) -> int:
+        return sum(queue.depth for queue in self.queues)
+
+    def stats(self) -> dict[str, int]:
+        stats = [queue.stats() for queue in self.queues]
+        return {key: sum(queue[key] for queue in stats) for key in stats[0]}
+
+    @contextmanager
+    def hold(self) -> Iterator[None]:
+        """Keep queued writes from being sent until the block exits"""
+        with ExitStack() as stack:
+            for queue in self.queues:
+                stack.enter_context(queue.hold())
+            yield
+
+    async def flush(self) -> None:
+        # (taking every queue's writes at once: gathering the queues' own
+        # flushes would let their workers take some of them first)
+        await asyncio.gather(*(
+            queue._send(*item)
+            for queue in self.queues for item in queue._take_all()
+        ))
+
+
+class MultiBridgeController:
+    """Lights spread over several bridges, controlled as one rig
+
+    Keeps an AsyncLightController (with its own pooled HTTP client, write
+    queue and state mirror) per bridge and routes each light's writes to its
+    bridge, so writes to lights on different bridges go out in parallel and
+    a slow bridge only holds up its own lights. Lights are keyed by their
+    rig-wide IDs from the config, which are mapped to their IDs on each
+    bridge. Works like AsyncLightController, except that it can't stream.
+    """
+    stream = None
+    streaming = False
+
+    def __init__(
+        self,
+        config: Config,
+        journal_path: Path | None = None,
+        **options: Any,
+    ) -> None:
+        self.config = config
+        self.controllers: dict[str, AsyncLightController] = {}
+        # rig-wide light ID -> the bridge the light is on and its config
+        self._routes: dict[int, tuple[str, LightConfig]] = {}
+        for bridge in config.bridges:
+            lights = config.lights_on(bridge)
+            self.controllers[bridge.name] = AsyncLightController(
+                bridge.address,
+                [LightConfig(light.local_id, light.label) for light in lights],
+                bridge_id=bridge.bridge_id,
+                # a journal per bridge, since light IDs are per bridge
+                journal_path=journal_path and journal_path.with_stem(
+                    f'{journal_path.stem}-{bridge.name}'
+                ),
+                **options,
+            )
+            for light in lights:
+                self._routes[light.light_id] = bridge.name, light
+        for controller in self.controllers.values():
+            # (a bridge's lights can come and go as it reconnects)
+            controller.on_connect.append(self._update_lights)
+        self.queue = _QueueGroup(
+            [controller.queue for controller in self.controllers.values()]
+        )
+        # the lights of every connected bridge keyed by rig-wide ID, in order
+        self.lights: dict[int, HueLight] = {}
+        # rig-wide light ID -> the light's controller and its light there
+        self._local: dict[int, tuple[AsyncLightController, HueLight]] = {}
+
+    @property
+    def connected(self) -> bool:
+        """Whether any of the bridges is connected"""
+        return any(
+            controller.connected for controller in self.controllers.values()
+        )
+
+    @property
+    def offline(self) -> bool:
+        """Whether any bridge has dropped off since connecting"""
+        return any(
+            controller.offline for controller in self.controllers.values()
+        )
+
+    async def connect(self) -> None:
+        """Connect to every bridge at once (see `ensure_connected`)"""
+        await self._connect_all(
+            controller.connect for controller in self.controllers.values()
+        )
+
+    async def ensure_connected(self) -> None:
+        """Connect to every bridge that isn't connected yet, at once
+
+        Raises ConnectionError only if none of the bridges can be reached;
+        the lights on the bridges that can't are left out until they can
+        (reconnecting is retried in the background, as for a bridge that
+        drops off later).
+        """
+        await self._connect_all(
+            controller.ensure_connected
+            for controller in self.controllers.values()
+        )
+
+    async def refresh(self) -> None:
+        await asyncio.gather(*(
+            controller.refresh() for controller in self._connected()
+        ))
+
+    async def close(self) -> None:
+        await asyncio.gather(*(
+            controller.close() for controller in self.controllers.values()
+        ))
+
+    async def set_state(self, light: HueLight | None, **attrs: Any) -> None:
+        controller, local = self._route(light)
+        if controller is not None:
+            await controller.set_state(local, **attrs)
+
+    async def apply(
+        self,
+        states: dict[HueLight | None, dict[str, Any]],
+    ) -> None:
+        """Set the state of several lights, every bridge in parallel"""
+        await asyncio.gather(*(
+            controller.apply(local)
+            for controller, local in self._split(states)
+        ))
+
+    async def apply_scene(
+        self,
+        states: dict[HueLight | None, dict[str, Any]],
+        name: str = '',
+    ) -> None:
+        """Set the state of several lights with a group action (or scene) per
+        bridge, every bridge in parallel"""
+        await asyncio.gather(*(
+            controller.apply_scene(local, name)
+            for controller, local in self._split(states)
+        ))
+
+    async def reset_lights(self) -> None:
+        await asyncio.gather(*(
+            controller.reset_lights()
+            for controller in self.controllers.values()
+        ))
+
+    async def all_on(self) -> None:
+        await asyncio.gather(*(
+            controller.all_on() for controller in self.controllers.values()
+        ))
+
+    async def all_off(self) -> None:
+        await asyncio.gather(*(
+            controller.all_off() for controller in self.controllers.values()
+        ))
+
+    def set_color(self, light: HueLight | None, color: str) -> None:
+        controller, local = self._route(light)
+        if controller is not None:
+            controller.set_color(local, color)
+
+    def set_brightness(self, light: HueLight | None, brightness: int) -> None:
+        controller, local = self._route(light)
+        if controller is not None:
+            controller.set_brightness(local, brightness)
+
+    def queue_state(self, light: HueLight | None, **attrs: Any) -> None:
+        controller, local = self._route(light)
+        if controller is not None:
+            controller.queue_state(local, **attrs)
+
+    def to_state(
+        self,
+        color: str | None = None,
+        brightness: int | None = None,
+        light: Any = None,
+        **attrs: Any,
+    ) -> dict[str, Any]:
+        """See `AsyncLightController.to_state`"""
+        controller, local = self._route(light)
+        if controller is None:
+            controller = next(iter(self.controllers.values()))
+        return controller.to_state(color, brightness, light=local, **attrs)
+
+    def brightness_of(self, light: Any, default: int = 100) -> int:
+        controller, local = self._route(light)
+        if controller is None:
+            return default
+        return controller.brightness_of(local, default)
+
+    def color_of(self, light: Any) -> str | None:
+        controller, local = self._route(light)
+        return controller.color_of(local) if controller else None
+
+    def gamut_of(self, light: Any) -> colors.Gamut | None:
+        controller, local = self._route(light)
+        return controller.gamut_of(local) if controller else None
+
+    def preview_of(self, light: Any, color: str) -> str:
+        return colors.preview(color, self.gamut_of(light))
+
+    def remember_color(self, light: Any, color: str) -> None:
+        controller, local = self._route(light)
+        if controller is not None:
+            controller.remember_color(local, color)
+
+    def is_on(self, light: Any, default: bool = True) -> bool:
+        controller, local = self._route(light)
+        return controller.is_on(local, default) if controller else default
+
+    async def _connect_all(
+        self,
+        connects: Iterable[Callable[[], Awaitable[None]]],
+    ) -> None:
+        results = await asyncio.gather(
+            *(connect() for connect in connects), return_exceptions=True
+        )
+        errors = [
+            result for result in results if isinstance(result, BaseException)
+        ]
+        for error in errors:
+            if not isinstance(error, ConnectionError):
+                raise error
+        if errors and len(errors) == len(results):
+            raise errors[0]
+
+    def _update_lights(self) -> None:
+        if self.config.lights:
+            local = {}
+            for light_id, (bridge, config) in self._routes.items():
+                controller = self.controllers[bridge]
+                if (light := controller.lights.get(config.local_id)):
+                    local[light_id] = controller, light
+        else:  # every light on the first bridge
+            controller = self.controllers[self.config.bridges[0].name]
+            local = {
+                light_id: (controller, light)
+                for light_id, light in controller.lights.items()
+            }
+        self._local = local
+        self.lights = {
+            light_id: HueLight(light_id, light.name, light.label)
+            for light_id, (_, light) in local.items()
+        }
+
+    def _connected(self) -> list[AsyncLightController]:
+        return [
+            controller for controller in self.controllers.values()
+            if controller.connected
+        ]
+
+    def _route(self, light: Any) -> tuple[Any, Any]:
+        """The controller a (rig-wide) light is on and the light there"""
+        if not light or light.light_id not in self._local:
+            return None, None
+        return self._local[light.light_id]
+
+    def _split(
+        self,
+        states: dict[Any, dict[str, Any]],
+    ) -> list[tuple[AsyncLightController, dict[Any, dict[str, Any]]]]:
+        """Light states grouped by the controller of their bridge"""
+        split: dict[int, tuple[AsyncLightController, dict]] = {}
+        for light, attrs in states.items():
+            controller, local = self._route(light)
+            if controller is not None:
+                _, bridge_states = split.setdefault(
+                    id(controller), (controller, {})
+                )
+                bridge_states[local] = attrs
+        return list(split.values())
+
+
+def controller_for(
+    config: Config,
+    **options: Any,
+) -> AsyncLightController | MultiBridgeController:
+    """The light controller for a config: an AsyncLightController for a
+    single bridge (unless lights are renumbered), otherwise one across every
+    bridge"""
+    bridge = config.bridges[0]
+    if len(config.bridges) == 1 and all(
+        light.bridge_light_id is None for light in config.lights
+    ):
+        return AsyncLightController(
+            bridge.address, config.lights, bridge_id=bridge.bridge_id,
+            **options,
+        )
+    return MultiBridgeController(config, **options)
 
 
 if __name__ == '__main__':  # TEST
-    lc = LightController('10.0.42.2')
+    config = load_config()
+    lc = LightController(config.bridge_ip, config.lights)
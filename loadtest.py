@@ -0,0 +1,242 @@
+import asyncio
+import json
+import random
+
+from time import monotonic
+from typing import Any
+
+import httpx
+
+from benchmark import _percentile, running_app
+
+# Fires JSON API operations (see api.py) at the app at a steady rate, over
+# HTTP or the WebSocket, and reports how quickly they were answered. With no
+# --url, the app is launched against a fake bridge first, so the report
+# also says how few bridge writes the operations were merged into. Once
+# the load is over, every light is changed one last time and checked, on
+# the app and on the fake bridge, to make sure nothing was lost or sent
+# out of order.
+
+
+def operations(
+    light_ids: list[int],
+    count: int,
+    seed: int = 0,
+) -> list[dict[str, Any]]:
+    """Random light changes, mostly brightness (like dragged sliders) and
+    some color"""
+    rng = random.Random(seed)
+    ops = []
+    for _ in range(count):
+        op: dict[str, Any] = {'op': 'set', 'light': rng.choice(light_ids)}
+        if rng.random() < 0.75:
+            op['brightness'] = rng.randrange(1, 101)
+        else:
+            op['color'] = f'#{rng.randrange(1 << 24):06X}'
+        ops.append(op)
+    return ops
+
+
+async def load(
+    url: str,
+    ops: list[dict[str, Any]],
+    rate: float,
+    batch: int = 1,
+    websocket: bool = False,
+    connections: int = 16,
+) -> dict[str, Any]:
+    """Send `ops` at `rate` operations per second, `batch` to a request,
+    each request on the first free of `connections` connections"""
+    requests = [ops[i:i + batch] for i in range(0, len(ops), batch)]
+    interval = batch / rate
+    latencies: list[float] = []
+    failed = 0
+    free: asyncio.Queue = asyncio.Queue()
+
+    async def send_http(client: httpx.AsyncClient, request: list) -> bool:
+        if len(request) == 1:
+            op = request[0]
+            response = await client.put(
+                f'{url}/api/lights/{op["light"]}', json=_state(op)
+            )
+            return response.status_code == 200
+        response = await client.post(f'{url}/api/batch', json=request)
+        return response.status_code == 200 and all(
+            result['ok'] for result in response.json()['results']
+        )
+
+    async def send_ws(socket: Any, request: list) -> bool:
+        await socket.send(json.dumps(request if batch > 1 else request[0]))
+        answer = json.loads(await socket.recv())
+        results = answer['results'] if batch > 1 else [answer]
+        return all(result['ok'] for result in results)
+
+    async def send(request: list) -> None:
+        nonlocal failed
+        connection = await free.get()
+        start = monotonic()
+        try:
+            ok = await (send_ws if websocket else send_http)(
+                connection, request
+            )
+        except (httpx.HTTPError, OSError, ValueError, KeyError):
+            ok = False
+        finally:
+            free.put_nowait(connection)
+        latencies.append(monotonic() - start)
+        failed += not ok
+
+    if websocket:
+        import websockets  # only needed for this
+        sockets = [
+            await websockets.connect(
+                url.replace('http', 'ws', 1) + '/api/ws'
+            )
+            for _ in range(connections)
+        ]
+        for socket in sockets:
+            free.put_nowait(socket)
+    else:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=connections), timeout=30
+        )
+        for _ in range(connections):
+            free.put_nowait(client)
+    tasks = []
+    start = monotonic()
+    try:
+        for i, request in enumerate(requests):
+            if (delay := start + i * interval - monotonic()) > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(request)))
+        await asyncio.gather(*tasks)
+    finally:
+        if websocket:
+            for socket in sockets:
+                await socket.close()
+        else:
+            await client.aclose()
+    elapsed = monotonic() - start
+    latencies.sort()
+    return {
+        'operations': len(ops),
+        'requests': len(requests),
+        'failed_requests': failed,
+        'operations_per_second': round(len(ops) / elapsed, 1),
+        'latency_ms': {
+            f'p{percent}': round(_percentile(latencies, percent) * 1000, 1)
+            for percent in (50, 95, 99, 100)
+        },
+    }
+
+
+def last_changes(light_ids: list[int], seed: int = 0) -> list[dict[str, Any]]:
+    """A final change of color and brightness for every light"""
+    rng = random.Random(seed + 1)
+    return [
+        {
+            'op': 'set',
+            'light': light_id,
+            'color': f'#{rng.randrange(1 << 24):06X}',
+            'brightness': rng.randrange(1, 101),
+        }
+        for light_id in light_ids
+    ]
+
+
+async def wait_for_lights(url: str, timeout: float = 30.0) -> list[int]:
+    """Wait for the app to be up and connected, returning its light IDs"""
+    start = monotonic()
+    async with httpx.AsyncClient() as client:
+        while monotonic() - start < timeout:
+            try:
+                response = await client.get(f'{url}/api/lights')
+                if lights := response.json()['lights']:
+                    return [light['id'] for light in lights]
+            except (httpx.HTTPError, ValueError, KeyError):
+                pass
+            await asyncio.sleep(0.1)
+    raise TimeoutError('the app did not start in time')
+
+
+def _state(op: dict[str, Any]) -> dict[str, Any]:
+    return {k: v for k, v in op.items() if k not in ('op', 'light')}
+
+
+async def check(url: str, changes: list[dict[str, Any]]) -> int:
+    """Make the `changes` one at a time, returning the number of lights the
+    app then doesn't show as asked"""
+    async with httpx.AsyncClient() as client:
+        for op in changes:
+            await client.put(
+                f'{url}/api/lights/{op["light"]}', json=_state(op)
+            )
+        await asyncio.sleep(1.0)  # let the write queue drain
+        response = await client.get(f'{url}/api/lights')
+    shown = {light['id']: light for light in response.json()['lights']}
+    return sum(
+        any(shown[op['light']].get(k) != v for k, v in _state(op).items())
+        for op in changes
+    )
+
+
+async def main(args: Any) -> dict[str, Any]:
+    url = args.url or f'http://127.0.0.1:{args.port}'
+    light_ids = await wait_for_lights(url)
+    ops = operations(light_ids, int(args.rate * args.duration), args.seed)
+    result = await load(
+        url, ops, args.rate, args.batch, args.websocket, args.connections
+    )
+    # (the operations may have been answered in a different order than
+    # they were sent, so the lights are checked with changes made after)
+    changes = last_changes(light_ids, args.seed)
+    result['lights_not_as_asked'] = await check(url, changes)
+    result['changes'] = changes
+    return result
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='Load test the JSON API')
+    parser.add_argument(
+        '--url', help='a running app (default: launch one against a fake '
+        'bridge)',
+    )
+    parser.add_argument(
+        '--rate', type=float, default=300.0, help='operations per second'
+    )
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument(
+        '--batch', type=int, default=1,
+        help='operations per request (more than 1 uses the batch endpoint)',
+    )
+    parser.add_argument(
+        '--websocket', action='store_true', help='send over /api/ws'
+    )
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--lights', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.03)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.url:
+        result = asyncio.run(main(args))
+    else:
+        with running_app(args.lights, latency=args.latency) as app:
+            bridge, args.port, _ = app
+            result = asyncio.run(main(args))
+            writes = sum(1 for write in bridge.writes if write.via == 'light')
+            result['bridge_light_writes'] = writes
+            result['operations_per_bridge_write'] = round(
+                result['operations'] / max(1, writes), 1
+            )
+            # the brightness each light was last given should have reached
+            # the bridge (colors are adjusted to each bulb's gamut)
+            result['lights_not_as_asked_on_bridge'] = sum(
+                bridge.lights[str(op['light'])]['state']['bri']
+                != int(op['brightness'] / 100 * 254)
+                for op in result['changes']
+            )
+        del result['changes']
+        print(json.dumps(result, indent=2))
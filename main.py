@@ -1,42 +1,348 @@
-import shutil
+import os
 
 from contextlib import suppress
-from dataclasses import dataclass
+from functools import partial
 from multiprocessing import freeze_support  # noqa
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Iterable
 from uuid import uuid4
 
-from nicegui import app, native, ui
-from nicegui.observables import ObservableDict
-
-from lights import LightController
-from randomonster import get_dnd, names, used_names
+from fastapi.responses import PlainTextResponse
+from nicegui import Client, app, core, native, run, ui
+from nicegui.json import dumps
+
+import metrics
+from animations import Animator
+from api import api_router
+from boardstate import BoardState
+from config import CONFIG_PATH, Config, load_config, save_light_ids
+from control import ANIMATIONS, RigControl
+from lights import (
+    BRIDGE_ERRORS, BRIDGE_LATENCY, BRIDGE_REQUESTS, OPERATIONS,
+    WRITES_DROPPED, WRITES_JOURNALED, WRITES_SKIPPED, AsyncLightController,
+    HueLight,
+    MultiBridgeController, controller_for,
+)
+from presets import LightBoardPreset, LightSetting, PresetStore
+from previews import Preview, PreviewCache
+from randomonster import get_dnd, names, refresh_names, used_names
+from scenes import THEMES
+from streaming import UDPTransport
 
 # TODO: better fonts for title, UI
 # TODO: fix help modal position in non-fullscreen viewports
-# TODO: randomizer for colors
 # TODO: easier editing of preset names
-# TODO: import presets (storage-general.json)
-# TODO: preconfigured animations
 # TODO: drag to rearrange presets
-# TODO: add scene transition timeline? Might be verrrry complicated...
-# TODO: custom animations (needs scene timeline probably)
-# TODO: replace lambdas in colorpicker callbacks with proper functions
+# TODO: custom animations (an editor for animations.Timeline)
 # TODO: figure out a better way to have useful functions in '/' besides using
 #       a ton of inner functions
 
 VERSION = '1.1.0'
 
+# served at /metrics (with the controller's, see lights.py)
+UI_CALLBACKS = metrics.Histogram(
+    'everlight_ui_callback_seconds',
+    'Time taken by UI event handlers',
+    ('callback',),
+)
+UI_ERRORS = metrics.Counter(
+    'everlight_ui_callback_errors_total',
+    'UI event handlers that raised',
+    ('callback',),
+)
+UPDATE_BYTES = metrics.Histogram(
+    'everlight_websocket_message_bytes',
+    'Size of the messages sent to browsers, by message type',
+    ('type',),
+    buckets=metrics.SIZE_BUCKETS,
+)
+CLIENTS = metrics.Gauge(
+    'everlight_clients', 'Connected browser clients',
+    function=lambda: len(Client.instances),
+)
+
+
+def ui_callback(name: str) -> Callable:
+    """Decorator timing a UI event handler for the metrics"""
+    return metrics.timed(UI_CALLBACKS, UI_ERRORS, callback=name)
+
+
+def diagnostics() -> list[dict[str, str]]:
+    """Headline numbers from the metrics, for the diagnostics panel"""
+    def ms(histogram: metrics.Histogram, **labels: Any) -> str:
+        return ' / '.join(
+            f'{histogram.quantile(q, **labels) * 1000:.0f}'
+            for q in (0.5, 0.95)
+        ) + ' ms'
+
+    queue = lc.queue.stats()
+    rows = {
+        'Bridge': (
+            'offline (reconnecting)' if lc.offline
+            else 'connected' if lc.connected else 'disconnected'
+        ) + (' (streaming)' if lc.streaming else ''),
+        'Bridge requests': f'{BRIDGE_REQUESTS.total():.0f}',
+        'Bridge latency (p50 / p95)': ms(BRIDGE_LATENCY),
+        'Bridge errors': f'{BRIDGE_ERRORS.total():.0f}',
+        'Writes queued / coalesced / sent': (
+            f'{queue["queued"]} / {queue["coalesced"]} / {queue["sent"]}'
+        ),
+        'Writes pending': str(queue['pending']),
+        'Writes skipped (unchanged)': f'{WRITES_SKIPPED.total():.0f}',
+        'Writes journaled (offline)': f'{WRITES_JOURNALED.total():.0f}',
+        'Writes dropped': f'{WRITES_DROPPED.total():.0f}',
+        'UI callbacks': f'{UI_CALLBACKS.count()}',
+        'UI callback time (p50 / p95)': ms(UI_CALLBACKS),
+        'UI callback errors': f'{UI_ERRORS.total():.0f}',
+        'Updates sent to browsers': (
+            f'{UPDATE_BYTES.count()} '
+            f'({UPDATE_BYTES.sum() / 1024:.0f} KiB)'
+        ),
+        'Clients': str(len(Client.instances)),
+    }
+    # slowest controller operations first
+    for operation in sorted(
+        {operation for operation, in OPERATIONS.label_values()},
+        key=lambda operation: -OPERATIONS.quantile(0.95, operation=operation),
+    ):
+        rows[f'{operation} (p50 / p95)'] = ms(OPERATIONS, operation=operation)
+    return [{'name': name, 'value': value} for name, value in rows.items()]
+
+
+class PresetGrid:
+    """Card showing saved presets, one page at a time
+
+    Cards are keyed by preset name, so saving or deleting a preset only adds,
+    updates or removes that one card instead of rebuilding the whole grid.
+    Each card shows the preset's preview from `preview` (see previews.py).
+    """
+    def __init__(
+        self,
+        on_apply: Callable[[LightBoardPreset], Any],
+        on_delete: Callable[[str], Any],
+        preview: Callable[[LightBoardPreset], Preview],
+        page_size: int = 24,
+    ) -> None:
+        self.on_apply = on_apply
+        self.on_delete = on_delete
+        self.preview = preview
+        self.page_size = page_size
+        self.presets: dict[str, LightBoardPreset] = {}
+        self._cards: dict[str, ui.card] = {}
+        with ui.card().classes('w-full no-shadow') as self.card:
+            ui.markdown("#### Saved Presets").classes('px-4')
+            self.container = ui.row().classes('px-4')
+            self.pagination = ui.pagination(
+                1, 1, direction_links=True, on_change=self._show_page
+            ).classes('px-4')
+        self._refresh_controls()
+
+    @property
+    def page(self) -> int:
+        return self.pagination.value
+
+    def load(self, presets: Iterable[LightBoardPreset]) -> None:
+        """Replace all presets in the grid"""
+        self.presets = {str(preset.name): preset for preset in presets}
+        self._refresh_controls()
+        self._show_page()
+
+    def set(self, preset: LightBoardPreset) -> None:
+        """Add a preset, or update the card of an existing one"""
+        name = str(preset.name)
+        self.presets[name] = preset
+        if name in self._cards:
+            card = self._cards[name]
+            card.clear()
+            with card:
+                self._fill_card(preset)
+        elif name in self._page_names():
+            self._add_card(name)
+        self._refresh_controls()
+
+    def remove(self, name: str) -> None:
+        """Remove a preset and its card"""
+        self.presets.pop(name, None)
+        if (card := self._cards.pop(name, None)) is None:
+            self._refresh_controls()
+            return
+        card.delete()
+        self._refresh_controls()
+        if not self._cards and self.page > 1:
+            self.pagination.value = self.page - 1  # page emptied; go back
+            return
+        # pull in the preset that moved up onto this page, if any
+        for name in self._page_names():
+            if name not in self._cards:
+                self._add_card(name)
+
+    def _page_names(self) -> list[str]:
+        start = (self.page - 1) * self.page_size
+        return list(self.presets)[start:start + self.page_size]
+
+    def _show_page(self) -> None:
+        self.container.clear()
+        self._cards.clear()
+        for name in self._page_names():
+            self._add_card(name)
+
+    def _refresh_controls(self) -> None:
+        # only show the card if there are any presets, and the page picker
+        # if there's more than one page
+        pages = max(1, -(-len(self.presets) // self.page_size))
+        self.card.visible = bool(self.presets)
+        self.pagination.visible = pages > 1
+        if self.pagination.max != pages:
+            self.pagination.max = pages
+            if self.page > pages:
+                self.pagination.value = pages
+
+    def _add_card(self, name: str) -> None:
+        with self.container, ui.card().props('flat bordered') as card:
+            self._fill_card(self.presets[name])
+        self._cards[name] = card
+
+    def _fill_card(self, preset: LightBoardPreset) -> None:
+        preview = self.preview(preset)
+        ui.label(str(preset.name)).classes('text-h6')
+        ui.element('div').classes('w-48 h-12 rounded').style(
+            f'background: {preview.background}'
+        )
+        ui.label(preview.caption).classes('text-caption')
+        with ui.row().classes('justify-between'):
+            ui.button(
+                'Apply',
+                on_click=lambda p=preset: self.on_apply(p)  # type: ignore
+            )
+            ui.button(
+                'Delete',
+                on_click=lambda n=preset.name: self.on_delete(str(n))
+            )
+
+
+class LightCard:
+    """Controls for one light: an on/off switch, a color picker and a
+    brightness slider
+
+    The card shows the light's state in `board`, which it shares with the
+    cards for the same light in every other window: changes made here are
+    sent to the board (and the light), and changes made elsewhere are shown
+    here.
+    """
+    def __init__(
+        self,
+        controller: AsyncLightController | MultiBridgeController,
+        light: HueLight,
+        board: BoardState,
+    ) -> None:
+        self.lc = controller
+        self.light = light
+        self.board = board
+        state = board.get(light.light_id)
+        # last color picked for the light
+        self.color = state.get('color', '')
+        with (
+            ui.card().classes('no-shadow flex-1 min-w-[16rem]'),
+            ui.column().classes('px-4 w-full'),
+        ):
+            ui.markdown(f'#### {light.label or light.name}')
+            on = state.get('on', True)
+            self.switch = ui.switch(
+                'On' if on else 'Off',
+                value=on,
+                on_change=lambda e: self._toggle(e.value),
+            )
+            with (
+                ui.row().classes('w-full'),
+                ui.button(icon='palette').classes('w-full') as self.button
+            ):
+                self.picker = ui.color_picker(
+                    on_pick=lambda e: self._pick(e.color)
+                )
+            # show minimal color picker
+            self.picker.q_color.props('default-view=palette no-header')
+            if self.color:
+                self.show_color(self.color)
+            with ui.row().classes('w-full'):
+                ui.icon('brightness_6', size='1.5rem')
+                self.slider = ui.slider(
+                    min=0,
+                    max=100,
+                    value=state.get('brightness', 100),
+                    on_change=lambda e: self._set_brightness(int(e.value)),
+                ).props('label-always')
+        board.watch(light.light_id, self.show)
+
+    @property
+    def setting(self) -> LightSetting:
+        """Current color and brightness, for saving in a preset"""
+        return LightSetting(self.color or '#FFFFFF', int(self.slider.value))
+
+    def show(self, changes: dict[str, Any]) -> None:
+        """Show changes to the light made in another window (or by the
+        app itself, e.g. applying a preset)"""
+        # NOTE: the switch and slider handlers see that the board already
+        # has these values, so the light isn't set a second time
+        if 'on' in changes:
+            self.switch.value = changes['on']
+            self.switch.text = 'On' if changes['on'] else 'Off'
+        if 'brightness' in changes:
+            self.slider.value = changes['brightness']
+        if 'color' in changes:
+            if changes['color']:
+                self.show_color(changes['color'])
+            else:
+                self.color = ''
+                self.clear_color()
+
+    def show_color(self, color: str) -> None:
+        """Show a color in the picker and on its button"""
+        self.color = color
+        self.picker.set_color(color)
+        # (showing the color the light can actually produce)
+        self.button.style(
+            f'background-color: {self.lc.preview_of(self.light, color)}'
+            ' !important;'
+        )
+        # force update to frontend on client side
+        self.button.update()
+
+    def clear_color(self) -> None:
+        """Restore the picker button to the default primary color"""
+        self.button.style('background-color: var(--q-primary) !important;')
+
+    @ui_callback('toggle')
+    async def _toggle(self, on: bool) -> None:
+        """Turn the light on or off to match the switch"""
+        self.switch.text = 'On' if on else 'Off'
+        if self.board.get(self.light.light_id).get('on') == on:
+            return  # switched to match another window
+        self.board.update(self.light.light_id, self.show, on=on)
+        if trace:
+            trace.record('on', light=self.light.light_id, value=on)
+        await self.lc.set_state(self.light, on=on)
+
+    @ui_callback('pick_color')
+    def _pick(self, color: str) -> None:
+        self.board.update(self.light.light_id, self.show, color=color)
+        if trace:
+            trace.record('color', light=self.light.light_id, value=color)
+        self.lc.set_color(self.light, color)
+        self.show_color(color)
+
+    @ui_callback('set_brightness')
+    def _set_brightness(self, brightness: int) -> None:
+        if self.board.get(self.light.light_id).get('brightness') == brightness:
+            return  # moved to match another window
+        self.board.update(
+            self.light.light_id, self.show, brightness=brightness
+        )
+        if trace:
+            trace.record(
+                'brightness', light=self.light.light_id, value=brightness
+            )
+        self.lc.set_brightness(self.light, brightness)
 
-@dataclass
-class LightBoardPreset:
-    """Dataclass to store a lighting preset"""
-    color1: str
-    brightness1: int
-    color2: str
-    brightness2: int
-    name: Optional[str] = ''
 
 # UI color scheme
 drow = '#6b6b88'
@@ -44,17 +350,105 @@ orc = '#91a32b'
 dragon = '#BE3D20'
 behir = "#5680AD"
 
-with suppress(ConnectionRefusedError):
-    # placeholder for LightController instance
-    lc = LightController('127.0.0.1')
-# FIXME: this is gross, but I can't think of a better way to give the
-# on_shutdown handler access to the lc - it's early and I'm tired
+# the app's own files are kept next to NiceGUI's storage
+data_dir = Path(__file__).resolve().parent / '.nicegui'
+
+# one controller for the whole app, shared by every client; it starts
+# connecting to the bridge as soon as the app is up (without holding up the
+# window) and reconnects on its own after that
+config_path = Path(os.environ.get('EVERLIGHT_CONFIG') or CONFIG_PATH)
+config = load_config(config_path)
+# (or, with several bridges, one per bridge behind a single controller);
+# changes made while the bridge is offline are kept in a journal until it's
+# back
+lc = controller_for(config, journal_path=data_dir / 'journal.ndjson')
+# UI events are recorded to replay with benchmark.py, if asked to
+trace = None
+if trace_path := os.environ.get('EVERLIGHT_TRACE'):
+    from benchmark import TraceRecorder
+    trace = TraceRecorder(Path(trace_path))
+
+# measure the size of every update sent to the browsers (serializing them a
+# second time, which orjson makes cheap)
+metrics.track_messages(core.sio, UPDATE_BYTES, dumps)
+
+# plays animations on the controller's lights (one at a time, for everyone),
+# streamed to them if the config says where to
+animator = Animator(
+    lc,
+    transport=config.stream and partial(
+        UDPTransport, config.stream.host, config.stream.port
+    ),
+    stream_rate=config.stream.rate if config.stream else 25.0,
+)
+
+# what the lights are set to, shown the same in every window
+board = BoardState()
+
+# saved presets, kept in their own database
+# (presets from older versions are for the first two configured lights)
+presets = PresetStore(
+    data_dir / 'presets.sqlite3',
+    legacy_ids=config.light_ids[:2] or (1, 2),
+)
+
+# preset previews in the colors each light can actually show
+previews = PreviewCache(
+    presets, lambda light_id: lc.gamut_of(lc.lights.get(light_id))
+)
+
+# what the UI and the JSON API (at /api, see api.py) do to the lights
+control = RigControl(lc, board, animator, presets)
+app.include_router(api_router(control))
+
+app.add_static_files('/static', 'static')
+
+# update the random preset names in the background once the app is up
+app.on_startup(refresh_names)
+
+
+@app.on_startup
+async def connect_bridge() -> None:
+    """Connect to the bridge in the background, so it's usually done by the
+    time the first page asks (pages show their own progress and errors)"""
+    with suppress(ConnectionError):
+        await lc.ensure_connected()
+        remember_light_ids()
+        control.sync_board()
+        # work out the random scene colors for these lights ahead of time
+        await run.io_bound(control.scenes.prepare, control.gamuts().values())
+
+
+def remember_light_ids() -> None:
+    """Once connected, save the IDs the bridge has for the lights given by
+    name in the light config (as the default one gives the lights older
+    versions used), and give presets from older versions to them"""
+    global config
+    if not config.unresolved:
+        return
+    resolved = Config(config.bridges, lc.config)
+    if resolved.light_ids == config.light_ids:
+        return  # none of them found (yet)
+    config = resolved
+    save_light_ids(config_path, {
+        light.name: light.light_id for light in config.lights
+        if light.name and light.light_id is not None
+    })
+    presets.set_legacy_ids(config.light_ids[:2] or (1, 2))
+
+
+@app.on_startup
+def migrate_presets() -> None:
+    """Move presets saved by older versions out of general storage"""
+    presets.migrate(app.storage.general)
 
 
 @app.on_shutdown
-def cleanup() -> None:
-    if lc is not None and isinstance(lc, LightController):
-        lc.reset_lights()
+async def cleanup() -> None:
+    animator.stop()
+    if lc.connected:
+        await lc.reset_lights()
+    await lc.close()
 
 
 @app.on_page_exception
@@ -66,19 +460,18 @@ def connection_error_page(exception: Exception) -> None:
         ui.label(f'{exception}').classes('text-2xl')
 
 
-@ui.page('/')
-def index() -> None:
-    global lc
-    try:
-        lc = LightController('10.0.42.2')
-    except OSError:  # failed to connect to bridge
-        # NOTE: rasing an exception will put up the NiceGUI error page
-        raise ConnectionError('Check your internet connection and try again')
+@app.get('/metrics')
+def metrics_endpoint() -> PlainTextResponse:
+    """Metrics in the Prometheus text format, for scraping"""
+    return PlainTextResponse(
+        metrics.render(), media_type='text/plain; version=0.0.4'
+    )
 
-    # store last selected colors for each light
-    last_color = dict.fromkeys([lc.D1.name, lc.D2.name], '')  # type: ignore
 
-    app.add_static_files('/static', 'static')
+@ui.page('/')
+async def index() -> None:
+    # NOTE: the page is shown right away; the light controls are added once
+    # the bridge is connected (see `start` at the end)
     ui.query('body').style(
         "background-image: url('static/bg1.jpeg');"
         "background-attachment: fixed;"
@@ -128,89 +521,99 @@ def index() -> None:
             ##### *Presets*
 
             Save your current light settings as a preset, apply saved presets, or delete them. You can provide a name for your preset before saving it, or a random name will be generated.
+
+            ##### *Animations*
+
+            Pick an animation and press play to loop it until you stop it, apply a preset, or reset the lights. "Preset Cycle" fades through your saved presets.
+
+            ##### *Random Scenes*
+
+            Pick a theme and roll the dice for a random scene in it. Roll again until you like it, then save it as a preset.
             """
         )
         ui.button('Okay', on_click=lambda: help_modal.close())
 
-    def reset_lights() -> None:
-        lc.reset_lights()
-        # restore the picker buttons to the default pirmary color
-        picker_1.style('background-color: var(--q-primary) !important;')
-        picker_2.style('background-color: var(--q-primary) !important;')
+    # hidden diagnostics panel, opened with Ctrl+Shift+D
+    with ui.dialog() as diagnostics_panel, ui.card().classes('no-shadow'):
+        ui.markdown('##### Diagnostics')
+        diagnostics_table = ui.table(
+            columns=[
+                {'name': 'name', 'label': 'Metric', 'field': 'name',
+                 'align': 'left'},
+                {'name': 'value', 'label': 'Value', 'field': 'value',
+                 'align': 'right'},
+            ],
+            rows=[],
+            row_key='name',
+        ).props('dense flat')
+        ui.link('All metrics', '/metrics', new_tab=True).classes('text-sm')
+
+    def show_diagnostics() -> None:
+        diagnostics_table.rows = diagnostics()
+
+    def open_diagnostics(e: Any) -> None:
+        if (
+            e.action.keydown and e.modifiers.ctrl and e.modifiers.shift
+            and e.key == 'KeyD'
+        ):
+            show_diagnostics()
+            diagnostics_panel.open()
+
+    # (only refreshed while it's open)
+    diagnostics_panel.bind_value_to(
+        ui.timer(1.0, show_diagnostics, active=False), 'active'
+    )
+
+    ui.keyboard(on_key=open_diagnostics)
+
+    @ui_callback('reset_lights')
+    async def reset_lights() -> None:
+        stop_animation()
+        await control.reset()
         ui.notify('Lights reset', type='info')
 
+    @ui_callback('save_preset')
     def save_preset() -> None:
         """Save the current light settings as a preset in user storage"""
         preset = LightBoardPreset(
-            color1=last_color.get(lc.D1.name, '#FFFFFF'),  # type: ignore
-            brightness1=brightness_1.value,
-            color2=last_color.get(lc.D2.name, '#FFFFFF'),  # type: ignore
-            brightness2=brightness_2.value,
+            lights={
+                light_id: card.setting
+                for light_id, card in light_cards.items()
+            },
             # use the user-provided name for the preset, or a random monster
             # name, or if all else fails, a random UUID segment
             name=preset_name.value or get_dnd() or uuid4().hex[:8].upper(),
         )
         if preset_name.value:
             preset_name.value = ''  # clear preset name input on save
-        app.storage.general[preset.name] = preset  # store preset
+        previews.save(preset)  # store preset (and its preview)
         ui.notify('Preset saved!', type='positive')
-        show_presets()
-
-    def show_presets() -> None:
-        """Display saved presets from user storage"""
-        if app.storage.general:  # show presets card if any presets are saved
-            print(app.storage.general)  # DEBUG
-            presets_card.visible = True
-        else:  # otherwise hide the card
-            presets_card.visible = False
-            return
-        preset_container.clear()
-        for name, preset in app.storage.general.items():
-            if isinstance(preset, ObservableDict):
-                # convert ObservableDict back to LightBoardPreset dataclass
-                preset = LightBoardPreset(**preset)
-            elif isinstance(preset, str):
-                return
-            with preset_container, ui.card().props('flat bordered'):
-                ui.markdown(f'##### {preset.name}')
-                with ui.row().classes('items-center'):
-                    ui.icon('circle', color=preset.color1, size='3rem')
-                    ui.label(f'Brightness: {preset.brightness1}')
-                with ui.row().classes('items-center'):
-                    ui.icon('circle', color=preset.color2, size='3rem')
-                    ui.label(f'Brightness: {preset.brightness2}')
-                with ui.row().classes('justify-between'):
-                    ui.button(
-                        'Apply',
-                        on_click=(
-                            lambda p=preset: apply_preset(p)  # type: ignore
-                        )
-                    )
-                    ui.button(
-                        'Delete',
-                        on_click=lambda n=name: delete_preset(str(n))
-                    )
-
-    def apply_preset(preset: LightBoardPreset) -> None:
+        preset_grid.set(preset)
+
+    @ui_callback('apply_preset')
+    async def apply_preset(preset: LightBoardPreset) -> None:
         """Set the lights to the given preset"""
-        # set light colors
-        lc.set_color(lc.D1, preset.color1)
-        lc.set_color(lc.D2, preset.color2)
-        # set color picker button backgrounds
-        picker_1.style(f'background-color: {preset.color1} !important;')
-        picker_2.style(f'background-color: {preset.color2} !important;')
-        # set color picker vaulues
-        p1.set_color(preset.color1)
-        p2.set_color(preset.color2)
-        # set brightness sliders (also sets actual light brightness)
-        brightness_1.value = preset.brightness1
-        brightness_2.value = preset.brightness2
-        # force update to frontend on client side
-        picker_2.update()
-        picker_1.update()
+        stop_animation()
+        if trace:
+            trace.record('preset', **preset.to_dict())
+        await control.apply_preset(preset)
         # notify user
         ui.notify('Preset applied', type='info', color='primary')
 
+    @ui_callback('roll_scene')
+    async def roll_scene(theme: str) -> None:
+        """Set the lights to a random scene in the chosen theme"""
+        stop_animation()
+        try:
+            scene = await control.roll_scene(theme)
+        except ValueError as e:
+            ui.notify(str(e), type='negative')
+            return
+        if trace:
+            trace.record('preset', **scene.to_dict())
+        ui.notify(f'{scene.name} scene rolled', type='info')
+
+    @ui_callback('delete_preset')
     async def delete_preset(name: str) -> None:
         """Delete the preset with the given name from storage"""
         with ui.dialog() as dialog, ui.card().classes('no-shadow'):
@@ -232,170 +635,261 @@ def index() -> None:
                 )
 
         # choice = await dialog
-        if await dialog == 'Yes' and name in app.storage.general:
-            del app.storage.general[name]
+        if await dialog == 'Yes' and presets.delete(name):
             if name in used_names:
                 used_names.remove(name)
                 names.add(name)
             ui.notify( f'Preset "{name}" deleted', color='negative')
-            show_presets()
+            preset_grid.remove(name)
 
-    def export_presets() -> None:
+    @ui_callback('export_presets')
+    async def export_presets() -> None:
         """Export presets to the Downloads folder"""
-        # resolve path inside the app bundle
-        basepath = Path(__file__).resolve().parent
-        storage_path = basepath / '.nicegui' / 'storage-general.json'
-
-        if not storage_path.exists():
-            ui.notify(
-                f'Storage file not found at: {storage_path}',
-                type='negative'
-            )
+        if not len(presets):
+            ui.notify('There are no presets to export', type='negative')
             return
 
-        downloads_folder = Path.home() / 'Downloads'
-        shutil.copy(storage_path, downloads_folder)
-        destination = downloads_folder / 'Everlight Presets.json'
-        shutil.move(downloads_folder / 'storage-general.json', destination)
-
-        if destination.exists():
-            ui.notify('Presets exported to Downloads folder!', type='positive')
-        else:
+        destination = Path.home() / 'Downloads' / 'Everlight Presets.ndjson'
+        try:
+            # NOTE: written one preset at a time and moved into place when done
+            await run.io_bound(presets.export_file, destination)
+        except OSError:
             ui.notify('Exporting presets failed', type='negative')
+        else:
+            ui.notify('Presets exported to Downloads folder!', type='positive')
 
-    def import_presets() -> None:  # TODO: implement importing
-        """Import a presets file"""
-        # resolve path inside the app bundle
-        basepath = Path(__file__).resolve().parent
-        storage_path = basepath / '.nicegui' / 'storage-general.json'
+    @ui_callback('import_presets')
+    async def import_presets() -> None:
+        """Merge the presets from an exported (or storage-general.json) file
+        into the saved presets"""
+        if app.native.main_window is None:
+            ui.notify('Importing needs the Everlight app', type='negative')
+            return
+        paths = await app.native.main_window.create_file_dialog(
+            directory=str(Path.home() / 'Downloads'),
+            file_types=('Everlight presets (*.ndjson;*.json)',),
+        )
+        if not paths:
+            return
 
-    # main UI layout
-    # REFACTOR: the light controls are essentially identical for both lights;
-    # maybe they could be a class (or whaterver nicegui uses for reusable
-    # UI components?)
-    with ui.row(wrap=False).classes('w-full'):
-        # light 1 controls
-        with ui.card().classes('no-shadow w-full'), ui.column().classes('px-4 w-full'):
-            ui.markdown("#### Light 1")
-            on_off_1 = ui.switch(
-                'On',
-                value=True,
-                on_change=lambda e: [
-                    setattr(lc.D1, 'on', e.value),
-                    setattr(on_off_1, 'text', 'On' if e.value else 'Off')
-                ]
+        with ui.dialog() as dialog, ui.card().classes('no-shadow'):
+            ui.markdown('##### Import Presets')
+            ui.label('When a preset with the same name already exists:')
+            conflict = ui.radio(
+                {
+                    'rename': 'Import it with a random name',
+                    'overwrite': 'Replace the existing preset',
+                    'skip': 'Keep the existing preset',
+                },
+                value='rename',
             )
-
-            with (
-                ui.row().classes('w-full'),
-                ui.button(icon='palette').classes('w-full') as picker_1
-            ):
-                p1 = ui.color_picker(
-                    on_pick=lambda e: [
-                        lc.set_color(lc.D1, e.color),
-                        print(e),
-                        picker_1.style(
-                            f'background-color: {e.color} !important;'
-                        ),
-                        last_color.update(
-                            {lc.D1.name: e.color}  # type: ignore
-                        ),
-                    ]
+            with ui.row():
+                ui.button(
+                    'Import',
+                    on_click=lambda: dialog.submit(conflict.value),
                 )
-            # show minimal color picker
-            p1.q_color.props('default-view=palette no-header')
-            with ui.row().classes('w-full'):
-                ui.icon('brightness_6', size='1.5rem')
-                brightness_1 = ui.slider(
-                    min=0,
-                    max=100,
-                    value=100,
-                    on_change=lambda e: lc.set_brightness(lc.D1, int(e.value)),
-                ).props('label-always')
+                ui.button('Cancel', on_click=lambda: dialog.submit(None))
+        if (on_conflict := await dialog) is None:
+            return
 
-        # light 2 controls
-        with ui.card().classes('no-shadow w-full'), ui.column().classes('px-4 w-full'):
-            ui.markdown("#### Light 2")
-            on_off_2 = ui.switch(
-                'On',
-                value=True,
-                on_change=lambda e: [
-                    setattr(lc.D2, 'on', e.value),
-                    setattr(on_off_2, 'text', 'On' if e.value else 'Off')
-                ]
+        try:
+            # parsed, validated and saved one preset at a time, in one
+            # transaction (so nothing is saved if the file is broken)
+            counts = await run.io_bound(
+                presets.import_file, Path(paths[0]), on_conflict, get_dnd
             )
-            with (
-                ui.row().classes('w-full'),
-                ui.button(icon='palette').classes('w-full') as picker_2
-            ):
-                p2 = ui.color_picker(
-                    on_pick=lambda e: [
-                        lc.set_color(lc.D2, e.color),
-                        picker_2.style(
-                            f'background-color: {e.color} !important;'
-                        ),
-                        last_color.update(
-                            {lc.D2.name: e.color}  # type: ignore
-                        ),
-                    ]
-                )
-                # show minimal color picker
-                p2.q_color.props('default-view=palette no-header')
-            with ui.row().classes('w-full'):
-                ui.icon('brightness_6', size='1.5rem')
-                brightness_2 = ui.slider(
-                    min=0,
-                    max=100,
-                    value=100,
-                    on_change=lambda e: lc.set_brightness(lc.D2, int(e.value)),
-                ).props('label-always')
+        except (OSError, ValueError) as e:
+            ui.notify(f'Importing presets failed: {e}', type='negative')
+            return
+        preset_grid.load(presets)
+        imported = counts['added'] + counts['overwritten'] + counts['renamed']
+        message = f'Imported {imported} presets'
+        if counts['skipped']:
+            message += f', skipped {counts["skipped"]} existing'
+        if counts['invalid']:
+            message += f', ignored {counts["invalid"]} invalid'
+        ui.notify(message, type='positive')
+
+    @ui_callback('switch_all')
+    def switch_all(on: bool) -> None:
+        """Flip every light's switch (which turns the light on or off)"""
+        for card in light_cards.values():
+            card.switch.value = on
+
+    @ui_callback('play_animation')
+    def play_animation(name: str) -> None:
+        """Start looping the chosen animation on every light"""
+        try:
+            timeline = control.play(name)
+        except ValueError as e:
+            ui.notify(str(e), type='negative')
+            return
+        if trace:
+            trace.record('animation', name=name.lower())
+        ui.notify(f'Playing {timeline.name}', type='info')
+
+    @ui_callback('stop_animation')
+    def stop_animation() -> None:
+        if trace and animator.playing:
+            trace.record('stop')
+        control.stop()
+
+    def show_animation_stats() -> None:
+        if animator.timeline is None:
+            return
+        stats = animator.stats.summary()
+        animation_stats.text = (
+            f'{animator.timeline.name}'
+            f'{"" if animator.playing else " (stopped)"}: '
+            f'{stats["frames"]} frames, {stats["dropped"]} dropped, '
+            f'{stats["jitter_p95_ms"]:.0f} ms jitter (p95)'
+        )
+
+    async def start() -> None:
+        """Wait for the bridge (showing progress in place of the light
+        controls), then add the controls and saved presets"""
+        connecting.visible = True
+        connect_failed.visible = False
+        progress.text = 'Connecting to the Hue bridge...'
+        try:
+            # (once connected, the controls keep working while the bridge is
+            # offline, so there's no waiting for it to come back)
+            if not lc.offline:
+                await lc.ensure_connected()
+        except ConnectionError:  # failed to connect to bridge
+            connecting.visible = False
+            connect_failed.visible = True
+            return
+        remember_light_ids()
+        if light_cards:
+            return  # already started (retried while still connecting)
+        progress.text = 'Loading presets...'
+        preset_grid.load(presets)
+        if not board.lights:  # connected since the app started
+            control.sync_board()
+            await run.io_bound(
+                control.scenes.prepare, control.gamuts().values()
+            )
+        show_lights()
+
+    def show_lights() -> None:
+        """Show a card per light in place of the progress, and again
+        whenever the lights change (e.g. a bridge that couldn't be reached
+        at first connects)"""
+        if lights_changed.active and set(light_cards) == set(lc.lights):
+            return
+        remember_light_ids()
+        if not set(lc.lights) <= set(board.lights):
+            control.sync_board()
+        stop_watching()
+        light_cards.clear()
+        light_row.clear()
+        with light_row:
+            light_cards.update({
+                light_id: LightCard(lc, light, board)
+                for light_id, light in lc.lights.items()
+            })
+        # (lights come and go as bridges reconnect)
+        lights_changed.activate()
+
+    def stop_watching() -> None:
+        for card in light_cards.values():
+            board.unwatch(card.show)
+
+    # main UI layout
+    # shown while the bridge is offline; changes made meanwhile are sent
+    # once it's back
+    with ui.row().classes('items-center px-4 text-warning') as offline:
+        ui.icon('wifi_off', size='sm')
+        ui.label(
+            'The Hue bridge is offline. Your changes will be made once it '
+            'reconnects.'
+        )
+    offline.bind_visibility_from(lc, 'offline')
+    # one card of controls per light, wrapping onto more rows as needed
+    light_cards: dict[int, LightCard] = {}
+    with ui.row().classes('w-full') as light_row:
+        with ui.row().classes('items-center px-4') as connecting:
+            ui.spinner(size='lg')
+            progress = ui.label()
+        with ui.row().classes('items-center px-4') as connect_failed:
+            ui.icon('wifi_off', size='lg')
+            ui.label('Check your internet connection and try again')
+            ui.button('Retry', on_click=start)
+        connect_failed.visible = False  # (until connecting does)
+    lights_changed = ui.timer(1.0, show_lights, active=False)
 
     # global controls
     with ui.row():
         ui.button('Reset', on_click=reset_lights)
-        # FIXME: I'm almost 100% sure setattr isn't the right way to do this
-        ui.button('All On', on_click=(
-            lambda _: [
-                setattr(on_off_1, 'value', True),
-                setattr(on_off_2, 'value', True)
-            ]
-        ))
-        ui.button('All Off', on_click=(
-            lambda _: [
-                setattr(on_off_1, 'value', False),
-                setattr(on_off_2, 'value', False)
-            ]
-        ))
+        ui.button('All On', on_click=lambda: switch_all(True))
+        ui.button('All Off', on_click=lambda: switch_all(False))
         ui.separator().props('vertical')
         ui.button('Save as Preset', on_click=save_preset)
         ui.button('Export Presets', on_click=export_presets)
+        ui.button('Import Presets', on_click=import_presets)
+    # animation controls
+    with ui.row().classes('items-center'):
+        animation = ui.select(
+            list(ANIMATIONS),
+            value='Candle',
+            label='Animation',
+        ).classes('w-40')
         ui.button(
-            'Import Presets',
-            on_click=import_presets
-        ).props('disabled').tooltip('Coming soon!')
+            icon='play_arrow',
+            on_click=lambda: play_animation(animation.value),
+        )
+        ui.button(icon='stop', on_click=stop_animation)
+        animation_stats = ui.label().classes('text-sm text-gray-400')
+        ui.timer(1.0, show_animation_stats)
+    # random scenes
+    with ui.row().classes('items-center'):
+        theme = ui.select(
+            {name: name.title() for name in THEMES},
+            value='underdark',
+            label='Random Scene',
+        ).classes('w-40')
+        ui.button(icon='casino', on_click=lambda: roll_scene(theme.value))
     with ui.row().classes('w-1/4'):
         preset_name = ui.input(
             'Preset Name (optional):',
             # placeholder=choice(list(names)),
         ).classes('w-full')
 
-    with ui.card().classes('w-full no-shadow') as presets_card:
-        ui.markdown("#### Saved Presets").classes('px-4')
-        preset_container = ui.row().classes('px-4')
-    show_presets()
+    preset_grid = PresetGrid(
+        on_apply=apply_preset, on_delete=delete_preset, preview=previews.get
+    )
+    ui.context.client.on_delete(stop_watching)
+
+    # send the page first, then connect and fill it in
+    try:
+        await ui.context.client.connected(timeout=30)
+    except TimeoutError:
+        return  # the page was never opened
+    await start()
 
 
 if __name__ in {'__main__', '__mp_main__'}:
     freeze_support()  # noqa
     app.native.window_args['resizable'] = True
     # app.native.start_args['debug'] = True
+    if port := int(os.environ.get('EVERLIGHT_PORT') or 0):
+        # a plain web server with no window, e.g. for the startup benchmark
+        # (see benchmark.py) or to open the app on another device
+        window: dict[str, Any] = dict(
+            native=False, show=False, reload=False, port=port
+        )
+    else:
+        window = dict(
+            fullscreen=True,
+            native=True,
+            window_size=(1000, 625),
+            port=native.find_open_port(),
+        )
     ui.run(
         # reload=True,
         title='Everlight - D&D Lightboard',
-        fullscreen=True,
         dark=True,
         # storage_secret='lightboard_secret',
-        native=True,
-        window_size=(1000, 625),
-        port=native.find_open_port()
+        **window,
     )
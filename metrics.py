@@ -0,0 +1,287 @@
+import inspect
+import json
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+from typing import Any, Callable, Iterator, TypeVar
+
+# Minimal Prometheus-style metrics, so the app can report on itself without
+# pulling in a metrics library; `render` produces the text exposition format
+# served at /metrics
+
+F = TypeVar('F', bound=Callable[..., Any])
+Labels = tuple[str, ...]
+
+# seconds; bridge requests take tens of milliseconds when all is well
+TIME_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0,
+)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+REGISTRY: list['_Metric'] = []
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict[str, Any]) -> Labels:
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _format(self, key: Labels, extra: str = '') -> str:
+        pairs = [
+            f'{label}="{_escape(value)}"'
+            for label, value in zip(self.labels, key)
+        ]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def label_values(self) -> list[Labels]:
+        """Every set of label values seen so far"""
+        return list(self._values)  # type: ignore
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.description}'
+        yield f'# TYPE {self.name} {self.kind}'
+
+
+class Counter(_Metric):
+    """A count that only goes up"""
+    kind = 'counter'
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+    ) -> None:
+        super().__init__(name, description, labels)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        """Sum over every set of labels"""
+        return sum(self._values.values())
+
+    def render(self) -> Iterator[str]:
+        yield from super().render()
+        for key, value in list(self._values.items()):
+            yield f'{self.name}{self._format(key)} {_number(value)}'
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, either set directly or read from
+    `function` whenever the metrics are rendered"""
+    kind = 'gauge'
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        function: Callable[[], float] | None = None,
+    ) -> None:
+        super().__init__(name, description, labels)
+        self.function = function
+        self._values: dict[Labels, float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: Any) -> float:
+        if self.function is not None:
+            return self.function()
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> Iterator[str]:
+        yield from super().render()
+        if self.function is not None:
+            yield f'{self.name} {_number(self.function())}'
+            return
+        for key, value in list(self._values.items()):
+            yield f'{self.name}{self._format(key)} {_number(value)}'
+
+
+class Histogram(_Metric):
+    """Counts of observed values (e.g. durations) in cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = TIME_BUCKETS,
+    ) -> None:
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+        # per label set: [count in each bucket (plus +Inf)], sum
+        self._values: dict[Labels, tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0)
+            )
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = counts, total + value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observe how long the block takes"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def count(self, **labels: Any) -> int:
+        """Number of observations, over every set of labels if none given"""
+        return sum(sum(counts) for counts, _ in self._select(labels))
+
+    def sum(self, **labels: Any) -> float:
+        return sum(total for _, total in self._select(labels))
+
+    def quantile(self, q: float, **labels: Any) -> float:
+        """Estimate a quantile (0-1) from the buckets, over every set of
+        labels if none given"""
+        counts = [0] * (len(self.buckets) + 1)
+        for values, _ in self._select(labels):
+            counts = [a + b for a, b in zip(counts, values)]
+        if not (total := sum(counts)):
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):  # past the last bucket
+                    return self.buckets[-1]
+                low = self.buckets[i - 1] if i else 0.0
+                return low + (self.buckets[i] - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def _select(self, labels: dict[str, Any]) -> list[tuple[list[int], float]]:
+        if not labels:
+            return list(self._values.values())
+        value = self._values.get(self._key(labels))
+        return [value] if value else []
+
+    def render(self) -> Iterator[str]:
+        yield from super().render()
+        for key, (counts, total) in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield (
+                    f'{self.name}_bucket{self._format(key, le)} {cumulative}'
+                )
+            cumulative += counts[-1]
+            inf = self._format(key, 'le="+Inf"')
+            yield f'{self.name}_bucket{inf} {cumulative}'
+            yield f'{self.name}_sum{self._format(key)} {_number(total)}'
+            yield f'{self.name}_count{self._format(key)} {cumulative}'
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format"""
+    return '\n'.join(
+        line for metric in REGISTRY for line in metric.render()
+    ) + '\n'
+
+
+def timed(
+    histogram: Histogram,
+    errors: Counter | None = None,
+    **labels: Any,
+) -> Callable[[F], F]:
+    """Decorator timing every call of a function (or coroutine function) in
+    `histogram`, and counting the calls that raise in `errors`"""
+    def decorate(function: F) -> F:
+        if inspect.iscoroutinefunction(function):
+            @wraps(function)
+            async def timed_async(*args: Any, **kwargs: Any) -> Any:
+                start = perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(**labels)
+                    raise
+                finally:
+                    histogram.observe(perf_counter() - start, **labels)
+            return timed_async  # type: ignore
+
+        @wraps(function)
+        def timed_sync(*args: Any, **kwargs: Any) -> Any:
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(**labels)
+                raise
+            finally:
+                histogram.observe(perf_counter() - start, **labels)
+        return timed_sync  # type: ignore
+    return decorate
+
+
+def track_messages(
+    server: Any,
+    histogram: Histogram,
+    dumps: Callable[[Any], str | bytes] = json.dumps,
+) -> None:
+    """Observe the (serialized) size of every message a socket.io server
+    emits, by message type"""
+    emit = server.emit
+
+    @wraps(emit)
+    async def emit_tracked(event: str, data: Any = None, *args, **kwargs):
+        histogram.observe(len(dumps(data)), type=event)
+        return await emit(event, data, *args, **kwargs)
+
+    server.emit = emit_tracked
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _escape(value: str) -> str:
+    return (
+        value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+    )
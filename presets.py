@@ -0,0 +1,548 @@
+import json
+import os
+import re
+import sqlite3
+
+from collections.abc import (
+    Callable, Container, Iterable, Iterator, Mapping, MutableMapping,
+    Sequence,
+)
+from contextlib import suppress
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from threading import RLock
+from typing import Any, Literal, Optional, TextIO
+
+Conflict = Literal['skip', 'overwrite', 'rename']
+
+_hex_color = re.compile(r'#[0-9a-fA-F]{6}')
+# what can follow the start of a JSON number and still be part of it
+_number_tail = re.compile(r'[0-9.eE+-]*')
+
+# what presets are made of, including those from older versions
+_PRESET_FIELDS = frozenset(
+    ('name', 'lights', 'color1', 'brightness1', 'color2', 'brightness2')
+)
+
+
+# bridge IDs of the two lights that presets from before the light config
+# (with color1/brightness1 and color2/brightness2) were made for
+LEGACY_LIGHT_IDS = (1, 2)
+# color of a light in those presets if its picker was never touched (which
+# they saved as '')
+LEGACY_COLOR = '#FFFFFF'
+
+
+@dataclass(slots=True)
+class LightSetting:
+    """Color and brightness of one light in a preset"""
+    color: str
+    brightness: int
+
+
+@dataclass(slots=True)
+class LightBoardPreset:
+    """Dataclass to store a lighting preset"""
+    lights: dict[int, LightSetting]  # keyed by the light's bridge ID
+    name: Optional[str] = ''
+
+    @classmethod
+    def from_dict(
+        cls,
+        data: Mapping[str, Any],
+        legacy_ids: Sequence[int] = LEGACY_LIGHT_IDS,
+    ) -> 'LightBoardPreset':
+        """Build a preset from a mapping (e.g. decoded JSON), ignoring any
+        unknown keys
+
+        Two-light presets from older versions are given to the lights in
+        `legacy_ids`.
+        """
+        if 'lights' not in data:
+            data = {**data, 'lights': _legacy_lights(data, legacy_ids)}
+        return cls(
+            lights={
+                int(light_id): LightSetting(**setting)
+                for light_id, setting in data['lights'].items()
+            },
+            name=data.get('name', ''),
+        )
+
+    @classmethod
+    def validate(
+        cls,
+        data: Any,
+        name: str | None = None,
+        legacy_ids: Sequence[int] = LEGACY_LIGHT_IDS,
+    ) -> 'LightBoardPreset':
+        """Build a preset from untrusted data (e.g. an imported file),
+        raising ValueError if it isn't a valid preset"""
+        if not isinstance(data, Mapping):
+            raise ValueError('preset must be an object')
+        data = {**data, 'name': data.get('name') or name}
+        if 'lights' not in data:
+            data['lights'] = _legacy_lights(data, legacy_ids)
+        lights = data['lights']
+        if not isinstance(lights, Mapping) or not lights:
+            raise ValueError('preset must set at least one light')
+        for light_id, setting in lights.items():
+            if not str(light_id).isdigit():
+                raise ValueError(f'{light_id!r} is not a light ID')
+            if not isinstance(setting, Mapping):
+                raise ValueError(f'light {light_id} must be an object')
+            color = setting.get('color')
+            if not isinstance(color, str) or not _hex_color.fullmatch(color):
+                raise ValueError(
+                    f'light {light_id} color must be a hex color like #A1B2C3'
+                )
+            brightness = setting.get('brightness')
+            if type(brightness) is not int or not 0 <= brightness <= 100:
+                raise ValueError(
+                    f'light {light_id} brightness must be a whole number '
+                    'from 0-100'
+                )
+        if not isinstance(data['name'], str) or not data['name'].strip():
+            raise ValueError('preset must have a name')
+        return cls(
+            lights={
+                int(light_id): LightSetting(
+                    setting['color'], setting['brightness']
+                )
+                for light_id, setting in lights.items()
+            },
+            name=data['name'],
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'name': self.name,
+            # JSON object keys are strings
+            'lights': {
+                str(light_id): asdict(setting)
+                for light_id, setting in self.lights.items()
+            },
+        }
+
+
+def _legacy_lights(
+    data: Mapping[str, Any],
+    legacy_ids: Sequence[int],
+) -> dict[str, Any]:
+    """`lights` for a preset with color1/brightness1/color2/brightness2"""
+    lights = {}
+    for n, light_id in enumerate(legacy_ids[:2], start=1):
+        if f'color{n}' in data or f'brightness{n}' in data:
+            lights[str(light_id)] = {
+                'color': data.get(f'color{n}') or LEGACY_COLOR,
+                'brightness': data.get(f'brightness{n}'),
+            }
+    return lights
+
+
+class PresetStore:
+    """Saved presets, indexed by name in memory and persisted to SQLite
+
+    Every preset is one row keyed by its name, so saving or deleting a preset
+    writes just that row no matter how many presets there are. Presets keep
+    the order they were first saved in. Two-light presets saved by older
+    versions are kept as they were (until saved again) and given to the
+    lights in `legacy_ids`. Each preset can have a preview (see previews.py)
+    saved with it.
+
+    Changes are serialized by a lock, so files can be imported on another
+    thread while the UI saves presets.
+    """
+    def __init__(
+        self,
+        path: Path,
+        legacy_ids: Sequence[int] = LEGACY_LIGHT_IDS,
+    ) -> None:
+        self.path = path
+        self.legacy_ids = tuple(legacy_ids)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # autocommit; each statement is its own (small) transaction
+        self._db = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        self._lock = RLock()
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS presets ('
+            'name TEXT PRIMARY KEY, data TEXT NOT NULL, preview TEXT)'
+        )
+        columns = {
+            row[1] for row in self._db.execute('PRAGMA table_info(presets)')
+        }
+        if 'preview' not in columns:  # made by an older version
+            self._db.execute('ALTER TABLE presets ADD COLUMN preview TEXT')
+        self._index: dict[str, LightBoardPreset] = {}
+        self._previews: dict[str, Any] = {}
+        for name, data, preview in self._db.execute(
+            'SELECT name, data, preview FROM presets ORDER BY rowid'
+        ):
+            self._index[name] = LightBoardPreset.from_dict(
+                json.loads(data), legacy_ids
+            )
+            if preview is not None:
+                with suppress(ValueError):
+                    self._previews[name] = json.loads(preview)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._index
+
+    def __iter__(self) -> Iterator[LightBoardPreset]:
+        return iter(list(self._index.values()))
+
+    def get(self, name: str) -> LightBoardPreset | None:
+        return self._index.get(name)
+
+    def preview(self, name: str) -> Any:
+        """The preview saved with a preset, if any"""
+        return self._previews.get(name)
+
+    def save(self, preset: LightBoardPreset, preview: Any = None) -> None:
+        """Add a preset, or replace the one with the same name (and its
+        preview)"""
+        with self._lock:
+            self._write(preset, preview, self._index, self._previews)
+
+    def _write(
+        self,
+        preset: LightBoardPreset,
+        preview: Any,
+        index: dict[str, LightBoardPreset],
+        previews: dict[str, Any],
+        data: Mapping[str, Any] | None = None,
+    ) -> None:
+        """Write a preset's row (with `data` in place of the preset's own,
+        if given) and add it to `index` and `previews`"""
+        name = str(preset.name)
+        self._db.execute(
+            'INSERT INTO presets (name, data, preview) VALUES (?, ?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET data = excluded.data, '
+            'preview = excluded.preview',
+            (
+                name, json.dumps(preset.to_dict() if data is None else data),
+                None if preview is None else json.dumps(preview),
+            ),
+        )
+        index[name] = preset
+        if preview is None:
+            previews.pop(name, None)
+        else:
+            previews[name] = preview
+
+    def set_preview(self, name: str, preview: Any) -> None:
+        """Save a new preview for a preset"""
+        with self._lock:
+            if name not in self._index:
+                return
+            self._db.execute(
+                'UPDATE presets SET preview = ? WHERE name = ?',
+                (json.dumps(preview), name),
+            )
+            self._previews[name] = preview
+
+    def delete(self, name: str) -> bool:
+        """Delete a preset, returning whether it existed"""
+        with self._lock:
+            if name not in self._index:
+                return False
+            self._db.execute('DELETE FROM presets WHERE name = ?', (name,))
+            del self._index[name]
+            self._previews.pop(name, None)
+            return True
+
+    def migrate(self, storage: MutableMapping[str, Any]) -> int:
+        """Move presets stored as top-level keys of a NiceGUI storage dict
+        (how presets used to be saved) into the store
+
+        Returns the number of presets moved.
+        """
+        moved = 0
+        for name, value in list(storage.items()):
+            if not isinstance(value, (Mapping, LightBoardPreset)):
+                continue  # not a preset
+            data = None
+            if isinstance(value, Mapping):
+                if 'lights' not in value:  # kept as it was (see above)
+                    data = {**value, 'name': value.get('name') or name}
+                try:
+                    value = LightBoardPreset.from_dict(value, self.legacy_ids)
+                except (TypeError, AttributeError):  # not a preset
+                    continue
+                if not value.lights:
+                    continue
+            value.name = value.name or name
+            with self._lock:
+                self._write(value, None, self._index, self._previews, data)
+            del storage[name]
+            moved += 1
+        return moved
+
+    def set_legacy_ids(self, legacy_ids: Sequence[int]) -> None:
+        """Give presets from older versions to the lights in `legacy_ids`
+        instead (e.g. once the lights' IDs have been looked up)"""
+        with self._lock:
+            self.legacy_ids = tuple(legacy_ids)
+            for name, data in self._db.execute(
+                'SELECT name, data FROM presets'
+            ).fetchall():
+                if 'lights' not in (data := json.loads(data)):
+                    self._index[name] = LightBoardPreset.from_dict(
+                        data, self.legacy_ids
+                    )
+
+    def import_file(
+        self,
+        path: Path,
+        on_conflict: Conflict = 'skip',
+        new_name: Callable[[], str | None] = lambda: None,
+    ) -> dict[str, int]:
+        """Merge the presets in a file into the store
+
+        Presets are read and validated one at a time (see `read_presets`), and
+        all of them are written in a single transaction, so a failed import
+        leaves the store untouched. Other changes wait for the import, and
+        the imported presets only show up once it's committed. A preset
+        whose name is taken is skipped, overwrites the existing one, or is
+        saved under a name from `new_name` (falling back to a numbered copy)
+        depending on `on_conflict`.
+
+        Returns counts of presets 'added', 'overwritten', 'renamed',
+        'skipped' and 'invalid'.
+        """
+        counts = dict.fromkeys(
+            ('added', 'overwritten', 'renamed', 'skipped', 'invalid'), 0
+        )
+        with self._lock, open(path, encoding='utf-8') as file:
+            # imported into copies, swapped in once committed
+            index, previews = dict(self._index), dict(self._previews)
+            self._db.execute('BEGIN')
+            try:
+                for preset in read_presets(file, counts, self.legacy_ids):
+                    name = str(preset.name)
+                    if name not in index:
+                        counts['added'] += 1
+                    elif on_conflict == 'skip':
+                        counts['skipped'] += 1
+                        continue
+                    elif on_conflict == 'overwrite':
+                        counts['overwritten'] += 1
+                    else:
+                        preset.name = _free_name(name, new_name, index)
+                        counts['renamed'] += 1
+                    self._write(preset, None, index, previews)
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._index, self._previews = index, previews
+        return counts
+
+    def export_file(self, path: Path) -> int:
+        """Write every preset to an NDJSON file (one preset per line)
+
+        The file is written next to its destination and moved into place, so
+        an existing file is only ever replaced by a complete export. Returns
+        the number of presets written.
+        """
+        return write_presets(path, self)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def _free_name(
+    name: str,
+    new_name: Callable[[], str | None],
+    taken: Container[str],
+) -> str:
+    """Pick a name not in `taken` for a preset whose name is"""
+    candidate = new_name()
+    if candidate and candidate not in taken:
+        return candidate
+    copy = 2
+    while f'{name} ({copy})' in taken:
+        copy += 1
+    return f'{name} ({copy})'
+
+
+def write_presets(path: Path, presets: Iterable[LightBoardPreset]) -> int:
+    """Atomically write presets to an NDJSON file, returning how many were
+    written"""
+    count = 0
+    with NamedTemporaryFile(
+        'w', encoding='utf-8', dir=path.parent, delete=False, suffix='.tmp'
+    ) as file:
+        try:
+            for preset in presets:
+                file.write(json.dumps(preset.to_dict()) + '\n')
+                count += 1
+            file.flush()
+            os.fsync(file.fileno())
+        except BaseException:
+            file.close()
+            os.unlink(file.name)
+            raise
+    os.replace(file.name, path)
+    return count
+
+
+def read_presets(
+    file: TextIO,
+    counts: dict[str, int] | None = None,
+    legacy_ids: Sequence[int] = LEGACY_LIGHT_IDS,
+) -> Iterator[LightBoardPreset]:
+    """Read presets from a file one at a time, skipping invalid ones
+
+    Understands NDJSON (one preset per line), a JSON array of presets, and a
+    JSON object of presets keyed by name (the format of NiceGUI's
+    storage-general.json, which older versions exported, where anything
+    that isn't an object is another setting and skipped). Invalid presets are
+    counted in `counts['invalid']`, if given. Two-light presets from older
+    versions are given to the lights in `legacy_ids` (with LEGACY_COLOR for
+    a light whose picker was never touched).
+    """
+    for name, data in _iter_json_records(file):
+        try:
+            yield LightBoardPreset.validate(data, name, legacy_ids)
+        except ValueError:
+            if counts is not None:
+                counts['invalid'] = counts.get('invalid', 0) + 1
+
+
+class _JSONStream:
+    """Incremental reader for a stream of JSON values
+
+    Only the part of the file that hasn't been decoded yet is kept in memory,
+    so files of any size can be read with a flat memory footprint.
+    """
+    def __init__(self, file: TextIO, chunk_size: int = 1 << 16) -> None:
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        # position to keep in the buffer, so the reader can rewind to it
+        self.mark: int | None = None
+        self._decoder = json.JSONDecoder()
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character ('' at the end)"""
+        while True:
+            buffer = self.buffer
+            while self.pos < len(buffer) and buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._read():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars: str) -> str:
+        """Consume and return the next character, which must be in `chars`"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f'expected one of {chars!r}, found {char!r}')
+        self.pos += 1
+        return char
+
+    def value(self) -> Any:
+        """Decode and consume the next JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise ValueError('file ended in the middle of a value')
+                continue
+            # a number only ends where something else starts, so one that
+            # runs to the end of what's been read may carry on in the next
+            # chunk (as may its fraction or exponent)
+            if (
+                type(value) in (int, float)
+                and _number_tail.match(self.buffer, end).end()  # type: ignore
+                == len(self.buffer)
+                and self._read()
+            ):
+                continue
+            self.pos = end
+            return value
+
+    def _read(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        # drop what's already been decoded before adding more
+        keep = self.pos if self.mark is None else self.mark
+        self.buffer = self.buffer[keep:] + chunk
+        self.pos -= keep
+        if self.mark is not None:
+            self.mark -= keep
+        self.eof = not chunk
+        return bool(chunk)
+
+
+def _keyed_entry(key: Any, value: Any) -> bool | None:
+    """Whether an entry of a top-level object means the object is keyed by
+    name (True) or is itself a preset (False), or None if it could be
+    either"""
+    if key == 'lights' and isinstance(value, dict) and all(
+        str(light_id).isdigit() for light_id in value
+    ):
+        return False
+    if key in _PRESET_FIELDS and not isinstance(value, dict):
+        return False
+    if isinstance(value, dict) and not _PRESET_FIELDS.isdisjoint(value):
+        return True
+    return None
+
+
+def _iter_json_records(file: TextIO) -> Iterator[tuple[str | None, Any]]:
+    """Yield (name, value) pairs for each record in a JSON or NDJSON file;
+    name is None unless the records are keyed by name"""
+    stream = _JSONStream(file)
+    first = stream.peek()
+    if first == '[':
+        stream.expect('[')
+        if stream.peek() == ']':
+            return
+        while True:
+            yield None, stream.value()
+            if stream.expect(',]') == ']':
+                return
+    if first != '{':
+        if first:
+            raise ValueError(f'expected an object or array, found {first!r}')
+        return
+    # an object is either the first line of NDJSON (a preset) or presets
+    # keyed by name (among other settings), which is decided by reading its
+    # entries until one is a preset's own field or a preset itself
+    stream.mark = stream.pos
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    keyed = None
+    while keyed is None:
+        key = stream.value()
+        stream.expect(':')
+        keyed = _keyed_entry(key, stream.value())
+        if stream.expect(',}') == '}':
+            break
+    stream.pos, stream.mark = stream.mark, None
+    if keyed is not False:  # presets keyed by name
+        stream.expect('{')
+        while True:
+            name = stream.value()
+            stream.expect(':')
+            value = stream.value()
+            if isinstance(value, dict):
+                yield str(name), value
+            if stream.expect(',}') == '}':
+                return
+    while stream.peek():  # NDJSON
+        yield None, stream.value()
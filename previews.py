@@ -0,0 +1,131 @@
+import hashlib
+import json
+
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from typing import Any
+
+import colors
+from presets import LightBoardPreset, PresetStore
+
+# bump when previews are drawn differently, so ones stored by older versions
+# are redrawn instead of used
+PREVIEW_VERSION = 1
+
+# how dark a light at 0% brightness is drawn (a fraction of its color), so
+# dim lights still show their color
+MIN_SHADE = 0.25
+
+
+@dataclass(slots=True)
+class Preview:
+    """How a preset is shown in the preset grid: a gradient through the
+    colors its lights actually show"""
+    key: str  # what the preview was drawn from (see `preview_key`)
+    background: str  # CSS background
+    caption: str
+
+
+def preview_key(
+    preset: LightBoardPreset,
+    gamut_of: Callable[[int], colors.Gamut | None],
+) -> str:
+    """Versioned key for a preset's preview, which changes when anything
+    that's drawn does (but not with the preset's name)"""
+    drawn = [
+        (light_id, setting.color.upper(), setting.brightness,
+         gamut_of(light_id))
+        for light_id, setting in preset.lights.items()
+    ]
+    digest = hashlib.sha1(json.dumps(drawn).encode()).hexdigest()[:16]
+    return f'v{PREVIEW_VERSION}:{digest}'
+
+
+def draw(
+    preset: LightBoardPreset,
+    gamut_of: Callable[[int], colors.Gamut | None],
+) -> Preview:
+    """Draw a preset's preview, with each light's color as its bulb shows
+    it, darkened by its brightness"""
+    stops = []
+    for light_id, setting in preset.lights.items():
+        shown = _shown(setting.color, gamut_of(light_id))
+        shade = MIN_SHADE + (1 - MIN_SHADE) * setting.brightness / 100
+        stops.append(colors.rgb_to_hex(tuple(c * shade for c in shown)))
+    if len(stops) == 1:
+        stops *= 2  # a gradient needs two stops
+    return Preview(
+        key=preview_key(preset, gamut_of),
+        background=f'linear-gradient(90deg, {", ".join(stops)})',
+        caption='Brightness ' + ' / '.join(
+            str(setting.brightness) for setting in preset.lights.values()
+        ),
+    )
+
+
+class PreviewCache:
+    """Preset previews, drawn once and kept by key
+
+    Previews are saved with their presets, so they're only drawn again when
+    the preset, a light's color gamut or PREVIEW_VERSION changes. Presets
+    saved without one (e.g. imported) get theirs the first time they're
+    shown.
+    """
+    def __init__(
+        self,
+        store: PresetStore,
+        gamut_of: Callable[[int], colors.Gamut | None],
+        size: int = 4096,
+    ) -> None:
+        self.store = store
+        self.gamut_of = gamut_of
+        self.size = size
+        self._previews: dict[str, Preview] = {}
+
+    def get(self, preset: LightBoardPreset) -> Preview:
+        """The preview of a preset, drawing (and storing) it if needed"""
+        key = preview_key(preset, self.gamut_of)
+        name = str(preset.name)
+        stored = _stored(self.store.preview(name))
+        if (preview := self._previews.get(key)) is None:
+            if stored and stored['key'] == key:
+                preview = Preview(**stored)
+            else:
+                preview = draw(preset, self.gamut_of)
+            self._remember(preview)
+        # keep the stored preview current, if this is the stored preset
+        if (
+            (not stored or stored['key'] != key)
+            and self.store.get(name) is preset
+        ):
+            self.store.set_preview(name, asdict(preview))
+        return preview
+
+    def save(self, preset: LightBoardPreset) -> None:
+        """Save a preset to the store along with its preview"""
+        self.store.save(preset, preview=asdict(self.get(preset)))
+
+    def _remember(self, preview: Preview) -> None:
+        if len(self._previews) >= self.size:
+            # forget the oldest
+            del self._previews[next(iter(self._previews))]
+        self._previews[preview.key] = preview
+
+
+def _shown(color: str, gamut: colors.Gamut | None) -> colors.RGB:
+    """What a light with `gamut` shows for a preset's color (white, if it
+    isn't a color, so one bad preset can't keep the others from showing)"""
+    try:
+        return colors.hex_to_rgb(colors.preview(color, gamut))
+    except (ValueError, AttributeError):
+        return 1.0, 1.0, 1.0
+
+
+def _stored(data: Any) -> dict[str, Any] | None:
+    """A stored preview (as saved with a preset), if it's readable"""
+    fields = {'key', 'background', 'caption'}
+    if isinstance(data, dict) and data.keys() == fields and all(
+        isinstance(value, str) for value in data.values()
+    ):
+        return data
+    return None
@@ -1,4 +1,10 @@
-from asyncio import run
+import asyncio
+import json
+
+from contextlib import suppress
+from pathlib import Path
+from time import time
+
 import httpx
 
 
@@ -6,23 +12,71 @@ _base_url = 'https://www.dnd5eapi.co/api/2014/'
 _headers = {'Accept': 'application/json'}
 _endpoints = ('magic-items', 'monsters', 'spells')
 
+_basepath = Path(__file__).resolve().parent
+# names fetched from the API are cached on disk so startup never waits on them
+_cache_path = _basepath / '.nicegui' / 'names-cache.json'
+# offline fallback bundled with the app
+_snapshot_path = _basepath / 'static' / 'names.json'
+# how long (in seconds) cached names are considered fresh
+CACHE_TTL = 7 * 24 * 60 * 60
+
+
+def _read_names(path: Path) -> tuple[set[str], float] | None:
+    """Read a names file, returning the names and when they were fetched"""
+    with suppress(OSError, ValueError, KeyError, TypeError):
+        data = json.loads(path.read_text())
+        return set(data['names']), float(data['fetched_at'])
+    return None
+
+
+def _load_names() -> tuple[set[str], float]:
+    """Load names from the on-disk cache, or the bundled snapshot (no network
+    calls are made)"""
+    return (
+        _read_names(_cache_path)
+        or _read_names(_snapshot_path)
+        or (set(), 0.0)
+    )
+
 
 async def _fetch_names() -> set[str]:
-    """Fetch item names from the 5e API endpoints asynchronously."""
+    """Fetch item names from the 5e API endpoints concurrently."""
     _names = set()
-    try:
-        request_tasks = [
-            httpx.get(_base_url + endpoint, headers=_headers)
-            for endpoint in _endpoints
-        ]
-        for response in request_tasks:
-            if response.status_code == 200:
-                _names = _names.union(
-                    {i['name'] for i in response.json().get('results', [])}
-                )
-        return _names
-    except httpx.ConnectError:
-        return set()
+    async with httpx.AsyncClient(
+        base_url=_base_url, headers=_headers
+    ) as client:
+        responses = await asyncio.gather(
+            *(client.get(endpoint) for endpoint in _endpoints),
+            return_exceptions=True,
+        )
+    for response in responses:
+        if isinstance(response, httpx.Response) and response.is_success:
+            _names = _names.union(
+                {i['name'] for i in response.json().get('results', [])}
+            )
+    return _names
+
+
+async def refresh_names(ttl: float = CACHE_TTL) -> None:
+    """Fetch fresh names in the background if the cache is older than `ttl`
+
+    Meant to run once the UI is up; on failure (e.g. no network) the names
+    already loaded are kept.
+    """
+    global fetched_at
+    if time() - fetched_at < ttl:
+        return
+    _names = await _fetch_names()
+    if not _names:
+        return
+    fetched_at = time()
+    # update in place, leaving out names already used by presets
+    names.update(_names - used_names)
+    with suppress(OSError):
+        _cache_path.parent.mkdir(exist_ok=True)
+        _cache_path.write_text(
+            json.dumps({'fetched_at': fetched_at, 'names': sorted(_names)})
+        )
 
 
 def get_dnd() -> str | None:
@@ -35,11 +89,13 @@ def get_dnd() -> str | None:
         return None
 
 
-# run fetch_names coroutine to populate set of names
-names = run(_fetch_names())
+# populate set of names from the cache (or snapshot) without touching the
+# network; call `refresh_names` later to update them
+names, fetched_at = _load_names()
 # track used names so random names can be recycled as presets are deleted
 used_names = set()
 
 
 if __name__ == '__main__':
+    asyncio.run(refresh_names(ttl=0))
     print(names)
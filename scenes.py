@@ -0,0 +1,123 @@
+import colorsys
+import random
+
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass
+from functools import cache
+
+import colors
+from presets import LightBoardPreset, LightSetting
+
+# Random scenes: every light gets a color and brightness picked at random
+# from a theme. Each theme's colors are worked out ahead of time (for each
+# color gamut, leaving out any a bulb can't show), so rolling a scene is
+# just picking from a list.
+
+
+@dataclass(frozen=True, slots=True)
+class Theme:
+    """The colors and brightness of a kind of scene"""
+    hues: tuple[tuple[int, int], ...]  # ranges of hues, in degrees
+    saturation: tuple[float, float]  # range, 0-1
+    brightness: tuple[int, int]  # range, percent
+
+
+THEMES: dict[str, Theme] = {
+    # dim violets with the odd glowing fungus
+    'underdark': Theme(((250, 290), (170, 195)), (0.6, 1.0), (5, 35)),
+    'fire': Theme(((0, 40),), (0.8, 1.0), (50, 100)),
+    # pinks and spring greens
+    'fey': Theme(((290, 340), (80, 140)), (0.4, 0.8), (30, 80)),
+    'frost': Theme(((185, 215),), (0.15, 0.55), (50, 100)),
+    'swamp': Theme(((60, 110),), (0.5, 0.9), (15, 50)),
+    'tavern': Theme(((22, 40),), (0.55, 0.8), (35, 70)),
+}
+
+# saturation levels tried across each theme's range
+SATURATION_STEPS = 4
+# how far (per RGB channel, 0-1) what a bulb shows can be from a color for
+# the color to be in that bulb's palette
+TOLERANCE = 0.1
+
+
+@cache
+def palette(theme: str, gamut: colors.Gamut | None = None) -> tuple[str, ...]:
+    """Every hex color in a theme that a light with `gamut` can show, worked
+    out on first use"""
+    spec = THEMES[theme]
+    low, high = spec.saturation
+    candidates = dict.fromkeys(
+        colors.rgb_to_hex(colorsys.hsv_to_rgb(hue / 360, saturation, 1.0))
+        for start, end in spec.hues
+        for hue in range(start, end + 1)
+        for saturation in (
+            low + (high - low) * step / (SATURATION_STEPS - 1)
+            for step in range(SATURATION_STEPS)
+        )
+    )
+    if not gamut:
+        return tuple(candidates)
+    shown = {color: colors.preview(color, gamut) for color in candidates}
+    showable = tuple(
+        color for color, preview in shown.items()
+        if max(
+            abs(a - b) for a, b in zip(
+                colors.hex_to_rgb(color), colors.hex_to_rgb(preview)
+            )
+        ) <= TOLERANCE
+    )
+    # (or failing that, the closest the bulb can get)
+    return showable or tuple(dict.fromkeys(shown.values()))
+
+
+class SceneGenerator:
+    """Rolls random scenes from the THEMES
+
+    Colors aren't repeated (for lights with the same gamut) until every
+    color in a theme has been used, after which they're all available
+    again. Given a seed, the same rolls give the same scenes.
+    """
+    def __init__(self, seed: int | None = None) -> None:
+        self.rng = random.Random(seed)
+        # positions in each palette not picked yet, by theme and gamut
+        self._unused: dict[tuple[str, colors.Gamut | None], list[int]] = {}
+
+    def prepare(self, gamuts: Iterable[colors.Gamut | None]) -> None:
+        """Work out the palettes of every theme for lights with `gamuts`
+        (e.g. once connected), so the first roll doesn't have to"""
+        for gamut in set(gamuts):
+            for theme in THEMES:
+                palette(theme, gamut)
+
+    def roll(
+        self,
+        theme: str,
+        gamuts: Mapping[int, colors.Gamut | None],
+    ) -> LightBoardPreset:
+        """A random scene in `theme` (in any case) for the lights in
+        `gamuts`, keyed by light ID, named after the theme"""
+        if (name := str(theme).lower()) not in THEMES:
+            raise ValueError(
+                f'There is no theme {theme!r} (try one of '
+                f'{", ".join(THEMES)})'
+            )
+        low, high = THEMES[name].brightness
+        return LightBoardPreset(
+            lights={
+                light_id: LightSetting(
+                    self._pick(name, gamut), self.rng.randint(low, high)
+                )
+                for light_id, gamut in gamuts.items()
+            },
+            name=name.title(),
+        )
+
+    def _pick(self, theme: str, gamut: colors.Gamut | None) -> str:
+        choices = palette(theme, gamut)
+        unused = self._unused.get((theme, gamut))
+        if not unused:  # all used (or none yet); start over
+            unused = self._unused[theme, gamut] = list(range(len(choices)))
+        # swap a random one to the end to take it
+        i = self.rng.randrange(len(unused))
+        unused[i], unused[-1] = unused[-1], unused[i]
+        return choices[unused.pop()]
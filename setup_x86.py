@@ -7,7 +7,11 @@ from main import VERSION
 # - the built app crashes immediately after opening
 
 APP = ['main.py']
-DATA_FILES = [('static', ['static/bg1.jpeg']), '.nicegui']
+DATA_FILES = [
+    ('static', ['static/bg1.jpeg', 'static/names.json']),
+    'lights.json',
+    '.nicegui',
+]
 OPTIONS = {
     'argv_emulation': False,
     'arch': 'x86_64',
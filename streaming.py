@@ -0,0 +1,190 @@
+import asyncio
+import socket
+import struct
+
+from collections.abc import Iterable
+from time import monotonic
+from typing import Protocol
+
+import colors
+
+# Hue Entertainment API (v1) stream messages: a 16 byte header followed by 9
+# bytes per light, sent as UDP datagrams to port 2100 on the bridge
+PROTOCOL = b'HueStream'
+VERSION = (1, 0)
+COLOR_RGB = 0x00
+COLOR_XY = 0x01  # xy + brightness
+PORT = 2100
+_header = struct.Struct('>9s2BB2xB1x')
+_light = struct.Struct('>BH3H')
+_MAX = 0xFFFF
+
+
+def encode(
+    lights: Iterable[tuple[int, colors.XY, int]],
+    sequence: int = 0,
+) -> bytes:
+    """Build a stream message setting each (light ID, xy, bri) in one go"""
+    parts = [_header.pack(PROTOCOL, *VERSION, sequence & 0xFF, COLOR_XY)]
+    for light_id, (x, y), bri in lights:
+        parts.append(_light.pack(
+            0x00,  # device type: light
+            light_id,
+            round(min(max(x, 0.0), 1.0) * _MAX),
+            round(min(max(y, 0.0), 1.0) * _MAX),
+            round(min(max(bri, 0), 254) / 254 * _MAX),
+        ))
+    return b''.join(parts)
+
+
+def decode(message: bytes) -> tuple[int, dict[int, tuple[float, float, int]]]:
+    """Parse a stream message into its sequence number and the (x, y, bri)
+    of each light, raising ValueError if it isn't one"""
+    if len(message) < _header.size:
+        raise ValueError('message too short')
+    protocol, major, _, sequence, space = _header.unpack_from(message)
+    if protocol != PROTOCOL or major != VERSION[0]:
+        raise ValueError('not a HueStream message')
+    if space != COLOR_XY:
+        raise ValueError('only xy + brightness messages are supported')
+    body = message[_header.size:]
+    if len(body) % _light.size:
+        raise ValueError('truncated light data')
+    lights = {}
+    for offset in range(0, len(body), _light.size):
+        _, light_id, x, y, bri = _light.unpack_from(body, offset)
+        lights[light_id] = (x / _MAX, y / _MAX, round(bri / _MAX * 254))
+    return sequence, lights
+
+
+class Transport(Protocol):
+    """Sends stream messages somewhere"""
+    def open(self) -> None: ...
+    def send(self, message: bytes) -> None: ...
+    def close(self) -> None: ...
+
+
+class UDPTransport:
+    """Plain UDP transport
+
+    The bridge itself only accepts stream messages over DTLS (PSK with the
+    client key from registration), which the standard library can't do, so
+    this is for local stand-ins (see `StreamReceiver`) and DTLS proxies. Any
+    object with the same three methods can be passed to the controller
+    instead.
+    """
+    def __init__(self, host: str, port: int = PORT) -> None:
+        self.address = (host, port)
+        self._socket: socket.socket | None = None
+
+    def open(self) -> None:
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def send(self, message: bytes) -> None:
+        if self._socket is None:
+            raise OSError('transport is not open')
+        self._socket.sendto(message, self.address)
+
+    def close(self) -> None:
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class HueStream:
+    """Color frames streamed to the lights of an entertainment group
+
+    Keeps the latest xy and brightness of every streamed light and sends all
+    of them in every message, so a lost datagram is corrected by the next
+    one. The bridge ends a stream that goes quiet for 10 seconds, so
+    `keep_alive` resends the last frame while nothing else is being sent.
+    """
+    def __init__(self, transport: Transport, rate: float = 25.0) -> None:
+        self.transport = transport
+        self.rate = rate  # frames per second the stream is meant to carry
+        self.sent = 0  # messages sent
+        # set if sending failed, after which the stream shouldn't be used
+        self.error: OSError | None = None
+        self._lights: dict[int, tuple[colors.XY, int]] = {}
+        self._sequence = 0
+        self._last_sent = 0.0
+        self._scheduled = False
+
+    def update(
+        self,
+        light_id: int,
+        xy: colors.XY | None = None,
+        bri: int | None = None,
+    ) -> None:
+        """Change the color and/or brightness of a light in the next frame"""
+        old_xy, old_bri = self._lights.get(light_id, ((0.3127, 0.329), 254))
+        self._lights[light_id] = (
+            tuple(xy) if xy is not None else old_xy,  # type: ignore
+            bri if bri is not None else old_bri,
+        )
+
+    def send_soon(self) -> None:
+        """Send a frame once the event loop is free, so updates to several
+        lights made together go out in a single message"""
+        if not self._scheduled:
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self._try_send)
+
+    def _try_send(self) -> None:
+        self._scheduled = False
+        try:
+            self.send()
+        except OSError as e:
+            self.error = e
+
+    def send(self) -> None:
+        """Send a frame with the current state of every light"""
+        self.transport.send(encode(
+            ((light_id, xy, bri)
+             for light_id, (xy, bri) in self._lights.items()),
+            self._sequence,
+        ))
+        self._sequence = (self._sequence + 1) & 0xFF
+        self._last_sent = monotonic()
+        self.sent += 1
+
+    async def keep_alive(self, interval: float = 1.0) -> None:
+        """Resend the current frame whenever the stream has been idle for
+        `interval` seconds (run as a task)"""
+        while True:
+            await asyncio.sleep(interval)
+            if self._lights and monotonic() - self._last_sent >= interval:
+                self._try_send()
+
+
+class StreamReceiver(asyncio.DatagramProtocol):
+    """Local stand-in for a bridge's streaming endpoint, recording the frames
+    it receives"""
+    def __init__(self) -> None:
+        self.frames: list[dict[int, tuple[float, float, int]]] = []
+        self.times: list[float] = []  # monotonic time each frame arrived
+        self.invalid = 0
+        self.received = asyncio.Event()
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        try:
+            self.frames.append(decode(data)[1])
+        except ValueError:
+            self.invalid += 1
+            return
+        self.times.append(monotonic())
+        self.received.set()
+
+    @classmethod
+    async def serve(
+        cls,
+        host: str = '127.0.0.1',
+        port: int = 0,
+    ) -> tuple[asyncio.DatagramTransport, 'StreamReceiver']:
+        """Listen for stream messages; port 0 picks a free port (see
+        `transport.get_extra_info('sockname')`)"""
+        loop = asyncio.get_running_loop()
+        return await loop.create_datagram_endpoint(
+            cls, local_addr=(host, port)
+        )  # type: ignore
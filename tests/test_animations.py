@@ -0,0 +1,106 @@
+import asyncio
+
+from typing import Any
+
+import pytest
+
+from animations import Animator, Frame, Keyframe, Timeline, lightning, plan
+from fakebridge import FakeBridge
+from lights import AsyncLightController
+
+
+def to_state(light: Any, key: Keyframe) -> dict[str, Any]:
+    return {'color': key.color, 'bri': key.brightness}
+
+
+def most_in_a_second(times: list[float]) -> int:
+    """Most commands sent within any one second"""
+    return max(
+        sum(start <= at < start + 1 for at in times) for start in times
+    )
+
+
+@pytest.mark.parametrize('budget', [2.0, 5.0, 10.0])
+def test_plan_stays_within_budget(budget: float) -> None:
+    timeline = lightning(range(4), length=60.0, seed=1)
+    timeline.loop = False
+    frames, dropped = plan(timeline, to_state, budget)
+    times = [frame.at for frame in frames for _ in frame.states]
+    # (the bucket holds a command per light, so a frame can set them all)
+    assert most_in_a_second(times) <= budget + 4
+    assert dropped  # (flashes come faster than that)
+    assert times == sorted(times)
+
+    # merging held back states never loses the final state of a light
+    for light, track in timeline.tracks.items():
+        last = max(track, key=lambda key: key.at)
+        sent = [
+            frame.states[light] for frame in frames if light in frame.states
+        ]
+        assert sent[-1] == to_state(light, last)
+
+
+def test_plan_sends_everything_within_budget() -> None:
+    timeline = Timeline('Steps', tracks={
+        light: [Keyframe(at, '#FF0000', light + at) for at in range(5)]
+        for light in range(3)
+    })
+    frames, dropped = plan(timeline, to_state, budget=3.0)
+    assert dropped == 0
+    assert [frame.at for frame in frames] == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert all(len(frame.states) == 3 for frame in frames)
+    assert isinstance(frames[0], Frame)
+
+
+def test_held_back_states_wait_for_budget() -> None:
+    # every light, twice a second, is twice what the budget allows
+    timeline = Timeline('Pulse', length=1.0, tracks={
+        light: [Keyframe(0.0, brightness=100), Keyframe(0.5, brightness=1)]
+        for light in range(4)
+    })
+    dim = {light: {'color': None, 'bri': 1} for light in range(4)}
+    frames, dropped = plan(timeline, to_state, budget=4.0)
+    # played once, the second frame goes out when there's budget for it
+    assert [frame.at for frame in frames] == [0.0, 1.0]
+    assert frames[1].states == dim and dropped == 0
+
+    # on repeat, there's never budget for it before the next loop's first
+    # frame, which it's merged into (so each loop stays within the budget)
+    timeline.loop = True
+    frames, dropped = plan(timeline, to_state, budget=4.0)
+    assert [frame.at for frame in frames] == [0.0]
+    assert dropped == 1
+
+
+def test_animation_shares_the_write_rate(bridge: FakeBridge) -> None:
+    """Animation frames and writes queued meanwhile (e.g. moving a light
+    card's slider) go out at no more than the write rate between them"""
+    async def main() -> None:
+        lc = AsyncLightController(
+            bridge.address, username=bridge.username, write_rate=10
+        )
+        await lc.ensure_connected()
+        first, second = lc.lights.values()
+        animator = Animator(lc)
+        # all of the budget, on the first light only
+        timeline = Timeline('Ramp', loop=True, length=1.0, tracks={
+            first: [Keyframe(i / 10, brightness=i * 9 + 1) for i in range(10)]
+        })
+        try:
+            bridge.reset_stats()
+            animator.start(timeline)
+            for brightness in range(1, 101):
+                lc.set_brightness(second, brightness)
+                await asyncio.sleep(0.02)
+            animator.stop()
+
+            times = [write.at for write in bridge.writes]
+            assert {write.light_id for write in bridge.writes} == {1, 2}
+            # give or take a burst: the planner's (one command, for the one
+            # light) and a queued write sent just before a frame
+            assert most_in_a_second(times) <= 10 + 2
+        finally:
+            animator.stop()
+            await lc.close()
+
+    asyncio.run(main())
@@ -0,0 +1,38 @@
+import colors
+
+from lights import StateMirror
+
+
+def test_hue_sat_round_trip() -> None:
+    values = [(0, 254), (6929, 129), (21845, 254), (43690, 100), (0, 0)]
+    rgbs = colors.hue_sat_to_rgb(values)
+    assert colors.rgb_to_hex(rgbs[0]) == '#FF0000'
+    assert colors.rgb_to_hex(rgbs[-1]) == '#FFFFFF'
+    for (hue, sat), back in zip(values, colors.rgb_to_hue_sat(rgbs)):
+        assert abs(back[0] - hue) <= 1 and abs(back[1] - sat) <= 1
+
+
+def test_xy_is_clamped_to_gamut() -> None:
+    red = colors.hex_to_rgb('#FF0000')
+    for gamut, corners in colors.GAMUTS.items():
+        x, y = colors.rgb_to_xy([red], gamut)[0]  # type: ignore
+        # pure sRGB red is outside every Hue gamut, so lands on its edge
+        assert abs(x - corners[0][0]) < 0.05 and abs(y - corners[0][1]) < 0.05
+        shown = colors.preview('#FF0000', gamut)  # type: ignore
+        assert shown.startswith('#FF')
+
+
+def test_mirror_shows_color_the_light_reports() -> None:
+    mirror = StateMirror()
+    mirror.update(1, {'xy': [0.6915, 0.3083], 'bri': 254})
+    mirror.set_color(1, '#FF0000')
+    assert mirror.color(1) == '#FF0000'
+
+    # reset to a warm white by hue/sat: no longer the color that was set
+    mirror.update(1, {'hue': 6929, 'sat': 129, 'bri': 254})
+    expected = colors.rgb_to_hex(colors.hue_sat_to_rgb([(6929, 129)])[0])
+    assert mirror.color(1) == expected
+
+    mirror.update(1, {'ct': 366})
+    assert mirror.color(1) is None
+    assert mirror.color(2) is None
@@ -0,0 +1,41 @@
+import json
+
+from pathlib import Path
+
+import pytest
+
+from config import StreamConfig, load_config
+
+
+def write(path: Path, data: dict) -> Path:
+    path.write_text(json.dumps(data))
+    return path
+
+
+def test_streaming_is_opt_in(tmp_path: Path) -> None:
+    path = tmp_path / 'lights.json'
+    assert load_config(write(path, {'bridge': '10.0.42.2'})).stream is None
+
+    config = load_config(write(path, {
+        'bridge': '10.0.42.2', 'stream': {'address': '127.0.0.1:2101'},
+    }))
+    assert config.stream == StreamConfig('127.0.0.1', 2101, 25.0)
+    config = load_config(write(path, {
+        'stream': {'address': 'proxy', 'rate': 50},
+    }))
+    assert config.stream == StreamConfig('proxy', 2100, 50.0)
+
+
+@pytest.mark.parametrize('data', [
+    {'stream': {}},
+    {'stream': {'address': ''}},
+    {'stream': {'address': '127.0.0.1', 'rate': 0}},
+    {'stream': {'address': '127.0.0.1:port'}},
+    {
+        'bridges': [{'name': 'tavern'}, {'name': 'annex'}],
+        'stream': {'address': '127.0.0.1'},
+    },
+])
+def test_invalid_stream(tmp_path: Path, data: dict) -> None:
+    with pytest.raises(ValueError):
+        load_config(write(tmp_path / 'lights.json', data))
@@ -0,0 +1,107 @@
+import asyncio
+
+from pathlib import Path
+
+from fakebridge import FakeBridge
+from journal import CommandJournal
+from lights import AsyncLightController
+
+
+def test_final_states_are_kept(tmp_path: Path) -> None:
+    path = tmp_path / 'journal.ndjson'
+    journal = CommandJournal(path, compact_at=5)
+    journal.record(1, {'on': False, 'transitiontime': 4})
+    for bri in range(0, 250, 50):
+        journal.record(1, {'bri': bri})
+    journal.record(1, {'on': True, 'xy': [0.3, 0.3]})
+    journal.record(1, {'hue': 6929, 'sat': 129})  # replaces the xy color
+    journal.record(2, {'ct': 366})
+    final = {
+        1: {'on': True, 'bri': 200, 'hue': 6929, 'sat': 129},
+        2: {'ct': 366},
+    }
+    assert journal.pending() == final
+    assert journal.recorded == 9
+    # compacted along the way, rather than a line per write
+    assert len(path.read_text().splitlines()) < 9
+
+    # (a line cut short by the app closing is skipped)
+    with path.open('a') as file:
+        file.write('{"light": 2, "state": {"on": tr')
+    assert CommandJournal(path).pending() == final
+
+    journal.clear()
+    assert not path.exists() and not CommandJournal(path).pending()
+
+
+def test_offline_writes_are_replayed(tmp_path: Path) -> None:
+    """Writes made while the bridge is unreachable are sent, once per light,
+    when it's back"""
+    async def main() -> None:
+        bridge = FakeBridge(lights=2).start()
+        lc = AsyncLightController(
+            bridge.address, username=bridge.username, write_rate=100,
+            retries=0, reconnect_delay=0.1,
+            journal_path=tmp_path / 'journal.ndjson',
+        )
+        await lc.ensure_connected()
+        first, second = lc.lights.values()
+        try:
+            host, port = bridge.address.split(':')
+            bridge.stop()
+            await lc.set_state(first, on=False)
+            assert lc.offline
+            for brightness in range(10, 60, 10):
+                lc.set_brightness(first, brightness)
+                await lc.queue.flush()
+            await lc.set_state(first, on=True)
+            await lc.reset_lights()
+            await lc.set_state(second, xy=[0.2, 0.2], on=False)
+            assert len(lc.journal) == 2
+
+            # back (with its lights as they were)
+            bridge = FakeBridge(lights=2, host=host, port=int(port)).start()
+            for _ in range(100):
+                if lc.connected:
+                    break
+                await asyncio.sleep(0.05)
+            assert lc.connected and not lc.journal
+
+            assert sorted(write.light_id for write in bridge.writes) == [1, 2]
+            first_state = bridge.lights['1']['state']
+            assert first_state['on'] is True
+            assert first_state['colormode'] == 'hs'
+            assert (first_state['hue'], first_state['bri']) == (6929, 254)
+            second_state = bridge.lights['2']['state']
+            assert second_state['on'] is False
+            assert second_state['xy'] == [0.2, 0.2]
+            assert not (tmp_path / 'journal.ndjson').exists()
+        finally:
+            await lc.close()
+            bridge.stop()
+
+    asyncio.run(main())
+
+
+def test_journal_is_replayed_after_restart(
+    bridge: FakeBridge, tmp_path: Path
+) -> None:
+    """Writes journaled before the app was closed are sent once it
+    reconnects"""
+    path = tmp_path / 'journal.ndjson'
+    CommandJournal(path).record(2, {'on': False, 'bri': 1})
+
+    async def main() -> None:
+        lc = AsyncLightController(
+            bridge.address, username=bridge.username, journal_path=path
+        )
+        try:
+            await lc.ensure_connected()
+            assert [write.state for write in bridge.writes] == [
+                {'on': False, 'bri': 1}
+            ]
+            assert not path.exists()
+        finally:
+            await lc.close()
+
+    asyncio.run(main())
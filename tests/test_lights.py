@@ -0,0 +1,252 @@
+import asyncio
+
+from config import BridgeConfig, Config, LightConfig
+from fakebridge import FakeBridge
+from lights import AsyncLightController, MultiBridgeController
+
+
+def light_writes(bridge: FakeBridge) -> list[dict]:
+    return [write.state for write in bridge.writes]
+
+
+def test_pick_reset_pick(bridge: FakeBridge) -> None:
+    """Picking a color, resetting and picking it again changes the lights
+    every time (each is a different color mode to the bridge)"""
+    async def main() -> None:
+        lc = AsyncLightController(
+            bridge.address, username=bridge.username, write_rate=100
+        )
+        await lc.ensure_connected()
+        first, second = lc.lights.values()
+        try:
+            for _ in range(2):
+                bridge.reset_stats()
+                lc.set_color(first, '#FF0000')
+                lc.set_color(second, '#0000FF')
+                await lc.queue.flush()
+                assert len(light_writes(bridge)) == 2
+                for light in bridge.lights.values():
+                    assert light['state']['colormode'] == 'xy'
+
+                bridge.reset_stats()
+                await lc.reset_lights()
+                assert light_writes(bridge)
+                for light in bridge.lights.values():
+                    state = light['state']
+                    assert state['colormode'] == 'hs'
+                    assert (state['hue'], state['sat']) == (6929, 129)
+        finally:
+            await lc.close()
+
+    asyncio.run(main())
+
+
+def test_unchanged_writes_are_skipped(bridge: FakeBridge) -> None:
+    async def main() -> None:
+        lc = AsyncLightController(
+            bridge.address, username=bridge.username, write_rate=100
+        )
+        await lc.ensure_connected()
+        first, _ = lc.lights.values()
+        try:
+            lc.set_color(first, '#FF0000')
+            await lc.queue.flush()
+            bridge.reset_stats()
+            lc.mirror.skipped = 0
+            lc.set_color(first, '#FF0000')
+            lc.set_brightness(first, lc.brightness_of(first))
+            await lc.queue.flush()
+            assert not bridge.writes
+            assert lc.mirror.skipped == 1  # (both merged into one write)
+
+            # only what changed is sent
+            lc.set_color(first, '#FF0000')
+            lc.set_brightness(first, 10)
+            await lc.queue.flush()
+            assert light_writes(bridge) == [{'bri': 25}]
+        finally:
+            await lc.close()
+
+    asyncio.run(main())
+
+
+def test_group_action_skips_nothing(bridge: FakeBridge) -> None:
+    """Lights that already look right aren't counted as skipped when the
+    group action sets them anyway"""
+    async def main() -> None:
+        lc = AsyncLightController(
+            bridge.address, username=bridge.username, write_rate=100
+        )
+        await lc.ensure_connected()
+        first, second = lc.lights.values()
+        try:
+            lc.set_color(first, '#0000FF')
+            await lc.queue.flush()
+            bridge.reset_stats()
+            lc.mirror.skipped = 0
+            state = lc.to_state('#0000FF', 100, first)
+            await lc.apply_scene({first: state, second: state})
+            assert bridge.requests['PUT group action'] == 1
+            assert lc.mirror.skipped == 0
+
+            bridge.reset_stats()
+            await lc.apply_scene({first: state, second: state})
+            assert not bridge.writes
+            assert lc.mirror.skipped == 2
+        finally:
+            await lc.close()
+
+    asyncio.run(main())
+
+
+def test_queued_writes_are_merged(bridge: FakeBridge) -> None:
+    """Writes queued for a light before it's sent to are sent as one, with
+    the latest value of each attribute"""
+    async def main() -> None:
+        lc = AsyncLightController(
+            bridge.address, username=bridge.username, write_rate=10
+        )
+        await lc.ensure_connected()
+        first, second = lc.lights.values()
+        try:
+            bridge.reset_stats()
+            with lc.queue.hold():
+                for brightness in range(10, 60, 10):
+                    lc.set_brightness(first, brightness)
+                lc.set_color(first, '#00FF00')
+                lc.set_brightness(second, 20)
+            await lc.queue.flush()
+            assert lc.queue.coalesced == 5
+            writes = {write.light_id: write.state for write in bridge.writes}
+            assert len(bridge.writes) == 2
+            assert writes[first.light_id]['bri'] == 127
+            assert 'xy' in writes[first.light_id]
+            assert writes[second.light_id] == {'bri': 50}
+        finally:
+            await lc.close()
+
+    asyncio.run(main())
+
+
+def test_writes_are_rate_limited(bridge: FakeBridge) -> None:
+    """However fast the sliders move, the queue sends no more than
+    `write_rate` writes per second (over every light)"""
+    async def main() -> None:
+        lc = AsyncLightController(
+            bridge.address, username=bridge.username, write_rate=20
+        )
+        await lc.ensure_connected()
+        first, second = lc.lights.values()
+        try:
+            bridge.reset_stats()
+            for brightness in range(1, 41):
+                lc.set_brightness(first, brightness)
+                lc.set_brightness(second, 100 - brightness)
+                await asyncio.sleep(0.01)
+            while lc.queue.depth:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.1)  # (the last one on its way)
+
+            times = [write.at for write in bridge.writes]
+            assert 10 <= len(times) < 80
+            gaps = [b - a for a, b in zip(times, times[1:])]
+            assert min(gaps) >= 1 / 20 * 0.8  # (timer slack)
+            # every light got its final state
+            assert bridge.lights['1']['state']['bri'] == 101
+            assert bridge.lights['2']['state']['bri'] == 152
+        finally:
+            await lc.close()
+
+    asyncio.run(main())
+
+
+def test_scenes_are_stored_once(bridge: FakeBridge) -> None:
+    """Different states for each light are set by recalling a scene, which
+    is stored on the bridge the first time (and again if it's recycled)"""
+    async def main() -> None:
+        lc = AsyncLightController(
+            bridge.address, username=bridge.username, write_rate=100
+        )
+        await lc.ensure_connected()
+        first, second = lc.lights.values()
+        first_up = {first: {'bri': 254}, second: {'bri': 10}}
+        second_up = {first: {'bri': 10}, second: {'bri': 254}}
+        try:
+            bridge.reset_stats()
+            for states in (first_up, second_up, first_up, second_up):
+                await lc.apply_scene(states)
+            assert bridge.requests['POST scenes'] == 2
+            assert bridge.requests['PUT group action'] == 4
+            assert {write.via for write in bridge.writes} == {'scene'}
+
+            bridge.scenes.clear()  # recycled by the bridge
+            bridge.reset_stats()
+            await lc.apply_scene(first_up)
+            assert bridge.requests['POST scenes'] == 1
+            assert bridge.lights['2']['state']['bri'] == 10
+        finally:
+            await lc.close()
+
+    asyncio.run(main())
+
+
+def test_bridges_join_when_they_connect(bridge: FakeBridge) -> None:
+    """The lights on a bridge that can't be reached at first are added once
+    it connects, and a bridge dropping off and coming back keeps its
+    lights"""
+    async def main() -> None:
+        annex = FakeBridge(lights=1, username=bridge.username).start()
+        host, port = annex.address.split(':')
+        annex.stop()
+        lc = MultiBridgeController(
+            Config(
+                bridges=(
+                    BridgeConfig('tavern', bridge.address),
+                    BridgeConfig('annex', annex.address),
+                ),
+                lights=(
+                    LightConfig(1, bridge='tavern'),
+                    LightConfig(2, bridge='tavern'),
+                    LightConfig(3, bridge='annex', bridge_light_id=1),
+                ),
+            ),
+            username=bridge.username, retries=0, reconnect_delay=0.1,
+        )
+
+        async def lights(ids: list[int]) -> None:
+            for _ in range(100):
+                if list(lc.lights) == ids:
+                    return
+                await asyncio.sleep(0.05)
+            assert list(lc.lights) == ids
+
+        try:
+            await lc.ensure_connected()
+            assert list(lc.lights) == [1, 2]
+
+            annex = FakeBridge(
+                lights=1, host=host, port=int(port), username=bridge.username
+            ).start()
+            await lights([1, 2, 3])
+            lc.set_brightness(lc.lights[3], 10)
+            await lc.queue.flush()
+            assert annex.lights['1']['state']['bri'] == 25
+
+            # (writes while it's away are kept for when it's back)
+            annex.stop()
+            await lc.set_state(lc.lights[3], on=False)
+            assert lc.offline and list(lc.lights) == [1, 2, 3]
+            annex = FakeBridge(
+                lights=1, host=host, port=int(port), username=bridge.username
+            ).start()
+            for _ in range(100):
+                if not lc.offline:
+                    break
+                await asyncio.sleep(0.05)
+            assert list(lc.lights) == [1, 2, 3]
+            assert annex.lights['1']['state']['on'] is False
+        finally:
+            await lc.close()
+            annex.stop()
+
+    asyncio.run(main())
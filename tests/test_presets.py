@@ -0,0 +1,112 @@
+import io
+import json
+
+from pathlib import Path
+
+import pytest
+
+from presets import PresetStore, read_presets
+
+CHUNK_SIZES = [1, 2, 3, 4, 5, 7, 8, 13, 21, 52, 104, 105, 106, 107, 4096]
+
+TAVERN = {
+    'name': 'Tavern',
+    'lights': {
+        '1': {'color': '#FF8A1C', 'brightness': 40},
+        '2': {'color': '#FFB46B', 'brightness': 65},
+    },
+}
+CRYPT = {
+    'name': 'Crypt', 'lights': {'3': {'color': '#2B3A67', 'brightness': 5}},
+}
+
+# NiceGUI's storage-general.json as older versions exported it: other
+# settings (numbers that can be split between chunks, among others) around
+# two-light presets, one with a light whose picker was never touched
+STORAGE = {
+    'volume': 12345,
+    'dark_mode': False,
+    'Forest': {
+        'color1': '#228B22', 'brightness1': 70,
+        'color2': '', 'brightness2': 100,
+        'name': 'Forest',
+    },
+    'zoom': 1.25,
+    'Dungeon': {
+        'color1': '#6B6B88', 'brightness1': 12345 % 101,
+        'color2': '#BE3D20', 'brightness2': 3,
+    },
+    'theme': 'drow',
+    'scale': -0.5e3,
+}
+
+
+class Trickle(io.StringIO):
+    """A file that hands over at most `size` characters per read, as a
+    slow stream would"""
+    def __init__(self, text: str, size: int) -> None:
+        super().__init__(text)
+        self.size = size
+
+    def read(self, size: int | None = -1) -> str:
+        return super().read(self.size)
+
+
+def read(text: str, chunk_size: int) -> tuple[list, dict[str, int]]:
+    counts: dict[str, int] = {}
+    return list(read_presets(Trickle(text, chunk_size), counts)), counts
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_keyed_storage(chunk_size: int) -> None:
+    presets, counts = read(json.dumps(STORAGE), chunk_size)
+    assert [preset.name for preset in presets] == ['Forest', 'Dungeon']
+    forest, dungeon = presets
+    assert forest.lights[1].color == '#228B22'
+    assert forest.lights[2].color == '#FFFFFF'  # never touched
+    assert dungeon.lights[1].brightness == 23
+    assert counts.get('invalid', 0) == 0
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_array(chunk_size: int) -> None:
+    text = json.dumps([TAVERN, {'name': 'Bad', 'lights': {}}, CRYPT])
+    presets, counts = read(text, chunk_size)
+    assert [preset.to_dict() for preset in presets] == [TAVERN, CRYPT]
+    assert counts['invalid'] == 1
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_ndjson(chunk_size: int) -> None:
+    # a preset with an extra field first still reads as a line of NDJSON
+    first = {'preview': {'key': 'v1:0'}, **TAVERN}
+    text = '\n'.join(json.dumps(data) for data in (first, CRYPT)) + '\n'
+    presets, counts = read(text, chunk_size)
+    assert [preset.to_dict() for preset in presets] == [TAVERN, CRYPT]
+    assert counts.get('invalid', 0) == 0
+
+
+def test_truncated_file_fails() -> None:
+    with pytest.raises(ValueError):
+        read(json.dumps(STORAGE)[:-20], 7)
+
+
+def test_import_baseline_storage(tmp_path: Path) -> None:
+    """Every preset exported by older versions is imported, untouched
+    lights included, and a failed import changes nothing"""
+    path = tmp_path / 'storage-general.json'
+    path.write_text(json.dumps(STORAGE))
+    store = PresetStore(tmp_path / 'presets.sqlite3')
+    counts = store.import_file(path)
+    assert counts['added'] == 2 and counts['invalid'] == 0
+    assert [preset.name for preset in store] == ['Forest', 'Dungeon']
+
+    path.write_text(json.dumps([CRYPT, TAVERN])[:-10])
+    with pytest.raises(ValueError):
+        store.import_file(path)
+    assert [preset.name for preset in store] == ['Forest', 'Dungeon']
+    store.close()
+
+    store = PresetStore(tmp_path / 'presets.sqlite3')
+    assert len(store) == 2
+    store.close()
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from presets import LightBoardPreset, LightSetting, PresetStore
+from previews import PreviewCache, draw
+
+
+def test_migrated_legacy_preset_with_untouched_light(tmp_path: Path) -> None:
+    """Older versions saved '' as the color of a light whose picker was
+    never touched; such presets still show (with that light white)"""
+    store = PresetStore(tmp_path / 'presets.sqlite3')
+    storage = {
+        'Tavern': {
+            'color1': '#FF8A1C', 'brightness1': 40,
+            'color2': '', 'brightness2': 100,
+            'name': 'Tavern',
+        },
+    }
+    assert store.migrate(storage) == 1
+    preset = store.get('Tavern')
+    assert preset is not None
+    assert preset.lights[2].color == '#FFFFFF'
+
+    preview = PreviewCache(store, lambda light_id: 'C').get(preset)
+    assert preview.background.startswith('linear-gradient(')
+    assert preview.caption == 'Brightness 40 / 100'
+    store.close()
+
+    # and still do after a restart
+    store = PresetStore(tmp_path / 'presets.sqlite3')
+    assert store.get('Tavern').lights[2].color == '#FFFFFF'
+    store.close()
+
+
+def test_draw_falls_back_for_bad_colors() -> None:
+    preset = LightBoardPreset(
+        {1: LightSetting('', 100), 2: LightSetting('#12', 0)}, 'Broken'
+    )
+    preview = draw(preset, lambda light_id: 'C')
+    assert preview.background == 'linear-gradient(90deg, #FFFFFF, #404040)'
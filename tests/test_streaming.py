@@ -0,0 +1,108 @@
+import asyncio
+
+from functools import partial
+
+from animations import Animator, Keyframe, Timeline
+from fakebridge import FakeBridge
+from lights import AsyncLightController
+from streaming import StreamReceiver, UDPTransport, decode, encode
+
+
+def test_messages_round_trip() -> None:
+    message = encode([(1, (0.7, 0.3), 254), (12, (0.15, 0.06), 1)], 300)
+    sequence, lights = decode(message)
+    assert sequence == 300 & 0xFF
+    assert lights.keys() == {1, 12}
+    assert lights[1][2] == 254 and lights[12][2] == 1
+    assert abs(lights[12][0] - 0.15) < 1 / 0xFFFF
+
+
+def test_animation_is_streamed(bridge: FakeBridge) -> None:
+    """An animator given a transport streams the lights while an animation
+    plays, every step of every transition, and stops streaming after"""
+    async def main() -> None:
+        transport, receiver = await StreamReceiver.serve()
+        host, port = transport.get_extra_info('sockname')[:2]
+        lc = AsyncLightController(
+            bridge.address, username=bridge.username, write_rate=10
+        )
+        await lc.ensure_connected()
+        first, second = lc.lights.values()
+        animator = Animator(
+            lc, transport=partial(UDPTransport, host, port), stream_rate=25
+        )
+        # one light fades from red to a dim blue over a second
+        timeline = Timeline('Fade', tracks={
+            first: [
+                Keyframe(0.0, '#FF0000', 100),
+                Keyframe(0.2, '#0000FF', 10, transition=1.0),
+            ],
+        })
+        try:
+            bridge.reset_stats()
+            task = animator.start(timeline)
+            await asyncio.wait_for(receiver.received.wait(), 5)
+            assert lc.streaming
+            group = bridge.groups[str(lc.stream_group_id)]
+            assert group['type'] == 'Entertainment'
+            assert group['stream']['active'] is True
+            await task
+        finally:
+            animator.stop()
+            await lc.close()
+            transport.close()
+
+        # stopped streaming once the animation was over
+        assert not lc.streaming
+        assert group['stream']['active'] is False
+        # (nothing went as requests)
+        assert not bridge.writes
+
+        assert not receiver.invalid
+        # every message carries every light
+        assert all(frame.keys() == {1, 2} for frame in receiver.frames)
+        brightness = [frame[1][2] for frame in receiver.frames]
+        assert brightness[0] == 254 and brightness[-1] == 25
+        # fading down a step at a time, rather than in one go
+        assert brightness == sorted(brightness, reverse=True)
+        assert len(set(brightness)) >= 20
+        blue = lc.to_state('#0000FF', light=first)['xy']
+        x, y, _ = receiver.frames[-1][1]
+        assert abs(x - blue[0]) < 1e-4 and abs(y - blue[1]) < 1e-4
+        assert receiver.frames[-1][2] == receiver.frames[0][2]  # unchanged
+
+        # at the stream's frame rate while fading (holding red before that
+        # needed no more frames)
+        times = receiver.times[1:]
+        rate = (len(times) - 1) / (times[-1] - times[0])
+        assert 20 <= rate <= 30
+
+    asyncio.run(main())
+
+
+def test_stream_falls_back_to_requests(bridge: FakeBridge) -> None:
+    """With a transport that can't be opened, animations are sent as
+    requests like without one"""
+    class Broken(UDPTransport):
+        def open(self) -> None:
+            raise OSError('handshake failed')
+
+    async def main() -> None:
+        lc = AsyncLightController(
+            bridge.address, username=bridge.username, write_rate=10
+        )
+        await lc.ensure_connected()
+        first, _ = lc.lights.values()
+        animator = Animator(lc, transport=partial(Broken, '127.0.0.1', 9))
+        timeline = Timeline('Steps', tracks={
+            first: [Keyframe(0.0, brightness=10), Keyframe(0.2, brightness=20)]
+        })
+        try:
+            bridge.reset_stats()
+            await animator.start(timeline)
+            assert not lc.streaming
+            assert [write.state['bri'] for write in bridge.writes] == [25, 50]
+        finally:
+            await lc.close()
+
+    asyncio.run(main())